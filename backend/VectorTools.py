@@ -1,26 +1,57 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.extras
 import numpy as np
-import pandas as pd
 import os
 import re
 import json
 import glob
+import io
+import struct
+import hashlib
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import TYPE_CHECKING, List, Dict, Any, Tuple, Iterator, Callable, Optional
 from dotenv import load_dotenv
-from langchain_docling.loader import ExportType
-from langchain_docling import DoclingLoader
-from docling.chunking import HybridChunker
-from sentence_transformers import SentenceTransformer
-import torch
+from source_registry import SourceRegistry, source_name
+from reranker import create_reranker
+from telemetry import span, observe, count, run_in_context
 import datetime
 import time
+import threading
+import itertools
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+# Docling (ingestion only) and torch / sentence-transformers (the embedder) are
+# imported where they are first used, so query workers start without them
+if TYPE_CHECKING:
+    from docling.chunking import HybridChunker
+    from docling.document_converter import DocumentConverter
 
 # Load environment variables from .env file
 load_dotenv()
 POSTGRESPASS = os.environ.get("POSTGRESPASS")
 
+# Connection parameters
+CONN_PARAMS = {
+    "host": os.environ.get("POSTGRES_HOST", "localhost"),
+    "port": int(os.environ.get("POSTGRES_PORT", 5432)),
+    "database": os.environ.get("POSTGRES_DB", "postgres"),
+    "user": os.environ.get("POSTGRES_USER", "postgres"),
+    "password": POSTGRESPASS
+}
+
+# Connection pool settings
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 8))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))          # seconds to wait for a free connection
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", 5))        # seconds to open a new connection
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 30000))
+DB_HEALTHCHECK_AFTER = float(os.environ.get("DB_HEALTHCHECK_AFTER", 30)) # ping connections idle longer than this
+
 process_start = time.time()
 
 # Get the directory where this script is located
@@ -28,18 +59,135 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DOC_LOAD_DIR = os.path.join(SCRIPT_DIR, "TempDocumentStore")
 CSV_FILE = os.path.join(SCRIPT_DIR, "LamoniUrls.csv")
 
+# Document name -> URL lookups; mirrored into the sources table when this is on
+SOURCE_REGISTRY_DB = os.environ.get("SOURCE_REGISTRY_DB", "true").lower() == "true"
+source_registry = SourceRegistry(CSV_FILE)
+
 # Constants
 EMBED_MODEL_ID = "BAAI/bge-m3"
-EXPORT_TYPE = ExportType.DOC_CHUNKS
+EMBED_DIM = 1024
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 32))
+COPY_BATCH_SIZE = int(os.environ.get("COPY_BATCH_SIZE", 512))
+
+# Embedder inference runtime (see embedder_runtime.py). Anything but float32 torch is
+# checked against it at load time and replaced by it if the cosine delta is too large.
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")               # torch, onnx or openvino
+EMBED_QUANTIZE = os.environ.get("EMBED_QUANTIZE", "none")              # none or int8
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", 0))                # 0 = runtime default
+EMBED_ONNX_QCONFIG = os.environ.get("EMBED_ONNX_QCONFIG", "avx2")      # avx2, avx512, avx512_vnni or arm64
+EMBED_VALIDATE = os.environ.get("EMBED_VALIDATE", "true").lower() == "true"
+EMBED_MAX_COSINE_DELTA = float(os.environ.get("EMBED_MAX_COSINE_DELTA", 0.02))
+EMBED_EXPORT_DIR = os.environ.get("EMBED_EXPORT_DIR", os.path.join(SCRIPT_DIR, "EmbedderExports"))
+
+# Chunker settings; changing these or the embedding model changes PIPELINE_VERSION,
+# which makes the ingestion manifest treat every document as needing re-ingestion
+CHUNK_MAX_TOKENS = 2000
+CHUNK_OVERLAP_TOKENS = 100
+CHUNK_MIN_TOKENS = 50
+# The trailing version is bumped when chunk metadata changes (v2: document date)
+PIPELINE_VERSION = f"{EMBED_MODEL_ID}|hybrid:{CHUNK_MAX_TOKENS}/{CHUNK_OVERLAP_TOKENS}/{CHUNK_MIN_TOKENS}|v2"
+
+# Vector index settings. The index must use vector_cosine_ops to serve the <=> operator.
+VECTOR_INDEX_NAME = "documents_embedding_idx"
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "hnsw")         # hnsw or ivfflat
+HNSW_M = int(os.environ.get("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 64))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 100))
+HNSW_MAX_EF_SEARCH = 1000                                              # pgvector rejects larger values
+IVFFLAT_PROBES = int(os.environ.get("IVFFLAT_PROBES", 10))
+INDEX_BUILD_MEMORY = os.environ.get("INDEX_BUILD_MEMORY", "512MB")      # maintenance_work_mem for builds
+
+# What the ANN index is built over. The full-precision embedding column is kept either way
+# and the ANN shortlist is rescored against it exactly. "halfvec" halves the index size,
+# "binary" shrinks it 32x and prefilters by Hamming distance (both need pgvector 0.7+).
+VECTOR_STORAGE = os.environ.get("VECTOR_STORAGE", "vector")            # vector, halfvec or binary
+BINARY_RESCORE_FACTOR = int(os.environ.get("BINARY_RESCORE_FACTOR", 10))  # binary shortlist = limit * this
+# storage mode -> (indexed expression, operator class, ORDER BY expression for a %s query vector)
+VECTOR_STORAGE_MODES = {
+    "vector": ("embedding", "vector_cosine_ops", "embedding <=> %s::vector"),
+    "halfvec": (
+        f"(embedding::halfvec({EMBED_DIM}))", "halfvec_cosine_ops",
+        f"embedding::halfvec({EMBED_DIM}) <=> %s::halfvec({EMBED_DIM})"
+    ),
+    "binary": (
+        f"(binary_quantize(embedding)::bit({EMBED_DIM}))", "bit_hamming_ops",
+        f"binary_quantize(embedding)::bit({EMBED_DIM}) <~> binary_quantize(%s::vector)"
+    )
+}
+
+# Hybrid search: each leg (ANN and full-text) returns k * SEARCH_CANDIDATE_FACTOR rows,
+# merged by "rrf" (reciprocal rank fusion) or "weighted" (normalized score blend)
+HYBRID_RATIO = float(os.environ.get("HYBRID_RATIO", 0.5))              # 0.0 = all keyword, 1.0 = all vector
+FUSION_METHOD = os.environ.get("FUSION_METHOD", "rrf")
+RRF_K = int(os.environ.get("RRF_K", 60))
+SEARCH_CANDIDATE_FACTOR = int(os.environ.get("SEARCH_CANDIDATE_FACTOR", 5))
+
+# Lexical leg of hybrid search: "sparse" uses bge-m3's learned sparse weights, computed in
+# the same forward pass as the dense embedding and stored as pgvector sparsevec (0.7+);
+# "fulltext" uses the English tsvector. Sparse falls back to fulltext on older pgvector.
+LEXICAL_LEG = os.environ.get("LEXICAL_LEG", "sparse")
+SPARSE_DIM = 250002                                                    # bge-m3 (XLM-R) vocabulary size
+SPARSE_MAX_TERMS = int(os.environ.get("SPARSE_MAX_TERMS", 256))        # heaviest terms kept per chunk (HNSW allows 1000)
+# Compute missing sparse weights in the background after startup; until every row has
+# them, Postgres searches use the fulltext leg so older rows can still be matched
+SPARSE_AUTO_BACKFILL = os.environ.get("SPARSE_AUTO_BACKFILL", "true").lower() == "true"
+
+# Re-ranking of the fused search candidates: "cross-encoder" or "heuristic".
+# A cross-encoder pass that overruns RERANKER_BUDGET_MS falls back to the heuristic.
+RERANKER = os.environ.get("RERANKER", "cross-encoder")
+RERANKER_MODEL_ID = os.environ.get("RERANKER_MODEL_ID", "BAAI/bge-reranker-base")
+RERANKER_MAX_TOKENS = int(os.environ.get("RERANKER_MAX_TOKENS", 512))    # per (query, chunk) pair
+RERANKER_BUDGET_MS = float(os.environ.get("RERANKER_BUDGET_MS", 1500))
+RERANKER_CACHE_SIZE = int(os.environ.get("RERANKER_CACHE_SIZE", 4096))   # cached (query, chunk id) scores
 
-# Create the chunker for document processing
-chunker = HybridChunker(
-    tokenizer=EMBED_MODEL_ID,
-    max_tokens=2000,
-    overlap_tokens=100,
-    split_by_paragraph=True,
-    min_tokens=50
-)
+# PostgreSQL binary COPY framing: signature, flags field, header extension length
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+
+# Loaded on first use by load_embedding_model() and load_sparse_head()
+_embedding_model = None
+_embedding_runtime = {}
+_embedding_model_lock = threading.Lock()
+_sparse_head = None
+_sparse_skip_ids = set()
+
+# File types convert_file handles (Docling's Markdown, CSV, Word and PDF backends)
+DOCUMENT_EXTENSIONS = (".md", ".csv", ".docx", ".pdf")
+
+# Conversion worker processes for process_documents (1 = convert in this process)
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 1))
+
+# Streaming ingestion: chunks per embed/insert batch, and batches buffered between stages
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 64))
+INGEST_QUEUE_DEPTH = int(os.environ.get("INGEST_QUEUE_DEPTH", 4))
+
+# Created on first use by get_chunker() and get_converter(), once per process
+_chunker = None
+_converter = None
+
+def get_chunker() -> "HybridChunker":
+    """Create the chunker for document processing once per process."""
+    global _chunker
+    if _chunker is None:
+        from docling.chunking import HybridChunker
+
+        _chunker = HybridChunker(
+            tokenizer=EMBED_MODEL_ID,
+            max_tokens=CHUNK_MAX_TOKENS,
+            overlap_tokens=CHUNK_OVERLAP_TOKENS,
+            split_by_paragraph=True,
+            min_tokens=CHUNK_MIN_TOKENS
+        )
+    return _chunker
+
+def get_converter() -> "DocumentConverter":
+    """Create the Docling converter once per process so its models stay loaded."""
+    global _converter
+    if _converter is None:
+        from docling.document_converter import DocumentConverter
+
+        _converter = DocumentConverter()
+    return _converter
 
 def find_url(csv_file, document_name):
     """
@@ -52,239 +200,558 @@ def find_url(csv_file, document_name):
     Returns:
     str: The corresponding URL if found, otherwise None.
     """
+    registry = source_registry if csv_file == source_registry.csv_file else SourceRegistry(csv_file)
+    return registry.lookup(document_name)
 
-    document_name = document_name.replace("c:\\Users\\RODDIXON\\Desktop\\LamoniRodWigit\\backend\\","")
+def document_date(name: str) -> Optional[str]:
+    """
+    Date of a document from its file name, as an ISO "YYYY-MM-DD" string.
+    Recognises 1910-05-12, 1910_05_12, 19100512 and a bare year (taken as
+    January 1st); returns None when the name holds no plausible date.
+    """
+    if not name:
+        return None
+    match = re.search(r"(?<!\d)(1[89]\d\d|20\d\d)[-_.]?(0[1-9]|1[0-2])[-_.]?(0[1-9]|[12]\d|3[01])(?!\d)", name)
+    if match:
+        try:
+            return datetime.date(*(int(part) for part in match.groups())).isoformat()
+        except ValueError:
+            pass
+    match = re.search(r"(?<!\d)(1[89]\d\d|20\d\d)(?!\d)", name)
+    return f"{match.group(1)}-01-01" if match else None
+
+def convert_file(file: str, category: str) -> List[Any]:
+    """
+    Convert and chunk one file with Docling and simplify each chunk's metadata.
+    URLs are filled in afterwards by resolve_source_urls.
+    """
+    from langchain_docling import DoclingLoader
+    from langchain_docling.loader import ExportType
+
+    loader = DoclingLoader(
+        file_path=[file],
+        converter=get_converter(),
+        export_type=ExportType.DOC_CHUNKS,
+        chunker=get_chunker(),
+    )
+    docs = loader.load()
+
+    for doc in docs:
+        # Extract only what we need from the original metadata
+        source_file = None
+        headings = None
+        timestamp = datetime.datetime.now().isoformat()
+        
+        if hasattr(doc, 'metadata') and doc.metadata:
+            if 'source' in doc.metadata:
+                source_file = source_name(doc.metadata['source'])
+            
+            if 'dl_meta' in doc.metadata and 'headings' in doc.metadata['dl_meta']:
+                headings = doc.metadata['dl_meta']['headings'][0] if doc.metadata['dl_meta']['headings'] else None
+
+        # Replace the metadata with simplified version
+        doc.metadata = {
+            'source': source_file,
+            'heading': headings,
+            'scraped_at': timestamp,
+            'date': document_date(source_file),
+            "url": None,
+            "type": category
+        }
 
+    return docs
+
+def resolve_source_urls(docs: List[Any]):
+    """Fill in each chunk's url from the source registry, looking each source up once."""
+    urls = {}
+    for doc in docs:
+        source = doc.metadata.get('source')
+        if source not in urls:
+            urls[source] = source_registry.lookup(source)
+        doc.metadata['url'] = urls[source]
+
+def _convert_file_safely(file: str, category: str) -> Tuple[str, List[Any], str]:
+    """Run convert_file, returning (file, chunks, error) so one bad file can't stop a batch."""
     try:
-      df = pd.read_csv(csv_file)
-      result = df.loc[df.iloc[:, 1] == document_name, df.columns[0]]
-      return result.values[0] if not result.empty else None
+        return file, convert_file(file, category), None
     except Exception as e:
-        print(f"Error: {e}")
-        return None
+        return file, [], f"{type(e).__name__}: {e}"
 
-def process_documents(urlpath, category):
+def _init_conversion_worker():
+    """Warm a conversion worker's converter and chunker before it gets files."""
+    get_converter()
+    get_chunker()
+
+def gather_document_files(urlpath: str) -> List[str]:
+    """List the files in urlpath that process_documents knows how to convert."""
+    files = []
+    for extension in DOCUMENT_EXTENSIONS:
+        files.extend(glob.glob(os.path.join(urlpath, f"*{extension}")))
+    return files
+
+def iter_documents(files: List[str], category: str, workers: int = INGEST_WORKERS) -> Iterator[Tuple[str, List[Any], str]]:
+    """
+    Convert files and yield (file, chunks, error) as each file finishes.
+
+    With workers > 1 files are converted in a process pool, each worker holding
+    its own warm converter and chunker. At most 2 * workers files are in flight
+    so finished chunks don't pile up ahead of the consumer.
+    """
+    if workers <= 1:
+        for file in files:
+            print(f"Loading {Path(file).suffix.lstrip('.').upper()}: {Path(file).name}")
+            yield _convert_file_safely(file, category)
+        return
+
+    # spawn rather than fork: the parent may already hold torch threads and DB connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_conversion_worker) as pool:
+        remaining = iter(files)
+        pending = set()
+        for file in itertools.islice(remaining, 2 * workers):
+            pending.add(pool.submit(_convert_file_safely, file, category))
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    next_file = next(remaining, None)
+                    if next_file is not None:
+                        pending.add(pool.submit(_convert_file_safely, next_file, category))
+        finally:
+            # If the consumer stops early, don't start files nobody will read
+            for future in pending:
+                future.cancel()
+
+def _observe_each(items: Iterator, stage: str) -> Iterator:
+    """Yield from items, recording the time spent producing each one under stage."""
+    while True:
+        start_time = time.time()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        observe(stage, time.time() - start_time)
+        yield item
+
+def process_documents(urlpath, category, workers: int = INGEST_WORKERS):
     """Process and ingest documents into PGvectorstore"""
     print("Starting document ingestion process...")
     
     # Gather all files
-    pdf_files = glob.glob(os.path.join(urlpath, "*.pdf"))
-    md_files = glob.glob(os.path.join(urlpath, "*.md"))
-    docx_files = glob.glob(os.path.join(urlpath, "*.docx"))
-    cvs_files = glob.glob(os.path.join(urlpath, "*.cvs"))
-
-
-    print(f"Processing {len(pdf_files)} PDFs, {len(md_files)} Markdown and {len(docx_files)} DOCX files")
+    files = gather_document_files(urlpath)
+    print(f"Processing {len(files)} files with {max(workers, 1)} conversion worker(s)")
 
     # Load and chunk documents
     all_splits = []
+    for file, docs, error in _observe_each(iter_documents(files, category, workers=workers), "convert"):
+        if error:
+            print(f"Failed to convert {Path(file).name}: {error}")
+            count("convert_error")
+            continue
+        with span("find_url"):
+            resolve_source_urls(docs)
+        count("files_converted")
+        count("chunks_created", len(docs))
+        all_splits.extend(docs)
+    
+    print(f"Total document chunks created: {len(all_splits)}")
 
-    # Process Markdown files
-    for file in md_files:
-        print(f"Loading Markdown: {Path(file).name}")
-        loader = DoclingLoader(
-            file_path=[file],
-            export_type=EXPORT_TYPE,
-            chunker=chunker,
-        )
-        docs = loader.load()
+    return all_splits
 
-        for doc in docs:
-            # Extract only what we need from the original metadata
-            source_file = None
-            headings = None
-            timestamp = datetime.datetime.now().isoformat()
-            
-            if hasattr(doc, 'metadata') and doc.metadata:
-                if 'source' in doc.metadata:
-                    source_file = doc.metadata['source']
-                
-                if 'dl_meta' in doc.metadata and 'headings' in doc.metadata['dl_meta']:
-                    headings = doc.metadata['dl_meta']['headings'][0] if doc.metadata['dl_meta']['headings'] else None
-            
-                source_file = source_file.replace("c:\\Users\\RODDIXON\\Desktop\\LamoniRodWigit\\backend\\TempDocumentStore\\","")
-                url = find_url(CSV_FILE,source_file)
-
-            # Replace the metadata with simplified version
-            doc.metadata = {
-                'source': source_file,
-                'heading': headings,
-                'scraped_at': timestamp,
-                "url": url,
-                "type": category
-            }
+class SparseBackfillRunning(Exception):
+    """Raised by backfill_sparse_embeddings when another backfill is already running."""
 
-        all_splits.extend(docs)
-    
-    # Process CSV files
-    for file in cvs_files:
-        print(f"Loading CSV: {Path(file).name}")
-        loader = DoclingLoader(
-            file_path=[file],
-            export_type=EXPORT_TYPE,
-            chunker=chunker,
-        )
-        docs = loader.load()
 
-        for doc in docs:
-            # Extract only what we need from the original metadata
-            source_file = None
-            headings = None
-            timestamp = datetime.datetime.now().isoformat()
-            
-            if hasattr(doc, 'metadata') and doc.metadata:
-                if 'source' in doc.metadata:
-                    source_file = doc.metadata['source']
-                
-                if 'dl_meta' in doc.metadata and 'headings' in doc.metadata['dl_meta']:
-                    headings = doc.metadata['dl_meta']['headings'][0] if doc.metadata['dl_meta']['headings'] else None
-            
-                source_file = source_file.replace("c:\\Users\\RODDIXON\\Desktop\\LamoniRodWigit\\backend\\TempDocumentStore\\","")
-                url = find_url(CSV_FILE,source_file)
-
-            # Replace the metadata with simplified version
-            doc.metadata = {
-                'source': source_file,
-                'heading': headings,
-                'scraped_at': timestamp,
-                "url": url,
-                "type": category
-            }
+class IngestionCancelled(Exception):
+    """Raised inside ingestion when its should_cancel callback returns True."""
 
-        all_splits.extend(docs)
+def file_content_hash(file: str) -> str:
+    """SHA-256 of a file's bytes, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(file, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    # Process DOCX files
-    for file in docx_files:
-        print(f"Loading DOCX: {Path(file).name}")
-        loader = DoclingLoader(
-            file_path=[file],
-            export_type=EXPORT_TYPE,
-            chunker=chunker,
-        )
-        docs = loader.load()
+def load_embedding_model():
+    """
+    Load the BAAI/bge-m3 SentenceTransformer once and cache it for the process,
+    on the runtime chosen by EMBED_BACKEND / EMBED_QUANTIZE / EMBED_THREADS.
+    """
+    global _embedding_model, _embedding_runtime
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                from embedder_runtime import load_embedder
 
-        for doc in docs:
-            # Extract only what we need from the original metadata
-            source_file = None
-            headings = None
-            timestamp = datetime.datetime.now().isoformat()
-            
-            if hasattr(doc, 'metadata') and doc.metadata:
-                if 'source' in doc.metadata:
-                    source_file = doc.metadata['source']
-                
-                if 'dl_meta' in doc.metadata and 'headings' in doc.metadata['dl_meta']:
-                    headings = doc.metadata['dl_meta']['headings'][0] if doc.metadata['dl_meta']['headings'] else None
-            
-                source_file = source_file.replace(f"c:\\Users\\RODDIXON\\Desktop\\LamoniRodWigit\\backend\\TempDocumentStore\\","")
-                url = find_url(CSV_FILE,source_file)
+                with span("embed_model_load"):
+                    model, _embedding_runtime = load_embedder(
+                        EMBED_MODEL_ID, EMBED_BACKEND, EMBED_QUANTIZE, EMBED_THREADS,
+                        export_dir=EMBED_EXPORT_DIR, onnx_qconfig=EMBED_ONNX_QCONFIG,
+                        validate=EMBED_VALIDATE, max_delta=EMBED_MAX_COSINE_DELTA
+                    )
+                _embedding_model = model
+                print(f"Embedding model loaded ({_embedding_runtime['backend']}/{_embedding_runtime['quantize']})")
+    return _embedding_model
 
-                
-            # Replace the metadata with simplified version
-            doc.metadata = {
-                'source': source_file,
-                'heading': headings,
-                'scraped_at': timestamp,
-                "url": url,
-                "type": category
-            }
+def embedding_runtime() -> Dict[str, Any]:
+    """The embedder's backend, quantization, threads and validation result, once it is loaded."""
+    return dict(_embedding_runtime)
 
-        all_splits.extend(docs)
+def use_embedding_model(model, runtime: Dict[str, Any]):
+    """
+    Make an already loaded model the process's embedder, e.g. to benchmark
+    another runtime through encode_texts. The sparse head is reloaded for it.
+    """
+    global _embedding_model, _embedding_runtime, _sparse_head
+    with _embedding_model_lock:
+        _embedding_model = model
+        _embedding_runtime = runtime
+        _sparse_head = None
 
-    # Process PDF files
-    for file in pdf_files:
-        print(f"Loading PDF: {Path(file).name}")
-        loader = DoclingLoader(
-            file_path=[file],
-            export_type=EXPORT_TYPE,
-            chunker=chunker,
-        )
-        docs = loader.load()
+def load_sparse_head():
+    """
+    Load bge-m3's sparse_linear head, which turns the model's token embeddings
+    into lexical weights, along with the special token ids it must skip.
+    """
+    global _sparse_head, _sparse_skip_ids
+    if _sparse_head is None:
+        import torch
+        from huggingface_hub import hf_hub_download
 
-        for doc in docs:
-            # Extract only what we need from the original metadata
-            source_file = None
-            headings = None
-            timestamp = datetime.datetime.now().isoformat()
-            
-            if hasattr(doc, 'metadata') and doc.metadata:
-                if 'source' in doc.metadata:
-                    source_file = doc.metadata['source']
-                
-                if 'dl_meta' in doc.metadata and 'headings' in doc.metadata['dl_meta']:
-                    headings = doc.metadata['dl_meta']['headings'][0] if doc.metadata['dl_meta']['headings'] else None
-            
-                source_file = source_file.replace(f"c:\\Users\\RODDIXON\\Desktop\\LamoniRodWigit\\backend\\TempDocumentStore\\","")
-                url = find_url(CSV_FILE,source_file)
-
-            # Replace the metadata with simplified version
-            doc.metadata = {
-                'source': source_file,
-                'heading': headings,
-                'scraped_at': timestamp,
-                "url": url,
-                "type": category
-            }
- 
-        all_splits.extend(docs)
-    
-    print(f"Total document chunks created: {len(all_splits)}")
+        model = load_embedding_model()
+        head = torch.nn.Linear(EMBED_DIM, 1)
+        head.load_state_dict(torch.load(hf_hub_download(EMBED_MODEL_ID, "sparse_linear.pt"), map_location="cpu"))
+        head.eval()
+        tokenizer = model.tokenizer
+        _sparse_skip_ids = {
+            tokenizer.cls_token_id, tokenizer.eos_token_id, tokenizer.pad_token_id, tokenizer.unk_token_id
+        }
+        _sparse_head = head.to(model.device)
+    return _sparse_head
 
-    return all_splits
+def _sparse_weights(row: Dict[str, Any]) -> Dict[int, float]:
+    """Token id -> weight for one encoded text: relu(head(token embedding)), max over repeats."""
+    import torch
+
+    with torch.no_grad():
+        weights = torch.relu(_sparse_head(row["token_embeddings"].float())).squeeze(-1)
+        weights = (weights * row["attention_mask"]).tolist()
+    sparse = {}
+    for token_id, weight in zip(row["input_ids"].tolist(), weights):
+        if weight > 0 and token_id not in _sparse_skip_ids and weight > sparse.get(token_id, 0.0):
+            sparse[token_id] = weight
+    if len(sparse) > SPARSE_MAX_TERMS:
+        sparse = dict(sorted(sparse.items(), key=lambda item: item[1], reverse=True)[:SPARSE_MAX_TERMS])
+    return sparse
+
+def encode_texts(texts: List[str], batch_size: int = EMBED_BATCH_SIZE, sparse: bool = True,
+                 stage: str = "embed_batch") -> Tuple[np.ndarray, Optional[List[Dict[int, float]]]]:
+    """
+    Encode texts with BAAI/bge-m3, returning dense embeddings and, if sparse is
+    set, lexical weights from the same forward pass.
+
+    Texts are sorted by length so each batch pads to a similar size, encoded
+    batch_size at a time, and written back in the original order.
+
+    Args:
+        texts: The texts to encode
+        batch_size: How many texts to encode per forward pass
+        sparse: Also return each text's sparse weights (token id -> weight)
+        stage: Name the encoding time is recorded under
+
+    Returns:
+        A C-contiguous float32 array of shape (len(texts), EMBED_DIM), and a list
+        of sparse weight dicts in the same order (None if sparse is off)
+    """
+    start_time = time.time()
+    embeddings = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+    sparse_weights = [None] * len(texts) if sparse else None
+    if not texts:
+        return embeddings, sparse_weights
+
+    model = load_embedding_model()
+    if sparse:
+        import torch
+
+        load_sparse_head()
+
+    # Longest first, so the slowest batches run while memory is still free
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    for batch_start in range(0, len(order), batch_size):
+        batch_idx = order[batch_start:batch_start + batch_size]
+        batch_texts = [texts[i] for i in batch_idx]
+        if not sparse:
+            embeddings[batch_idx] = model.encode(
+                batch_texts,
+                batch_size=batch_size,
+                normalize_embeddings=True,  # Ensure vectors are normalized (important for BGE models)
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            continue
+
+        # output_value=None returns every model output per text: the pooled
+        # sentence embedding plus the token embeddings the sparse head needs
+        rows = model.encode(batch_texts, batch_size=batch_size, output_value=None, show_progress_bar=False)
+        dense = torch.stack([row["sentence_embedding"] for row in rows]).float()
+        embeddings[batch_idx] = torch.nn.functional.normalize(dense, dim=-1).cpu().numpy()
+        for i, row in zip(batch_idx, rows):
+            sparse_weights[i] = _sparse_weights(row)
+
+    observe(stage, time.time() - start_time)
+    count("texts_embedded", len(texts))
+    return embeddings, sparse_weights
+
+def get_embeddings(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    Generate dense embeddings for many texts at once using BAAI/bge-m3.
+
+    Returns:
+        A C-contiguous float32 array of shape (len(texts), EMBED_DIM)
+    """
+    return encode_texts(texts, batch_size, sparse=False)[0]
 
 def get_embedding(text: str) -> List[float]:
     "Generate embedding for text using BAAI/bge-m3"
-    print("Starting document embedding process...")
-    start_time = time.time()
-    
-    # Initialize the model (only done once and cached)
-    if not hasattr(get_embedding, "model"):
-        model_init_start = time.time()
-        # Specifically use the BAAI/bge-m3 model from HuggingFace
-        get_embedding.model = SentenceTransformer(EMBED_MODEL_ID)
-        
-        # Move model to GPU if available
-        if torch.cuda.is_available():
-            get_embedding.model = get_embedding.model.to(torch.device('cuda'))
-        model_init_end = time.time()
-        print(f"TIMING: Embedding model initialization took {model_init_end - model_init_start:.4f} seconds")
-    
-    # Generate embedding
-    # The SentenceTransformer library handles tokenization, encoding, and normalization
-    encode_start = time.time()
-    embedding = get_embedding.model.encode(
-        text,
-        normalize_embeddings=True,  # Ensure vectors are normalized (important for BGE models)
-        convert_to_numpy=True,      # Convert to numpy array for efficiency
-        show_progress_bar=True 
-    )
-    encode_end = time.time()
-    print(f"TIMING: Text encoding took {encode_end - encode_start:.4f} seconds")
-    
-    # Convert to list and return
-    end_time = time.time()
-    print(f"TIMING: get_embedding took {end_time - start_time:.4f} seconds")
+    model = load_embedding_model()
+    with span("embed_query"):
+        # The SentenceTransformer library handles tokenization, encoding, and normalization
+        embedding = model.encode(
+            text,
+            normalize_embeddings=True,  # Ensure vectors are normalized (important for BGE models)
+            convert_to_numpy=True,      # Convert to numpy array for efficiency
+            show_progress_bar=False
+        )
     return embedding.tolist()
 
+def get_query_encoding(text: str, sparse: bool = LEXICAL_LEG == "sparse") -> Tuple[List[float], Optional[Dict[int, float]]]:
+    """Dense embedding and (if sparse) sparse weights of a query, from one forward pass."""
+    if not sparse:
+        return get_embedding(text), None
+    embeddings, sparse_weights = encode_texts([text], sparse=True, stage="embed_query")
+    return embeddings[0].tolist(), sparse_weights[0]
+
+def sparse_to_text(weights: Dict[int, float]) -> str:
+    """Format sparse weights as a pgvector sparsevec literal (indices are 1-based there)."""
+    terms = ",".join(f"{token_id + 1}:{weight:.6g}" for token_id, weight in sorted(weights.items()))
+    return f"{{{terms}}}/{SPARSE_DIM}"
+
+def _encode_sparsevec(weights: Dict[int, float]) -> bytes:
+    """pgvector's binary sparsevec: int32 dim, int32 nnz, int32 unused, sorted 0-based indices, float4 values."""
+    indices = sorted(weights)
+    return (
+        struct.pack("!iii", SPARSE_DIM, len(indices), 0)
+        + np.asarray(indices, dtype=">i4").tobytes()
+        + np.asarray([weights[index] for index in indices], dtype=">f4").tobytes()
+    )
+
+def _encode_copy_rows(ids: List[int], documents: List[str], metadatas: List[Dict], embeddings: np.ndarray,
+                      sparse_embeddings: Optional[List[Dict[int, float]]] = None) -> io.BytesIO:
+    """
+    Encode (id, content, metadata, embedding[, sparse_embedding]) rows in PostgreSQL's
+    binary COPY format.
+
+    jsonb is sent as a version byte followed by the JSON text, and pgvector's
+    vector as int16 dim, int16 unused, then dim big-endian float4 values.
+    """
+    buffer = io.BytesIO()
+    buffer.write(PGCOPY_HEADER)
+    big_endian = np.asarray(embeddings, dtype=">f4")
+    for row, (doc_id, doc, metadata, embedding) in enumerate(zip(ids, documents, metadatas, big_endian)):
+        content = doc.encode("utf-8")
+        meta = b"\x01" + json.dumps(metadata).encode("utf-8")
+        vector = struct.pack("!hh", embedding.shape[0], 0) + embedding.tobytes()
+
+        buffer.write(struct.pack("!h", 4 if sparse_embeddings is None else 5))
+        buffer.write(struct.pack("!ii", 4, doc_id))
+        buffer.write(struct.pack("!i", len(content)))
+        buffer.write(content)
+        buffer.write(struct.pack("!i", len(meta)))
+        buffer.write(meta)
+        buffer.write(struct.pack("!i", len(vector)))
+        buffer.write(vector)
+        if sparse_embeddings is not None:
+            sparse = _encode_sparsevec(sparse_embeddings[row])
+            buffer.write(struct.pack("!i", len(sparse)))
+            buffer.write(sparse)
+    buffer.write(PGCOPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+def fuse_rankings(vector_hits: List[Dict[str, Any]], keyword_hits: List[Dict[str, Any]],
+                  hybrid_ratio: float, method: str = FUSION_METHOD) -> List[Dict[str, Any]]:
+    """
+    Merge the ANN and full-text result lists into one ranking.
+
+    "rrf" scores each document by hybrid_ratio / (RRF_K + vector rank) +
+    (1 - hybrid_ratio) / (RRF_K + keyword rank), so only positions matter.
+    "weighted" min-max normalizes each leg's scores and blends them with the
+    same weights. A document missing from a leg gets nothing from it.
+
+    Args:
+        vector_hits: Rows from the vector leg, best first
+        keyword_hits: Rows from the full-text leg, best first
+        hybrid_ratio: Weight of the vector leg (0.0 = all keyword, 1.0 = all vector)
+        method: "rrf" or "weighted"
+
+    Returns:
+        Documents sorted by fused "score", with each leg's "vector_score" and "keyword_score"
+    """
+    legs = (("vector_score", vector_hits, hybrid_ratio), ("keyword_score", keyword_hits, 1 - hybrid_ratio))
+    fused = {}
+    for score_key, hits, weight in legs:
+        if not hits:
+            continue
+        if method == "weighted":
+            scores = [hit["score"] for hit in hits]
+            low, high = min(scores), max(scores)
+            spread = high - low
+        for rank, hit in enumerate(hits, start=1):
+            doc = fused.get(hit["id"])
+            if doc is None:
+                doc = fused[hit["id"]] = {
+                    "id": hit["id"],
+                    "content": hit["content"],
+                    "metadata": hit["metadata"],
+                    "score": 0.0,
+                    "vector_score": None,
+                    "keyword_score": None
+                }
+            doc[score_key] = hit["score"]
+            if method == "weighted":
+                doc["score"] += weight * ((hit["score"] - low) / spread if spread else 1.0)
+            else:
+                doc["score"] += weight / (RRF_K + rank)
+    return sorted(fused.values(), key=lambda doc: doc["score"], reverse=True)
+
+
 class VectorDB:
-    def __init__(self, conn_params: Dict[str, Any]):
-        """Initialize the vector database with connection parameters."""
+    def __init__(self, conn_params: Dict[str, Any], minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX):
+        """
+        Initialize the vector database with a bounded connection pool.
+
+        At most maxconn connections are open at once; callers that find the pool
+        exhausted wait up to DB_POOL_TIMEOUT seconds for one to be returned.
+        """
         start_time = time.time()
-        self.conn_params = conn_params
-        self.conn = psycopg2.connect(**conn_params)
-        self.setup_database()
-        end_time = time.time()
-        print(f"TIMING: VectorDB initialization took {end_time - start_time:.4f} seconds")
+        self.conn_params = dict(conn_params)
+        self.conn_params.setdefault("connect_timeout", DB_CONNECT_TIMEOUT)
+        self.conn_params.setdefault("options", f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}")
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **self.conn_params)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self.pgvector_version = ()
+        # "sparse" once setup_database has the sparsevec column, else "fulltext"
+        self.lexical_leg = "fulltext"
+        # False while rows loaded before the sparsevec column still lack sparse weights
+        self.sparse_complete = True
+        self._backfill_thread = None
+        # Held by the running backfill, so two can't encode the same rows
+        self._backfill_lock = threading.Lock()
+        # Runs the full-text leg of similarity_search alongside the ANN leg
+        self._search_executor = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix="search-leg")
+        self.reranker = create_reranker(
+            RERANKER, RERANKER_MODEL_ID, RERANKER_MAX_TOKENS, RERANKER_BUDGET_MS / 1000, RERANKER_CACHE_SIZE
+        )
+        try:
+            self.setup_database()
+        except Exception:
+            # Don't leave the pool's connections open behind a failed constructor
+            self.pool.closeall()
+            raise
+        observe("db_init", time.time() - start_time)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a healthy connection from the pool for the duration of a with block.
+
+        Connections left mid-transaction are rolled back and broken connections are
+        closed instead of returned, so one failed request can't poison the next.
+        """
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise TimeoutError(f"No database connection available within {DB_POOL_TIMEOUT} seconds")
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        finally:
+            if conn is not None:
+                self._release(conn)
+            self._slots.release()
+
+    def _checkout(self):
+        """
+        Get a healthy connection from the pool.
+
+        Connections idle longer than DB_HEALTHCHECK_AFTER are pinged first. After
+        a database restart several pooled connections can be dead at once, so a
+        broken connection is discarded and every replacement is pinged as well,
+        until one answers or DB_POOL_TIMEOUT runs out.
+        """
+        deadline = time.time() + DB_POOL_TIMEOUT
+        verify = False
+        while True:
+            conn = None
+            try:
+                conn = self.pool.getconn()
+                idle_for = time.time() - self._last_used.get(id(conn), 0)
+                if verify or conn.closed or idle_for > DB_HEALTHCHECK_AFTER:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    conn.rollback()
+                return conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if conn is not None:
+                    print(f"Discarding broken database connection: {e}")
+                    self._discard(conn)
+                if time.time() >= deadline:
+                    raise
+                verify = True
+                if conn is None:
+                    # Opening a new connection failed; the database may still be starting
+                    time.sleep(min(0.5, max(0.0, deadline - time.time())))
+
+    def _release(self, conn):
+        """Return a connection to the pool, rolling back or closing it as needed."""
+        if not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                pass
+        if conn.closed:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.time()
+        self.pool.putconn(conn)
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self.pool.putconn(conn, close=True)
     
     def setup_database(self):
-        """Set up the necessary database tables and extensions."""
+        """
+        Set up the necessary database tables and extensions.
+
+        Raises the database error if any step fails; the whole migration is
+        rolled back so it can be retried.
+        """
         start_time = time.time()
-        with self.conn.cursor() as cursor:
+        with self.connection() as conn, conn.cursor() as cursor:
             try:
+                # Adding a generated column rewrites the table and index builds scan it,
+                # both of which outlast DB_STATEMENT_TIMEOUT_MS on a real corpus
+                cursor.execute("SET LOCAL statement_timeout = 0")
+
                 # Create pgvector extension if it doesn't exist
                 cursor.execute("""
                 CREATE EXTENSION IF NOT EXISTS vector;
                 """)
+                cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+                self.pgvector_version = tuple(int(part) for part in re.findall(r"\d+", cursor.fetchone()[0]))
                 
                 # Create documents table if it doesn't exist
                 cursor.execute("""
@@ -292,153 +759,408 @@ class VectorDB:
                     id SERIAL PRIMARY KEY,
                     content TEXT NOT NULL,
                     metadata JSONB,
-                    embedding vector(1024)
+                    embedding vector(1024),
+                    content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
                 );
                 """)
+
+                # Migrate tables created before content_tsv existed; this rewrites the
+                # table once to parse every chunk, after which inserts keep it current
+                cursor.execute("""
+                ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_tsv tsvector
+                    GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+                """)
+
+                # Full-text index for the keyword leg of hybrid search
+                cursor.execute("""
+                CREATE INDEX IF NOT EXISTS documents_content_tsv_idx ON documents
+                USING gin (content_tsv);
+                """)
                 
-                # Try to create an index for faster similarity search
-                try:
-                    cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS embedding_idx ON documents 
-                    USING ivfflat (embedding vector_l2_ops)
-                    WITH (lists = 100);
-                    """)
-                except Exception as e:
-                    print(f"Warning: Could not create IVFFlat index: {e}")
-                    print("Creating simple L2 index instead...")
-                    cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS embedding_idx ON documents 
-                    USING btree (embedding);
-                    """)
+                # bge-m3 sparse weights for the lexical leg; rows loaded before the
+                # column existed stay NULL until backfill_sparse_embeddings() runs
+                if LEXICAL_LEG == "sparse":
+                    if self.pgvector_version >= (0, 7):
+                        cursor.execute(f"""
+                        ALTER TABLE documents ADD COLUMN IF NOT EXISTS sparse_embedding sparsevec({SPARSE_DIM});
+                        """)
+                        cursor.execute("""
+                        CREATE INDEX IF NOT EXISTS documents_sparse_idx ON documents
+                        USING hnsw (sparse_embedding sparsevec_ip_ops);
+                        """)
+                        cursor.execute("SELECT EXISTS (SELECT 1 FROM documents WHERE sparse_embedding IS NULL)")
+                        self.sparse_complete = not cursor.fetchone()[0]
+                        self.lexical_leg = "sparse"
+                    else:
+                        print("pgvector 0.7+ is needed for sparse lexical search, using full-text search")
+
+                # Filter columns promoted out of metadata so they can be indexed;
+                # date is an ISO string, which compares in date order
+                cursor.execute("""
+                ALTER TABLE documents
+                    ADD COLUMN IF NOT EXISTS category TEXT GENERATED ALWAYS AS (metadata->>'type') STORED,
+                    ADD COLUMN IF NOT EXISTS source_name TEXT GENERATED ALWAYS AS (lower(metadata->>'source')) STORED,
+                    ADD COLUMN IF NOT EXISTS doc_date TEXT GENERATED ALWAYS AS (metadata->>'date') STORED;
+                """)
+                cursor.execute("""
+                CREATE INDEX IF NOT EXISTS documents_category_idx ON documents (category);
+                CREATE INDEX IF NOT EXISTS documents_source_name_idx ON documents (source_name);
+                CREATE INDEX IF NOT EXISTS documents_doc_date_idx ON documents (doc_date);
+                """)
+                
+                # Ingestion manifest: one row per source document, recording which
+                # content and pipeline version its chunks in documents came from
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_manifest (
+                    source TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    pipeline_version TEXT NOT NULL,
+                    category TEXT,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    ingested_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                """)
+                cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ingest_manifest_hash_idx
+                ON ingest_manifest (content_hash, pipeline_version);
+                """)
+
+                # Document name -> URL, kept alongside the documents
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    name TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                """)
+
+                # Lets a document's chunks be found (and replaced) by content hash
+                cursor.execute("""
+                CREATE INDEX IF NOT EXISTS documents_content_hash_idx
+                ON documents ((metadata->>'content_hash'));
+                """)
+
+                # The old ivfflat index used vector_l2_ops, so the <=> ordering in
+                # similarity_search could never use it. The cosine index is built by
+                # build_vector_index() once there is data to build it from.
+                cursor.execute("""
+                DROP INDEX IF EXISTS embedding_idx;
+                """)
                 
-                self.conn.commit()
+                conn.commit()
             except Exception as e:
                 print(f"Database setup error: {e}")
                 print("If the pgvector extension is not available, please install it first.")
-                self.conn.rollback()
-        end_time = time.time()
-        print(f"TIMING: Database setup took {end_time - start_time:.4f} seconds")
+                conn.rollback()
+                raise
+        observe("db_setup", time.time() - start_time)
     
-    def add_documents(self, documents: List[str], metadatas: List[Dict] = None):
-        """Add documents and their embeddings to the database."""
+    def add_documents(self, documents: List[str], metadatas: List[Dict] = None, batch_size: int = COPY_BATCH_SIZE,
+                      progress: Optional[Callable[[str, int], None]] = None,
+                      should_cancel: Optional[Callable[[], bool]] = None) -> List[int]:
+        """
+        Embed documents and bulk load them into the database with binary COPY.
+
+        Each batch of batch_size chunks is embedded, streamed and committed on its
+        own, so a failure part way through keeps every batch loaded before it.
+
+        Args:
+            progress: Called with ("chunks_embedded", n) and ("rows_inserted", n) per batch
+            should_cancel: Checked before each batch; IngestionCancelled is raised if it returns True
+
+        Returns:
+            The ids of the inserted rows, in the same order as documents
+        """
         if metadatas is None:
             metadatas = [{}] * len(documents)
-        
-        with self.conn.cursor() as cursor:
-            for doc, metadata in zip(documents, metadatas):
-                embedding = get_embedding(doc)
-                # Format the embedding as a PostgreSQL vector using the proper format
-                embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
-                
+
+        start_time = time.time()
+        ids = []
+        for batch_start in range(0, len(documents), batch_size):
+            batch_docs = documents[batch_start:batch_start + batch_size]
+            batch_metas = metadatas[batch_start:batch_start + batch_size]
+            if should_cancel is not None and should_cancel():
+                raise IngestionCancelled(f"Cancelled after {len(ids)} chunks")
+            try:
+                embeddings, sparse_embeddings = encode_texts(batch_docs, sparse=self.lexical_leg == "sparse")
+                if progress is not None:
+                    progress("chunks_embedded", len(batch_docs))
+                ids.extend(self.insert_embedded_documents(batch_docs, batch_metas, embeddings, sparse_embeddings))
+                if progress is not None:
+                    progress("rows_inserted", len(batch_docs))
+            except Exception as e:
+                print(f"Bulk load failed at chunk {batch_start}: {e}")
+                print(f"{len(ids)} chunks from earlier batches were committed")
+                raise
+
+        observe("add_documents", time.time() - start_time)
+        return ids
+
+    def insert_embedded_documents(self, documents: List[str], metadatas: List[Dict], embeddings: np.ndarray,
+                                  sparse_embeddings: Optional[List[Dict[int, float]]] = None) -> List[int]:
+        """
+        Insert one batch of already embedded documents with COPY ... FORMAT binary
+        and commit it. Ids are reserved from the serial sequence up front because
+        COPY cannot return them. sparse_embeddings are only stored when the
+        sparse lexical leg is enabled.
+        """
+        if not documents:
+            return []
+
+        start_time = time.time()
+        with self.connection() as conn, conn.cursor() as cursor:
+            try:
                 cursor.execute(
-                    """
-                    INSERT INTO documents (content, metadata, embedding)
-                    VALUES (%s, %s, %s::vector)
-                    RETURNING id
-                    """,
-                    (doc, json.dumps(metadata), embedding_str)
+                    "SELECT nextval(pg_get_serial_sequence('documents', 'id')) FROM generate_series(1, %s)",
+                    (len(documents),)
                 )
-            
-            self.conn.commit()
+                ids = [row[0] for row in cursor.fetchall()]
+
+                columns = "id, content, metadata, embedding"
+                if self.lexical_leg != "sparse":
+                    sparse_embeddings = None
+                if sparse_embeddings is not None:
+                    columns += ", sparse_embedding"
+                buffer = _encode_copy_rows(ids, documents, metadatas, embeddings, sparse_embeddings)
+                cursor.copy_expert(
+                    f"COPY documents ({columns}) FROM STDIN WITH (FORMAT binary)",
+                    buffer
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        observe("insert", time.time() - start_time)
+        count("rows_inserted", len(ids))
+        return ids
     
-    def similarity_search(self, query: str, k: int = 5, hybrid_ratio: float = 0.5) -> List[Dict[str, Any]]:
+    @property
+    def active_lexical_leg(self) -> str:
+        """
+        The lexical leg searches use right now: "sparse" only once every row has
+        sparse weights, "fulltext" until then (and whenever sparse is disabled).
         """
-        Perform hybrid similarity search (vector + BM25-like) to find documents similar to the query.
+        return "sparse" if self.lexical_leg == "sparse" and self.sparse_complete else "fulltext"
+
+    def similarity_search(self, query: str, k: int = 5, hybrid_ratio: float = None, query_embedding: List[float] = None,
+                          ef_search: int = HNSW_EF_SEARCH, probes: int = IVFFLAT_PROBES,
+                          fusion: str = FUSION_METHOD, filters: Dict[str, Any] = None,
+                          query_sparse: Dict[int, float] = None) -> List[Dict[str, Any]]:
+        """
+        Perform hybrid similarity search (vector + lexical) to find documents similar to the query.
         Returns the top k most similar documents after re-ranking.
+
+        The ANN leg (ordered by embedding distance, so the vector index is used) and
+        the lexical leg each fetch their own top candidates concurrently; the two
+        rankings are then fused. A chunk found by only one leg still competes, so
+        keyword-free matches are no longer dropped. The lexical leg scores bge-m3's
+        sparse weights by inner product (self.active_lexical_leg == "sparse") or falls
+        back to full-text search on content_tsv.
         
         Args:
             query: The query string
             k: The number of results to return
-            hybrid_ratio: Balance between vector and keyword search (0.0 = all keyword, 1.0 = all vector)
+            hybrid_ratio: Balance between vector and keyword search (0.0 = all keyword, 1.0 = all vector),
+                HYBRID_RATIO if not given
+            query_embedding: Precomputed embedding of query, computed here if not given
+            query_sparse: Precomputed sparse weights of query, computed here if needed and not given
+            ef_search: HNSW candidate list size for this query
+            probes: IVFFlat lists to probe for this query
+            fusion: "rrf" or "weighted"
+            filters: Optional restrictions, all of which must hold:
+                category: category name or list of names (the upload category, metadata "type")
+                source: document file name or list of names, case-insensitive
+                date_from, date_to: inclusive ISO date bounds on the document date
         """
         start_time = time.time()
-        # Get vector embedding
-        embed_start = time.time()
-        query_embedding = get_embedding(query)
-        embed_end = time.time()
-        print(f"TIMING: Query embedding generation took {embed_end - embed_start:.4f} seconds")
-        
-        # Prepare query for keyword search - extract meaningful terms
-        keyword_start = time.time()
-        keywords = self._extract_keywords(query)
-        keyword_end = time.time()
-        print(f"TIMING: Keyword extraction took {keyword_end - keyword_start:.4f} seconds")
-        
-        keyword_clause = ""
-        
-        if keywords:
-            # Create a text search query with weights for keyword matching
-            keyword_clause = "ts_rank(to_tsvector('english', content), to_tsquery('english', %s)) * (1 - %s) +"
-        
-        db_query_start = time.time()
-        with self.conn.cursor() as cursor:
-            # Format the query embedding as a PostgreSQL vector
-            query_embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
-            
-            sql_query = f"""
-            SELECT id, content, metadata, 
-                {keyword_clause if keywords else ""} (1 - (embedding <=> %s::vector)) * %s as hybrid_score
-            FROM documents
-            WHERE 1=1
-            """
-            
-            # Add keyword filter for first-stage retrieval if we have keywords
-            # This helps narrow down candidates before vector similarity
-            if keywords:
-                sql_query += " AND to_tsvector('english', content) @@ to_tsquery('english', %s)"
-                
-            sql_query += """
-            ORDER BY hybrid_score DESC
-            LIMIT %s * 5
-            """
-            
-            # Prepare parameters
-            params = []
-            if keywords:
-                params.extend([keywords, hybrid_ratio])
-            params.extend([query_embedding_str, hybrid_ratio if keywords else 1.0])
-            if keywords:
-                params.append(keywords)
-            params.append(k)
-            
-            sql_exec_start = time.time()
-            cursor.execute(sql_query, tuple(params))
-            sql_exec_end = time.time()
-            print(f"TIMING: SQL execution took {sql_exec_end - sql_exec_start:.4f} seconds")
-            
-            # First-stage retrieval results
-            fetch_start = time.time()
-            candidates = []
-            for doc_id, content, metadata, score in cursor.fetchall():
-                candidates.append({
-                    "id": doc_id,
-                    "content": content,
-                    "metadata": metadata,
-                    "score": score
-                })
-            fetch_end = time.time()
-            print(f"TIMING: Result fetching took {fetch_end - fetch_start:.4f} seconds")
-        db_query_end = time.time()
-        print(f"TIMING: Database query total took {db_query_end - db_query_start:.4f} seconds")
-        
-        # Perform re-ranking using cross-encoder scoring or more detailed similarity
-        rerank_start = time.time()
-        reranked_results = self._rerank_results(query, candidates)
-        rerank_end = time.time()
-        print(f"TIMING: Result re-ranking took {rerank_end - rerank_start:.4f} seconds")
+        if hybrid_ratio is None:
+            hybrid_ratio = HYBRID_RATIO
+        hybrid_ratio = min(max(hybrid_ratio, 0.0), 1.0)
+        n_candidates = k * SEARCH_CANDIDATE_FACTOR
+
+        sparse_leg = self.active_lexical_leg == "sparse"
+        keywords = ""
+        if not sparse_leg:
+            # Prepare query for keyword search - extract meaningful terms
+            keywords = self._extract_keywords(query)
+
+        use_keywords = hybrid_ratio < 1 and (sparse_leg or bool(keywords))
+        use_vector = hybrid_ratio > 0 or not use_keywords
+        need_sparse = use_keywords and sparse_leg and query_sparse is None
+
+        # Get vector embedding (and sparse weights, from the same forward pass)
+        if (use_vector and query_embedding is None) or need_sparse:
+            dense, sparse = get_query_encoding(query, sparse=need_sparse)
+            if query_embedding is None:
+                query_embedding = dense
+            if need_sparse:
+                query_sparse = sparse
+        if sparse_leg and not query_sparse:
+            # Nothing but special tokens: there is nothing for the lexical leg to match
+            use_keywords = False
+            use_vector = True
+
+        keyword_future = None
+        if use_keywords and sparse_leg:
+            keyword_future = self._search_executor.submit(
+                run_in_context(self._sparse_candidates, query_sparse, n_candidates, filters)
+            )
+        elif use_keywords:
+            keyword_future = self._search_executor.submit(
+                run_in_context(self._keyword_candidates, keywords, n_candidates, filters)
+            )
+        vector_hits = []
+        if use_vector:
+            vector_hits = self._vector_candidates(query_embedding, n_candidates, ef_search, probes, filters)
+        keyword_hits = keyword_future.result() if keyword_future is not None else []
+
+        candidates = fuse_rankings(vector_hits, keyword_hits, hybrid_ratio, fusion)[:n_candidates]
         
-        end_time = time.time()
-        print(f"TIMING: Total similarity_search function took {end_time - start_time:.4f} seconds")
+        # Re-rank with the cross-encoder, or the keyword heuristic when none is configured
+        with span("rerank"):
+            if self.reranker is not None:
+                reranked_results = self.reranker.rerank(query, candidates, fallback=self._rerank_results)
+            else:
+                reranked_results = self._rerank_results(query, candidates)
+        observe("search", time.time() - start_time)
         
         # Return top-k after re-ranking
         return reranked_results[:k]
 
+    def _filter_clause(self, filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        """
+        Build the WHERE conditions (each starting with AND) and parameters for
+        similarity_search filters, using the promoted, indexed filter columns.
+        """
+        if not filters:
+            return "", []
+        clauses = []
+        params = []
+        category = filters.get("category")
+        if category:
+            clauses.append("category = ANY(%s)")
+            params.append([category] if isinstance(category, str) else list(category))
+        source = filters.get("source")
+        if source:
+            sources = [source] if isinstance(source, str) else list(source)
+            clauses.append("source_name = ANY(%s)")
+            params.append([source_name(name).lower() for name in sources])
+        if filters.get("date_from"):
+            clauses.append("doc_date >= %s")
+            params.append(str(filters["date_from"]))
+        if filters.get("date_to"):
+            clauses.append("doc_date <= %s")
+            params.append(str(filters["date_to"]))
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    def _vector_candidates(self, query_embedding: List[float], limit: int, ef_search: int, probes: int,
+                           filters: Dict[str, Any] = None, storage: str = VECTOR_STORAGE) -> List[Dict[str, Any]]:
+        """
+        Top rows by cosine similarity. The shortlist is ordered on the same expression
+        the ANN index was built over (see VECTOR_STORAGE_MODES) so pgvector can use it,
+        then rescored with exact full-precision cosine distance.
+
+        With filters, the index scan is iterative (on pgvector 0.8+): it keeps scanning
+        until enough rows pass the filter instead of returning whatever survives
+        the first ef_search candidates. Relaxed ordering is restored by the outer sort.
+        """
+        # Format the query embedding as a PostgreSQL vector
+        query_embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
+        filter_sql, filter_params = self._filter_clause(filters)
+        shortlist = self._shortlist_size(limit, storage)
+        with self.connection() as conn, conn.cursor() as cursor:
+            self._set_search_params(cursor, max(ef_search, shortlist), probes, iterative=bool(filter_sql))
+            sql_exec_start = time.time()
+            cursor.execute(
+                self._vector_leg_sql(storage, filter_sql),
+                (*filter_params, query_embedding_str, shortlist, query_embedding_str, query_embedding_str, limit)
+            )
+            rows = cursor.fetchall()
+            observe("vector_leg", time.time() - sql_exec_start)
+        return [
+            {"id": doc_id, "content": content, "metadata": metadata, "score": score}
+            for doc_id, content, metadata, score in rows
+        ]
+
+    @staticmethod
+    def _shortlist_size(limit: int, storage: str) -> int:
+        return limit * BINARY_RESCORE_FACTOR if storage == "binary" else limit
+
+    @staticmethod
+    def _vector_leg_sql(storage: str, filter_sql: str = "") -> str:
+        """
+        Two-stage vector query. Parameters: filter values, query vector, shortlist
+        size, query vector twice more, result limit.
+        """
+        if storage not in VECTOR_STORAGE_MODES:
+            raise ValueError(f"Unknown vector storage mode: {storage}")
+        order_expression = VECTOR_STORAGE_MODES[storage][2]
+        return f"""
+        WITH shortlist AS MATERIALIZED (
+            SELECT id, content, metadata, embedding
+            FROM documents
+            WHERE TRUE{filter_sql}
+            ORDER BY {order_expression}
+            LIMIT %s
+        )
+        SELECT id, content, metadata, 1 - (embedding <=> %s::vector) AS similarity
+        FROM shortlist
+        ORDER BY embedding <=> %s::vector
+        LIMIT %s
+        """
+
+    def _keyword_candidates(self, keywords: str, limit: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Top rows by full-text rank among those matching any keyword (served by the GIN index)."""
+        filter_sql, filter_params = self._filter_clause(filters)
+        with self.connection() as conn, conn.cursor() as cursor:
+            sql_exec_start = time.time()
+            cursor.execute(
+                f"""
+                SELECT id, content, metadata, ts_rank(content_tsv, query) AS rank
+                FROM documents, to_tsquery('english', %s) query
+                WHERE content_tsv @@ query{filter_sql}
+                ORDER BY rank DESC
+                LIMIT %s
+                """,
+                (keywords, *filter_params, limit)
+            )
+            rows = cursor.fetchall()
+            observe("keyword_leg", time.time() - sql_exec_start)
+        return [
+            {"id": doc_id, "content": content, "metadata": metadata, "score": score}
+            for doc_id, content, metadata, score in rows
+        ]
+
+    def _sparse_candidates(self, query_sparse: Dict[int, float], limit: int,
+                           filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Top rows by sparse inner product with the query's lexical weights (HNSW on sparse_embedding)."""
+        query_sparse_str = sparse_to_text(query_sparse)
+        filter_sql, filter_params = self._filter_clause(filters)
+        with self.connection() as conn, conn.cursor() as cursor:
+            self._set_search_params(cursor, max(HNSW_EF_SEARCH, limit), IVFFLAT_PROBES, iterative=bool(filter_sql))
+            sql_exec_start = time.time()
+            cursor.execute(
+                f"""
+                SELECT id, content, metadata, -(sparse_embedding <#> %s::sparsevec) AS score
+                FROM documents
+                WHERE sparse_embedding IS NOT NULL{filter_sql}
+                ORDER BY sparse_embedding <#> %s::sparsevec
+                LIMIT %s
+                """,
+                (query_sparse_str, *filter_params, query_sparse_str, limit)
+            )
+            rows = cursor.fetchall()
+            observe("sparse_leg", time.time() - sql_exec_start)
+        return [
+            {"id": doc_id, "content": content, "metadata": metadata, "score": score}
+            for doc_id, content, metadata, score in rows
+        ]
+
     def _extract_keywords(self, query: str) -> str:
         """
         Extract meaningful keywords from the query for text search.
         Returns a formatted string for PostgreSQL ts_query.
         """
-        start_time = time.time()
         # Remove stop words and special characters
         stop_words = {"a", "an", "the", "and", "or", "but", "is", "are", "in", "on", "at", "to", "for", "with"}
         words = re.findall(r'\b\w+\b', query.lower())
@@ -447,61 +1169,692 @@ class VectorDB:
         keywords = [word for word in words if word not in stop_words and len(word) > 2]
         
         if not keywords:
-            end_time = time.time()
-            print(f"TIMING: _extract_keywords took {end_time - start_time:.4f} seconds (no keywords found)")
             return ""
         
         # Format for PostgreSQL tsquery (word1 | word2 | word3)
-        result = " | ".join(keywords)
-        end_time = time.time()
-        print(f"TIMING: _extract_keywords took {end_time - start_time:.4f} seconds")
-        return result
+        return " | ".join(keywords)
 
     def _rerank_results(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
-        Re-rank the candidate results using a more sophisticated scoring method.
-        This could use a cross-encoder or more detailed similarity calculation.
+        Re-rank the candidate results with a cheap keyword heuristic. Used when no
+        cross-encoder is configured, or when it doesn't answer within its budget.
+
+        The fused score stays the primary sort key: fused RRF scores sit in a
+        narrow band, so multiplying them by keyword bonuses would let repeated
+        query words outrank the best semantic match. The heuristic only breaks
+        ties between equally fused documents.
         """
-        start_time = time.time()
-        # For BAAI/bge-m3, ideally you would use a cross-encoder here
-        # But as a simple implementation, we can use a combination of:
+        # Tie breaker, a combination of:
         # 1. Exact phrase match bonus
         # 2. Keyword density
-        # 3. Original hybrid score
-        
+        query_lower = query.lower()
+        keywords = self._extract_keywords(query).split(" | ")
+
         for doc in candidates:
             content = doc["content"].lower()
-            query_lower = query.lower()
             
             # Exact phrase match bonus (1.5x boost if exact query appears)
             exact_match_bonus = 1.5 if query_lower in content else 1.0
             
             # Keyword density check
-            keywords = self._extract_keywords(query).split(" | ")
             keyword_count = sum(1 for keyword in keywords if keyword in content)
             keyword_density = keyword_count / len(keywords) if keywords else 0
             
-            # Compute final score - original score plus bonuses
-            final_score = doc["score"] * exact_match_bonus * (1 + keyword_density * 0.5)
-            doc["final_score"] = final_score
+            doc["keyword_bonus"] = exact_match_bonus * (1 + keyword_density * 0.5)
+            doc["final_score"] = doc["score"]
         
-        # Sort by final score
-        sorted_results = sorted(candidates, key=lambda x: x.get("final_score", 0), reverse=True)
+        # Sort by fused score, then by keyword bonus
+        return sorted(candidates, key=lambda x: (x["final_score"], x["keyword_bonus"]), reverse=True)
+
+    def load_sources(self) -> Dict[str, str]:
+        """Return every (normalized name -> url) row of the sources table."""
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT name, url FROM sources")
+            return dict(cursor.fetchall())
+
+    def upsert_sources(self, urls: Dict[str, str]):
+        """Insert or update sources rows from a normalized name -> url mapping."""
+        if not urls:
+            return
+        with self.connection() as conn, conn.cursor() as cursor:
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO sources (name, url) VALUES %s
+                ON CONFLICT (name) DO UPDATE SET url = EXCLUDED.url, updated_at = now()
+                WHERE sources.url IS DISTINCT FROM EXCLUDED.url
+                """,
+                list(urls.items())
+            )
+            conn.commit()
+
+    def ingested_hashes(self, content_hashes: List[str], pipeline_version: str = PIPELINE_VERSION) -> set:
+        """Return which of content_hashes are already ingested with this pipeline version."""
+        if not content_hashes:
+            return set()
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT content_hash FROM ingest_manifest WHERE pipeline_version = %s AND content_hash = ANY(%s)",
+                (pipeline_version, list(content_hashes))
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def delete_ingest_chunks(self, content_hash: str, pipeline_version: str = PIPELINE_VERSION) -> int:
+        """Delete chunks left behind by an interrupted ingestion of this content and version."""
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM documents
+                WHERE metadata->>'content_hash' = %s AND metadata->>'pipeline_version' = %s
+                """,
+                (content_hash, pipeline_version)
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def delete_source(self, source: str) -> int:
+        """
+        Remove source from the ingest manifest together with the chunks it was
+        ingested as, in one transaction. Returns the number of chunks deleted.
+        """
+        with self.connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute(
+                    "DELETE FROM ingest_manifest WHERE source = %s RETURNING content_hash, pipeline_version",
+                    (source,)
+                )
+                previous = cursor.fetchone()
+                deleted = 0
+                if previous is not None:
+                    cursor.execute(
+                        """
+                        DELETE FROM documents
+                        WHERE metadata->>'content_hash' = %s AND metadata->>'pipeline_version' = %s
+                        """,
+                        previous
+                    )
+                    deleted = cursor.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return deleted
+
+    def record_ingestion(self, source: str, content_hash: str, category: str, chunk_count: int,
+                         pipeline_version: str = PIPELINE_VERSION) -> int:
+        """
+        Mark source as ingested from content_hash and, in the same transaction,
+        delete the chunks of whatever version of source was ingested before.
+
+        Returns the number of replaced chunks deleted.
+        """
+        with self.connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute(
+                    "SELECT content_hash, pipeline_version FROM ingest_manifest WHERE source = %s FOR UPDATE",
+                    (source,)
+                )
+                previous = cursor.fetchone()
+                replaced = 0
+                if previous is not None and tuple(previous) != (content_hash, pipeline_version):
+                    cursor.execute(
+                        """
+                        DELETE FROM documents
+                        WHERE metadata->>'content_hash' = %s AND metadata->>'pipeline_version' = %s
+                        """,
+                        previous
+                    )
+                    replaced = cursor.rowcount
+
+                cursor.execute(
+                    """
+                    INSERT INTO ingest_manifest (source, content_hash, pipeline_version, category, chunk_count, ingested_at)
+                    VALUES (%s, %s, %s, %s, %s, now())
+                    ON CONFLICT (source) DO UPDATE SET
+                        content_hash = EXCLUDED.content_hash,
+                        pipeline_version = EXCLUDED.pipeline_version,
+                        category = EXCLUDED.category,
+                        chunk_count = EXCLUDED.chunk_count,
+                        ingested_at = EXCLUDED.ingested_at
+                    """,
+                    (source, content_hash, pipeline_version, category, chunk_count)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return replaced
+
+    def _set_search_params(self, cursor, ef_search: int, probes: int, iterative: bool = False):
+        """
+        Apply per-query ANN settings for the current transaction only. iterative
+        turns on iterative index scans for filtered queries where pgvector has
+        them (0.8+); older versions fall back to a plain filtered index scan.
+
+        ef_search is capped at HNSW_MAX_EF_SEARCH. A larger request (e.g. a big
+        binary rescoring shortlist) also turns on iterative scans, so the index
+        keeps returning rows until the query's LIMIT is met.
+        """
+        if ef_search > HNSW_MAX_EF_SEARCH:
+            ef_search = HNSW_MAX_EF_SEARCH
+            iterative = True
+        cursor.execute(
+            "SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+            (str(ef_search), str(probes))
+        )
+        if iterative and self.pgvector_version >= (0, 8):
+            cursor.execute(
+                "SELECT set_config('hnsw.iterative_scan', 'relaxed_order', true), "
+                "set_config('ivfflat.iterative_scan', 'relaxed_order', true)"
+            )
+
+    def backfill_sparse_embeddings(self, batch_size: int = EMBED_BATCH_SIZE * 8) -> Dict[str, Any]:
+        """
+        Compute sparse weights for rows loaded before the sparse lexical leg was
+        enabled. Each batch is committed on its own, so an interrupted backfill
+        picks up where it stopped.
+
+        Raises ValueError if the sparse lexical leg isn't enabled, and
+        SparseBackfillRunning if a backfill (e.g. start_sparse_backfill's) is
+        already running.
+        """
+        if not self._backfill_lock.acquire(blocking=False):
+            raise SparseBackfillRunning("A sparse backfill is already running")
+        try:
+            return self._backfill_sparse(batch_size)
+        finally:
+            self._backfill_lock.release()
+
+    def _backfill_sparse(self, batch_size: int) -> Dict[str, Any]:
+        if self.lexical_leg != "sparse":
+            raise ValueError("Sparse lexical search is not enabled (LEXICAL_LEG=sparse, pgvector 0.7+)")
+
+        start_time = time.time()
+        updated = 0
+        last_id = 0
+        while True:
+            # The connection goes back to the pool while the batch is encoded, which
+            # takes seconds on CPU, so no pool slot or snapshot is held meanwhile
+            with self.connection() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT id, content FROM documents
+                    WHERE id > %s AND sparse_embedding IS NULL ORDER BY id LIMIT %s
+                    """,
+                    (last_id, batch_size)
+                )
+                rows = cursor.fetchall()
+                conn.commit()
+            if not rows:
+                break
+            _, sparse_embeddings = encode_texts([content for _, content in rows], sparse=True)
+            with self.connection() as conn, conn.cursor() as cursor:
+                try:
+                    # Rows deleted while the batch was encoding are simply not matched
+                    psycopg2.extras.execute_values(
+                        cursor,
+                        """
+                        UPDATE documents SET sparse_embedding = v.sparse::sparsevec
+                        FROM (VALUES %s) AS v(id, sparse)
+                        WHERE documents.id = v.id
+                        """,
+                        [(doc_id, sparse_to_text(sparse)) for (doc_id, _), sparse in zip(rows, sparse_embeddings)],
+                        page_size=len(rows)
+                    )
+                    updated += cursor.rowcount
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            last_id = rows[-1][0]
+            print(f"Backfilled sparse weights for {updated} chunks")
+
+        self.sparse_complete = True
         end_time = time.time()
-        print(f"TIMING: _rerank_results took {end_time - start_time:.4f} seconds")
-        return sorted_results
+        observe("sparse_backfill", end_time - start_time)
+        return {"updated": updated, "seconds": end_time - start_time}
+
+    def _sparse_rows_missing(self) -> bool:
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM documents WHERE sparse_embedding IS NULL)")
+            return cursor.fetchone()[0]
+
+    def start_sparse_backfill(self) -> bool:
+        """
+        Run backfill_sparse_embeddings() on a background thread if any rows lack
+        sparse weights. Returns whether a backfill was started (or is running).
+        """
+        if self.lexical_leg != "sparse":
+            return False
+        if self._backfill_thread is not None and self._backfill_thread.is_alive():
+            return True
+        if not self._sparse_rows_missing():
+            self.sparse_complete = True
+            return False
+
+        def backfill():
+            try:
+                self.backfill_sparse_embeddings()
+            except SparseBackfillRunning:
+                print("Sparse backfill is already running")
+            except Exception as e:
+                print(f"Sparse backfill failed: {e}")
+
+        print("Backfilling sparse weights for existing chunks in the background")
+        self._backfill_thread = threading.Thread(target=backfill, name="sparse-backfill", daemon=True)
+        self._backfill_thread.start()
+        return True
+
+    def build_vector_index(self, index_type: str = VECTOR_INDEX_TYPE, rebuild: bool = False,
+                           storage: str = VECTOR_STORAGE) -> Dict[str, Any]:
+        """
+        Create the vector index for a storage mode, or rebuild it, after documents are loaded.
+
+        HNSW keeps itself up to date on insert, so an existing HNSW index is only
+        rebuilt when asked. IVFFlat lists are trained from the rows present at build
+        time, so it is rebuilt whenever the table has grown past what its lists
+        were sized for. A change of index type or storage mode also rebuilds. Rebuilds
+        build a new index concurrently and swap it in, so searches keep working meanwhile.
+        """
+        if storage not in VECTOR_STORAGE_MODES:
+            raise ValueError(f"Unknown vector storage mode: {storage}")
+        if storage != "vector" and self.pgvector_version < (0, 7):
+            raise ValueError(f"{storage} storage needs pgvector 0.7 or later")
+        index_expression, opclass, _ = VECTOR_STORAGE_MODES[storage]
+
+        start_time = time.time()
+        status = self.index_status()
+        row_count = status["row_count"]
+        if row_count == 0:
+            print("Skipping vector index build: documents is empty")
+            return status
+
+        if index_type == "hnsw":
+            options = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}"
+        elif index_type == "ivfflat":
+            lists = self._ivfflat_lists(row_count)
+            options = f"lists = {lists}"
+            current_lists = status.get("options", {}).get("lists")
+            if status["exists"] and status["type"] == "ivfflat" and current_lists:
+                # Retrain once the table has outgrown the current lists by 2x
+                rebuild = rebuild or lists > 2 * int(current_lists)
+        else:
+            raise ValueError(f"Unknown vector index type: {index_type}")
+
+        if status["exists"] and (status["type"] != index_type or status["storage"] != storage or not status["valid"]):
+            rebuild = True
+        if status["exists"] and not rebuild:
+            return status
+
+        target = f"{VECTOR_INDEX_NAME}_new" if status["exists"] else VECTOR_INDEX_NAME
+        with self.connection() as conn:
+            # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cursor:
+                    # Builds over a real archive outlast DB_STATEMENT_TIMEOUT_MS; a cancelled
+                    # concurrent build would leave an INVALID index behind
+                    cursor.execute("SET statement_timeout = 0")
+                    cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (INDEX_BUILD_MEMORY,))
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}_new")
+                    cursor.execute(f"""
+                    CREATE INDEX CONCURRENTLY {target} ON documents
+                    USING {index_type} ({index_expression} {opclass})
+                    WITH ({options})
+                    """)
+                    if target != VECTOR_INDEX_NAME:
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}")
+                        cursor.execute(f"ALTER INDEX {target} RENAME TO {VECTOR_INDEX_NAME}")
+            finally:
+                # Hand the connection back to the pool with its normal session settings
+                if not conn.closed:
+                    try:
+                        with conn.cursor() as cursor:
+                            cursor.execute("RESET statement_timeout")
+                            cursor.execute("RESET maintenance_work_mem")
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        pass
+                conn.autocommit = False
+
+        observe("index_build", time.time() - start_time)
+        print(f"Built {index_type} ({storage}) index over {row_count} rows")
+        return self.index_status()
+
+    @staticmethod
+    def _ivfflat_lists(row_count: int) -> int:
+        """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond."""
+        if row_count <= 1_000_000:
+            return max(1, row_count // 1000)
+        return int(row_count ** 0.5)
+
+    def index_status(self) -> Dict[str, Any]:
+        """Describe the vector index: type, operator class, options, size and validity."""
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM documents")
+            row_count = cursor.fetchone()[0]
+            lexical = {"lexical_leg": self.lexical_leg, "active_lexical_leg": self.active_lexical_leg}
+            if self.lexical_leg == "sparse":
+                # Rows still waiting for backfill_sparse_embeddings()
+                cursor.execute("SELECT COUNT(*) FROM documents WHERE sparse_embedding IS NULL")
+                lexical["sparse_missing"] = cursor.fetchone()[0]
+            cursor.execute("""
+            SELECT am.amname, pg_get_indexdef(i.indexrelid), c.reloptions,
+                   pg_relation_size(i.indexrelid), i.indisvalid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE c.relname = %s
+            """, (VECTOR_INDEX_NAME,))
+            row = cursor.fetchone()
+
+        if row is None:
+            return {"name": VECTOR_INDEX_NAME, "exists": False, "row_count": row_count, **lexical}
+
+        index_type, definition, reloptions, size_bytes, valid = row
+        storage = next((mode for mode, (_, opclass, _) in VECTOR_STORAGE_MODES.items() if opclass in definition), None)
+        return {
+            "name": VECTOR_INDEX_NAME,
+            "exists": True,
+            "type": index_type,
+            "definition": definition,
+            "storage": storage,
+            "cosine": storage is not None,
+            "options": dict(option.split("=", 1) for option in (reloptions or [])),
+            "size_bytes": size_bytes,
+            "valid": valid,
+            "row_count": row_count,
+            **lexical
+        }
+
+    def measure_recall(self, k: int = 10, sample_size: int = 20, ef_search: int = HNSW_EF_SEARCH,
+                       probes: int = IVFFLAT_PROBES, storage: str = VECTOR_STORAGE) -> Dict[str, Any]:
+        """
+        Compare the vector leg for a storage mode against exact search.
+
+        Stored embeddings of sample_size random documents are used as queries. Each
+        is run once through the storage mode's two-stage query and once as an exact
+        full-precision scan with index scans disabled; recall@k is the share of
+        exact neighbours the first also found. When the index was built for another
+        storage mode, the first query scans too, so its recall still shows the
+        quantization loss but its latency is not the indexed latency.
+        """
+        status = self.index_status()
+        approx_sql = self._vector_leg_sql(storage)
+        shortlist = self._shortlist_size(k, storage)
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT embedding::text FROM documents ORDER BY random() LIMIT %s", (sample_size,))
+            queries = [row[0] for row in cursor.fetchall()]
+
+            exact_sql = "SELECT id FROM documents ORDER BY embedding <=> %s::vector LIMIT %s"
+            recalls, index_times, exact_times = [], [], []
+            for query_vector in queries:
+                self._set_search_params(cursor, max(ef_search, shortlist), probes)
+                index_start = time.time()
+                cursor.execute(approx_sql, (query_vector, shortlist, query_vector, query_vector, k))
+                approx = {row[0] for row in cursor.fetchall()}
+                index_times.append(time.time() - index_start)
+
+                cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+                exact_start = time.time()
+                cursor.execute(exact_sql, (query_vector, k))
+                exact = {row[0] for row in cursor.fetchall()}
+                exact_times.append(time.time() - exact_start)
+                conn.rollback()
+
+                recalls.append(len(approx & exact) / len(exact) if exact else 1.0)
+
+        return {
+            "k": k,
+            "queries": len(queries),
+            "storage": storage,
+            "indexed": status["exists"] and status.get("storage") == storage,
+            "ef_search": ef_search,
+            "probes": probes,
+            "recall": float(np.mean(recalls)) if recalls else None,
+            "index_latency_ms": float(np.mean(index_times) * 1000) if index_times else None,
+            "exact_latency_ms": float(np.mean(exact_times) * 1000) if exact_times else None
+        }
+
+    def compare_storage_modes(self, k: int = 10, sample_size: int = 20, ef_search: int = HNSW_EF_SEARCH,
+                              probes: int = IVFFLAT_PROBES) -> Dict[str, Any]:
+        """
+        Report recall@k and latency of every storage mode this pgvector supports,
+        plus the index bytes per row each would need, to help pick VECTOR_STORAGE.
+        """
+        index_bytes_per_row = {"vector": EMBED_DIM * 4, "halfvec": EMBED_DIM * 2, "binary": EMBED_DIM // 8}
+        modes = ["vector"] if self.pgvector_version < (0, 7) else list(VECTOR_STORAGE_MODES)
+        return {
+            mode: dict(
+                self.measure_recall(k, sample_size, ef_search, probes, storage=mode),
+                vector_bytes_per_row=index_bytes_per_row[mode]
+            )
+            for mode in modes
+        }
 
     def get_document_count(self) -> int:
         """Get the total number of documents in the database."""
-        with self.conn.cursor() as cursor:
+        with self.connection() as conn, conn.cursor() as cursor:
             cursor.execute("SELECT COUNT(*) FROM documents")
             return cursor.fetchone()[0]
 
     def close(self):
-        """Close the database connection."""
+        """Close every connection in the pool."""
         start_time = time.time()
-        if self.conn:
-            self.conn.close()
-        end_time = time.time()
-        print(f"TIMING: Database connection close took {end_time - start_time:.4f} seconds")
+        if self.pool and not self.pool.closed:
+            self.pool.closeall()
+        observe("db_close", time.time() - start_time)
+
+class _IngestFile:
+    """Per-file state carried through the streaming ingestion stages."""
+
+    def __init__(self, file: str, content_hash: str):
+        self.source = Path(file).name
+        self.content_hash = content_hash
+        self.ids = []
+        self.started = False
+        self.failed = False
+        self.finished = False
+
+def _put_until_stopped(stage_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """Block on a bounded queue without deadlocking if a downstream stage has died."""
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get_until_stopped(stage_queue: queue.Queue, stop: threading.Event):
+    """Take the next item from a stage queue, or None once the pipeline is stopping."""
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return None
+
+def ingest_files(vector_db: VectorDB, files: List[str], category: str, workers: int = INGEST_WORKERS,
+                 progress: Optional[Callable[[str, int], None]] = None,
+                 should_cancel: Optional[Callable[[], bool]] = None,
+                 batch_size: int = INGEST_BATCH_SIZE, queue_depth: int = INGEST_QUEUE_DEPTH) -> Dict[str, Any]:
+    """
+    Ingest only the files whose content isn't already in the manifest.
+
+    Files are hashed first; any hash already ingested with the current
+    PIPELINE_VERSION (under any file name) is skipped. The rest flow through
+    overlapping stages joined by bounded queues:
+
+        convert/chunk (this thread, optionally a process pool)
+          -> embed (thread, batch_size chunks at a time)
+          -> COPY insert (thread, one commit per batch)
+
+    so memory is bounded by the largest file plus queue_depth batches per
+    stage, and the first batches are searchable while later files are still
+    converting. When a file's last batch lands it is recorded in the manifest,
+    which also removes the chunks of the document's previous version.
+
+    Args:
+        progress: Called with (counter, n) for "files_skipped", "files_converted",
+            "chunks_embedded", "rows_inserted" and "files_ingested"
+        should_cancel: Checked between batches; a cancelled file's partial
+            chunks are removed and the summary is marked cancelled
+    """
+    start_time = time.time()
+    report = progress or (lambda counter, n: None)
+    if SOURCE_REGISTRY_DB:
+        source_registry.attach(vector_db)
+    hashes = {file: file_content_hash(file) for file in files}
+    already_ingested = vector_db.ingested_hashes(list(hashes.values()))
+    to_convert = []
+    skipped = []
+    for file in files:
+        if hashes[file] in already_ingested:
+            skipped.append(Path(file).name)
+        else:
+            # Also catches the same content uploaded twice in one batch
+            already_ingested.add(hashes[file])
+            to_convert.append(file)
+    if skipped:
+        print(f"Skipping {len(skipped)} unchanged file(s): {', '.join(skipped)}")
+        report("files_skipped", len(skipped))
+
+    summary = {
+        "files_ingested": 0,
+        "files_skipped": len(skipped),
+        "chunks_inserted": 0,
+        "chunks_replaced": 0,
+        "errors": [],
+        "cancelled": False
+    }
+    states = []
+    embed_queue = queue.Queue(maxsize=queue_depth)
+    insert_queue = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    stage_errors = []
+
+    def fail(state: _IngestFile, error: Exception):
+        if not state.failed:
+            print(f"Failed to load {state.source}: {error}")
+            summary["errors"].append({"file": state.source, "error": f"{type(error).__name__}: {error}"})
+        state.failed = True
+
+    def embed_stage():
+        try:
+            while True:
+                item = _get_until_stopped(embed_queue, stop)
+                if item is None:
+                    break
+                state, texts, metadatas, last = item
+                embeddings = sparse_embeddings = None
+                if not state.failed and texts:
+                    try:
+                        embeddings, sparse_embeddings = encode_texts(texts, sparse=vector_db.lexical_leg == "sparse")
+                        report("chunks_embedded", len(texts))
+                    except Exception as e:
+                        fail(state, e)
+                batch = (state, texts, metadatas, embeddings, sparse_embeddings, last)
+                if not _put_until_stopped(insert_queue, batch, stop):
+                    return
+        except Exception as e:
+            stage_errors.append(e)
+            stop.set()
+        finally:
+            _put_until_stopped(insert_queue, None, stop)
+
+    def insert_stage():
+        try:
+            while True:
+                item = _get_until_stopped(insert_queue, stop)
+                if item is None:
+                    break
+                state, texts, metadatas, embeddings, sparse_embeddings, last = item
+                if state.failed:
+                    continue
+                try:
+                    if not state.started:
+                        # Clear leftovers from an interrupted run of this same content
+                        vector_db.delete_ingest_chunks(state.content_hash)
+                        state.started = True
+                    if texts:
+                        state.ids.extend(vector_db.insert_embedded_documents(
+                            texts, metadatas, embeddings, sparse_embeddings
+                        ))
+                        report("rows_inserted", len(texts))
+                    if last:
+                        replaced = vector_db.record_ingestion(state.source, state.content_hash, category, len(state.ids))
+                        state.finished = True
+                        summary["files_ingested"] += 1
+                        summary["chunks_inserted"] += len(state.ids)
+                        summary["chunks_replaced"] += replaced
+                        report("files_ingested", 1)
+                except Exception as e:
+                    fail(state, e)
+        except Exception as e:
+            stage_errors.append(e)
+            stop.set()
+
+    embed_thread = threading.Thread(target=embed_stage, name="ingest-embed", daemon=True)
+    insert_thread = threading.Thread(target=insert_stage, name="ingest-insert", daemon=True)
+    embed_thread.start()
+    insert_thread.start()
+
+    try:
+        # Conversion time is measured here, in this process, however many workers convert
+        for file, docs, error in _observe_each(iter_documents(to_convert, category, workers=workers), "convert"):
+            if stop.is_set():
+                break
+            if should_cancel is not None and should_cancel():
+                summary["cancelled"] = True
+                break
+            if error:
+                print(f"Failed to convert {Path(file).name}: {error}")
+                summary["errors"].append({"file": Path(file).name, "error": error})
+                count("convert_error")
+                continue
+            report("files_converted", 1)
+            count("files_converted")
+            count("chunks_created", len(docs))
+
+            with span("find_url"):
+                resolve_source_urls(docs)
+            state = _IngestFile(file, hashes[file])
+            states.append(state)
+            texts = [doc.page_content for doc in docs]
+            metadatas = [
+                dict(doc.metadata, content_hash=state.content_hash, pipeline_version=PIPELINE_VERSION)
+                for doc in docs
+            ]
+            del docs
+
+            # A file with no chunks still sends one (empty, last) batch to be recorded
+            batch_starts = list(range(0, len(texts), batch_size)) or [0]
+            for batch_start in batch_starts:
+                if should_cancel is not None and should_cancel():
+                    summary["cancelled"] = True
+                    break
+                last = batch_start == batch_starts[-1]
+                batch = (state, texts[batch_start:batch_start + batch_size],
+                         metadatas[batch_start:batch_start + batch_size], last)
+                if not _put_until_stopped(embed_queue, batch, stop):
+                    break
+            if summary["cancelled"]:
+                break
+    finally:
+        _put_until_stopped(embed_queue, None, stop)
+        embed_thread.join()
+        insert_thread.join()
+
+        # Anything started but not recorded (cancelled or failed) is removed again
+        for state in states:
+            if state.started and not state.finished:
+                try:
+                    vector_db.delete_ingest_chunks(state.content_hash)
+                except Exception as e:
+                    print(f"Could not remove partial chunks of {state.source}: {e}")
+
+    if stage_errors:
+        raise stage_errors[0]
 
+    observe("ingest_files", time.time() - start_time)
+    return summary
@@ -0,0 +1,139 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class AnswerCache:
+    """
+    LRU/TTL cache of finished answers, looked up either by the normalized query
+    text or by cosine similarity of the query embedding.
+
+    Entries remember the cache generation they were computed in; invalidate()
+    bumps the generation so answers that were in flight during an upload are
+    not stored against the new documents.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.generation = 0
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._matrix_keys = []
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Lowercase, collapse whitespace and drop surrounding punctuation."""
+        query = re.sub(r"\s+", " ", query.lower()).strip()
+        return query.strip(" ?!.,;:¿¡\"'")
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        """Return the cached answer for an exact (normalized) query match."""
+        key = self.normalize(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def get_similar(self, embedding: List[float], language: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached answer whose query embedding is closest to embedding,
+        if it is in the same language and above the similarity threshold.
+        """
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if self._matrix is None:
+                self._rebuild_matrix()
+            if not self._matrix_keys:
+                self.misses += 1
+                return None
+
+            # Embeddings are normalized, so the dot product is the cosine similarity
+            scores = self._matrix @ query_vector
+            for index in np.argsort(-scores):
+                if scores[index] < self.similarity_threshold:
+                    break
+                key = self._matrix_keys[index]
+                entry = self._entries.get(key)
+                if entry is None or entry["language"] != language:
+                    continue
+                if self._expired(entry):
+                    self._remove(key)
+                    continue
+                self._entries.move_to_end(key)
+                self.semantic_hits += 1
+                return entry["value"]
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, embedding: List[float], language: str, value: Dict[str, Any], generation: int = None):
+        """
+        Store an answer. If generation is given and the cache has been
+        invalidated since, the answer is stale and is dropped.
+        """
+        key = self.normalize(query)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = {
+                "value": value,
+                "embedding": np.asarray(embedding, dtype=np.float32),
+                "language": language,
+                "created_at": time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def invalidate(self):
+        """Drop every entry, e.g. after new documents are ingested."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "generation": self.generation
+            }
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] > self.ttl_seconds
+
+    def _remove(self, key: str):
+        del self._entries[key]
+        self.evictions += 1
+        self._matrix = None
+
+    def _rebuild_matrix(self):
+        self._matrix_keys = list(self._entries.keys())
+        if self._matrix_keys:
+            self._matrix = np.stack([self._entries[key]["embedding"] for key in self._matrix_keys])
+        else:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
@@ -1,17 +1,23 @@
-from fastapi import FastAPI, Response, UploadFile, File, Form, Depends, HTTPException, status
+from fastapi import FastAPI, Request, Response, UploadFile, File, Form, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
-from Retrieve import process_query
-from VectorTools import process_documents, VectorDB
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from retrieve import process_query, stream_query, get_vector_db, answer_cache, warm_up
+from VectorTools import VECTOR_INDEX_TYPE, DOCUMENT_EXTENSIONS, SparseBackfillRunning
+from ingest_jobs import IngestJobQueue
+from telemetry import TELEMETRY_ENABLED, observe, start_trace, finish_trace, render_metrics
+import asyncio
 import time
 import os
-import shutil
-from typing import List, Optional
+import queue
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +25,9 @@ POSTGRESPASS = os.environ.get("POSTGRESPASS")
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here")  # Change this in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Load the models, DB pool and Ollama model at startup; /ready stays 503 until that succeeds
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "true").lower() == "true"
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", 10))
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -85,7 +94,58 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     return user
 
-app = FastAPI()
+# Startup progress reported by /ready
+readiness = {"ready": not STARTUP_WARMUP, "started_at": None, "ready_at": None, "steps": {}}
+
+async def run_warmup():
+    """Warm up, retrying failed steps (e.g. Ollama still starting) until all succeed."""
+    readiness["started_at"] = time.time()
+    while True:
+        done = tuple(name for name, step in readiness["steps"].items() if step["ok"])
+        readiness["steps"].update(await warm_up(skip=done))
+        if all(step["ok"] for step in readiness["steps"].values()):
+            readiness["ready"] = True
+            readiness["ready_at"] = time.time()
+            observe("warmup", readiness["ready_at"] - readiness["started_at"])
+            return
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ingest_queue.start()
+    warmup_task = asyncio.create_task(run_warmup()) if STARTUP_WARMUP else None
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await run_in_threadpool(ingest_queue.stop)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Give each request a trace (id returned in X-Trace-Id) and record its duration
+    once the last byte of the body, streamed or not, has been sent. With
+    telemetry off the request passes straight through.
+    """
+    if not TELEMETRY_ENABLED:
+        return await call_next(request)
+    trace = start_trace(request.url.path, request.headers.get("X-Trace-Id"))
+    response = await call_next(request)
+    response.headers["X-Trace-Id"] = trace.id
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    body = response.body_iterator
+
+    async def body_then_finish():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish_trace(trace, request.method, route_path, response.status_code)
+
+    response.body_iterator = body_then_finish()
+    return response
 
 # Add CORS middleware with expanded configuration
 app.add_middleware(
@@ -110,13 +170,64 @@ TEMP_DIR = os.path.join(SCRIPT_DIR, "TempDocumentStore")
 # Ensure temp directory exists
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+def after_ingestion(job):
+    """Runs on the ingestion worker after a job loads new chunks."""
+    vector_db = get_vector_db()
+    # Build the vector index on first load (or retrain IVFFlat lists as the table grows)
+    index_start_time = time.time()
+    vector_db.build_vector_index()
+    observe("index_maintenance", time.time() - index_start_time)
+
+    # Cached answers may not reflect the new documents
+    answer_cache.invalidate()
+
+# Uploads are ingested by a background worker, one job at a time
+ingest_queue = IngestJobQueue(
+    os.path.join(TEMP_DIR, "jobs"),
+    get_vector_db,
+    max_queued=int(os.environ.get("INGEST_QUEUE_SIZE", 16)),
+    on_complete=after_ingestion
+)
+
 class QueryRequest(BaseModel):
     query: str
+    # Vector vs keyword weight for this query (0.0 = all keyword, 1.0 = all vector)
+    hybrid_ratio: Optional[float] = Field(None, ge=0.0, le=1.0)
+    # Search filters: upload categories, document file names and an inclusive document date range
+    category: Optional[List[str]] = None
+    source: Optional[List[str]] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+    def search_filters(self) -> Optional[Dict[str, Any]]:
+        filters = {
+            "category": self.category,
+            "source": self.source,
+            "date_from": self.date_from.isoformat() if self.date_from else None,
+            "date_to": self.date_to.isoformat() if self.date_to else None
+        }
+        filters = {key: value for key, value in filters.items() if value}
+        return filters or None
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the API"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once warm-up has loaded everything, 503 (with per-step status) until then."""
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if readiness["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=readiness
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Stage, request and event metrics in the Prometheus text format."""
+    if not TELEMETRY_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Telemetry is disabled")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.options("/")
 async def options_root():
     return Response(
@@ -141,6 +252,18 @@ async def options_query():
         }
     )
 
+@app.options("/query/stream")
+async def options_query_stream():
+    return Response(
+        status_code=200,
+        headers={
+            "Access-Control-Allow-Origin": "https://lamoni-rod-wigit.vercel.app",
+            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization",
+            "Access-Control-Max-Age": "3600",
+        }
+    )
+
 @app.options("/query/token")
 async def options_token():
     return Response(
@@ -153,7 +276,7 @@ async def options_token():
         }
     )
 
-@app.options("/query/query/upload")
+@app.options("/query/upload")
 async def options_upload():
     return Response(
         status_code=200,
@@ -168,33 +291,34 @@ async def options_upload():
 @app.post("/query/")
 async def my_query_endpoint(query: QueryRequest):
     total_start_time = time.time()
-    print(f"\n=== INCOMING QUERY ===")
-    print(f"Query: {query.query}")
     
     # Process the query
     process_start_time = time.time()
-    result = await process_query(query.query)
-    process_end_time = time.time()
-    process_time = process_end_time - process_start_time
-    print(f"TIMING: Query processing total time: {process_time:.4f} seconds")
+    result = await process_query(query.query, query.hybrid_ratio, query.search_filters())
+    process_time = time.time() - process_start_time
     
-    # Calculate response preparation time
-    response_prep_start = time.time()
     # Add timing data to result
     result["api_timing"] = {
-        "process_time": f"{process_time:.4f} seconds"
+        "process_time": f"{process_time:.4f} seconds",
+        "total_time": f"{time.time() - total_start_time:.4f} seconds"
     }
-    response_prep_end = time.time()
-    print(f"TIMING: Response preparation time: {response_prep_end - response_prep_start:.4f} seconds")
-    
-    # Calculate total API time
-    total_end_time = time.time()
-    total_time = total_end_time - total_start_time
-    print(f"TIMING: Total API endpoint time: {total_time:.4f} seconds")
-    result["api_timing"]["total_time"] = f"{total_time:.4f} seconds"
-    
     return result
 
+@app.post("/query/stream")
+async def my_query_stream_endpoint(query: QueryRequest):
+    return StreamingResponse(
+        stream_query(query.query, query.hybrid_ratio, query.search_filters()),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Stop nginx from buffering the stream
+        }
+    )
+
+@app.get("/query/cache")
+async def answer_cache_stats():
+    return answer_cache.stats()
+
 @app.post("/query/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     user = authenticate_user(fake_users_db, form_data.username, form_data.password)
@@ -210,7 +334,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.post("/query/upload")
+@app.post("/query/upload", status_code=status.HTTP_202_ACCEPTED)
 async def upload_files(
     files: List[UploadFile] = File(...),
     category: str = Form(...),
@@ -220,87 +344,126 @@ async def upload_files(
     print(f"\n=== INCOMING FILE UPLOAD ===")
     print(f"Category: {category}")
     print(f"Number of files: {len(files)}")
-    
+
+    # Validate file extensions
+    uploads = []
+    for file in files:
+        if not file.filename.lower().endswith(DOCUMENT_EXTENSIONS):
+            print(f"Skipping invalid file type: {file.filename}")
+            continue
+        uploads.append((file.filename, file.file))
+
+    # Files are saved under their names in one job directory, and sources are looked up by name
+    duplicates = ingest_queue.duplicate_names([filename for filename, _ in uploads])
+    if duplicates:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Each file in an upload needs a different name: {', '.join(duplicates)}"
+        )
+
+    if not uploads:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"No valid files were uploaded (accepted types: {', '.join(DOCUMENT_EXTENSIONS)})"
+        )
+
+    # Save the files into a new job; conversion and loading happen in the background
     try:
-        # Save uploaded files to temp directory
-        saved_files = []
-        for file in files:
-            print(f"Processing file: {file.filename}")
-            # Validate file extension
-            if not file.filename.lower().endswith(('.pdf', '.docx', '.md', '.csv', '.txt')):
-                print(f"Skipping invalid file type: {file.filename}")
-                continue
-                
-            file_path = os.path.join(TEMP_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            saved_files.append(file_path)
-            print(f"Saved file: {file.filename}")
-
-        if not saved_files:
-            return {"error": "No valid files were uploaded"}
-
-        # Initialize vector DB
-        conn_params = {
-            "host": "localhost",
-            "port": 5432,
-            "database": "postgres",
-            "user": "postgres",
-            "password": POSTGRESPASS
-        }
-        vector_db = VectorDB(conn_params)
-
-        # Process documents
-        process_start_time = time.time()
-        processed_docs = process_documents(TEMP_DIR, category)
-        process_end_time = time.time()
-        print(f"TIMING: Document processing time: {process_end_time - process_start_time:.4f} seconds")
-
-        # Prepare documents and metadata for vector DB
-        documents = []
-        metadatas = []
-        for doc in processed_docs:
-            if hasattr(doc, 'page_content'):
-                documents.append(doc.page_content)
-            else:
-                documents.append(str(doc))
-            metadatas.append(doc.metadata)
-
-        # Add to vector DB
-        db_start_time = time.time()
-        vector_db.add_documents(documents, metadatas)
-        db_end_time = time.time()
-        print(f"TIMING: Database insertion time: {db_end_time - db_start_time:.4f} seconds")
-
-        # Clean up temp files
-        for file_path in saved_files:
-            try:
-                os.remove(file_path)
-            except:
-                pass
-
-        upload_end_time = time.time()
-        total_time = upload_end_time - upload_start_time
-        print(f"TIMING: Total upload processing time: {total_time:.4f} seconds")
-
-        return {
-            "message": "Files processed and added to vector database successfully",
-            "api_timing": {
-                "total_time": f"{total_time:.4f} seconds",
-                "processing_time": f"{process_end_time - process_start_time:.4f} seconds",
-                "db_insertion_time": f"{db_end_time - db_start_time:.4f} seconds"
-            }
-        }
+        job = await run_in_threadpool(ingest_queue.submit, category, uploads)
+    except queue.Full:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many uploads are being processed, please try again later"
+        )
+
+    observe("upload_queue", time.time() - upload_start_time)
 
-    except Exception as e:
-        print(f"Error during file upload: {str(e)}")
-        # Clean up temp files in case of error
-        for file_path in saved_files:
-            try:
-                os.remove(file_path)
-            except:
-                pass
-        return {"error": str(e)}
+    return {
+        "message": "Files uploaded and queued for processing",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/query/upload/{job.id}"
+    }
+
+@app.get("/query/upload/{job_id}")
+async def upload_job_status(job_id: str, current_user: User = Depends(get_current_user)):
+    """Progress, throughput and errors of an ingestion job."""
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown job id")
+    return job.to_dict()
+
+@app.delete("/query/upload/{job_id}")
+async def cancel_upload_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Cancel a queued or running ingestion job."""
+    job = await run_in_threadpool(ingest_queue.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown job id")
+    return job.to_dict()
+
+@app.get("/query/admin/index")
+async def vector_index_status(
+    recall: bool = False,
+    k: int = 10,
+    sample_size: int = 20,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    storage: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Report the vector index state, and optionally its recall against exact search."""
+    vector_db = await run_in_threadpool(get_vector_db)
+    result = await run_in_threadpool(vector_db.index_status)
+    if recall:
+        search_params = {}
+        if ef_search is not None:
+            search_params["ef_search"] = ef_search
+        if probes is not None:
+            search_params["probes"] = probes
+        if storage is not None:
+            search_params["storage"] = storage
+        try:
+            result["recall"] = await run_in_threadpool(
+                vector_db.measure_recall, k=k, sample_size=sample_size, **search_params
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return result
+
+@app.get("/query/admin/index/storage")
+async def compare_vector_storage(
+    k: int = 10,
+    sample_size: int = 20,
+    current_user: User = Depends(get_current_user)
+):
+    """Recall@k, latency and size per row of each vector storage mode, to choose between them."""
+    vector_db = await run_in_threadpool(get_vector_db)
+    return await run_in_threadpool(vector_db.compare_storage_modes, k=k, sample_size=sample_size)
+
+@app.post("/query/admin/index/rebuild")
+async def rebuild_vector_index(
+    index_type: str = Form(VECTOR_INDEX_TYPE),
+    storage: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Rebuild the vector index, e.g. after a large bulk load or a parameter change."""
+    vector_db = await run_in_threadpool(get_vector_db)
+    index_params = {"storage": storage} if storage is not None else {}
+    try:
+        return await run_in_threadpool(vector_db.build_vector_index, index_type=index_type, rebuild=True, **index_params)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@app.post("/query/admin/index/sparse/backfill")
+async def backfill_sparse_weights(current_user: User = Depends(get_current_user)):
+    """Compute bge-m3 sparse weights for chunks loaded before the sparse lexical leg was enabled."""
+    vector_db = await run_in_threadpool(get_vector_db)
+    try:
+        return await run_in_threadpool(vector_db.backfill_sparse_embeddings)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except SparseBackfillRunning as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
 
 # Add this code to run the server when the file is executed directly
 if __name__ == "__main__":
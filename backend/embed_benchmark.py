@@ -0,0 +1,176 @@
+"""
+Benchmark the embedder's inference backends on this machine.
+
+For each backend / quantization / thread count, reports single-query latency
+(what a chat request pays), ingestion batch throughput (what an upload pays),
+agreement with float32 PyTorch, and the speedup over it:
+
+    python embed_benchmark.py --backends torch,onnx,openvino --quantize none,int8 --threads 0,4
+    python embed_benchmark.py --output embed_results.json
+
+Both figures go through the same code as the application: queries through
+get_query_encoding and chunks through encode_texts, so with the sparse
+lexical leg (LEXICAL_LEG=sparse, the default) they include the bge-m3 sparse
+weights computed from the same forward pass. --lexical-leg fulltext times
+dense encoding only.
+
+Queries and chunks are built from the language identification seed corpora,
+so the benchmark needs nothing but the model itself.
+"""
+import argparse
+import gc
+import itertools
+import json
+import re
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from embedder_runtime import load_sentence_transformer
+from language_id import ENGLISH_SEED, SPANISH_SEED
+
+EMBED_MODEL_ID = "BAAI/bge-m3"
+
+
+def seed_sentences() -> List[str]:
+    text = ENGLISH_SEED + SPANISH_SEED
+    return [sentence.strip() for sentence in re.split(r"(?<=[.?!])\s+", text) if sentence.strip()]
+
+
+def synthetic_chunks(sentences: List[str], count: int, words: int) -> List[str]:
+    """count chunks of about words words each, cycling through the sentences from different offsets."""
+    chunks = []
+    for i in range(count):
+        chunk_words = []
+        sentence = itertools.cycle(sentences[i % len(sentences):] + sentences[:i % len(sentences)])
+        while len(chunk_words) < words:
+            chunk_words.extend(next(sentence).split())
+        chunks.append(" ".join(chunk_words[:words]))
+    return chunks
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_config(model, runtime: Dict[str, Any], queries: List[str], chunks: List[str], batch_size: int,
+               sparse: bool, reference: np.ndarray, reference_texts: List[str]) -> Dict[str, Any]:
+    from VectorTools import encode_texts, get_query_encoding, use_embedding_model
+
+    encode = dict(normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+    use_embedding_model(model, runtime)
+    encode_texts(queries[:2], batch_size=batch_size, sparse=sparse)  # warm up, and load the sparse head
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        get_query_encoding(query, sparse=sparse)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    encode_texts(chunks, batch_size=batch_size, sparse=sparse)
+    ingest_seconds = time.perf_counter() - start
+
+    cosines = np.sum(model.encode(reference_texts, **encode) * reference, axis=1)
+    return {
+        "query_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "mean": float(np.mean(latencies))
+        },
+        "ingest_chunks_per_second": len(chunks) / ingest_seconds,
+        "min_cosine_vs_float32": float(cosines.min()),
+        "mean_cosine_vs_float32": float(cosines.mean())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=EMBED_MODEL_ID)
+    parser.add_argument("--backends", default="torch,onnx,openvino")
+    parser.add_argument("--quantize", default="none,int8")
+    parser.add_argument("--threads", default="0", help="comma separated; 0 = runtime default")
+    parser.add_argument("--queries", type=int, default=50, help="single-query encodes to time")
+    parser.add_argument("--chunks", type=int, default=256, help="chunks to embed for the ingestion figure")
+    parser.add_argument("--chunk-words", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lexical-leg", choices=("sparse", "fulltext"),
+                        help="sparse also computes sparse weights, like ingestion and queries do with it on "
+                             "(default LEXICAL_LEG)")
+    parser.add_argument("--onnx-qconfig", default="avx2")
+    parser.add_argument("--export-dir", default="EmbedderExports")
+    parser.add_argument("--output", help="write the results as JSON here")
+    args = parser.parse_args()
+
+    # Imported here: other benchmarks import this module for its corpus helpers before they configure VectorTools
+    from VectorTools import LEXICAL_LEG, use_embedding_model
+
+    sentences = seed_sentences()
+    queries = [sentences[i % len(sentences)] for i in range(args.queries)]
+    chunks = synthetic_chunks(sentences, args.chunks, args.chunk_words)
+    reference_texts = sentences[:16]
+
+    # The float32 PyTorch baseline's embeddings are what every other runtime is compared to
+    baseline = load_sentence_transformer(args.model)
+    reference = baseline.encode(reference_texts, normalize_embeddings=True, convert_to_numpy=True,
+                                show_progress_bar=False)
+    del baseline
+    gc.collect()
+
+    args.lexical_leg = args.lexical_leg or LEXICAL_LEG
+    sparse = args.lexical_leg == "sparse"
+    configs = itertools.product(
+        args.backends.split(","), args.quantize.split(","), [int(n) for n in args.threads.split(",")]
+    )
+    results = []
+    for backend, quantize, threads in configs:
+        result = {"backend": backend, "quantize": quantize, "threads": threads}
+        print(f"Benchmarking {backend}/{quantize} with threads={threads or 'default'}")
+        try:
+            load_start = time.time()
+            model = load_sentence_transformer(args.model, backend, quantize, threads, args.export_dir, args.onnx_qconfig)
+            result["load_seconds"] = time.time() - load_start
+            runtime = {"backend": backend, "quantize": quantize, "threads": threads, "validation": None}
+            try:
+                result.update(run_config(model, runtime, queries, chunks, args.batch_size, sparse, reference,
+                                         reference_texts))
+            finally:
+                # Let the next runtime's load free this one
+                use_embedding_model(None, {})
+            del model
+            gc.collect()
+        except Exception as e:
+            print(f"  failed: {type(e).__name__}: {e}")
+            result["error"] = f"{type(e).__name__}: {e}"
+        results.append(result)
+
+    baselines = {
+        r["threads"]: r for r in results
+        if r["backend"] == "torch" and r["quantize"] == "none" and "error" not in r
+    }
+    print(f"\nQuery latency (get_query_encoding) and chunks/s (encode_texts) are "
+          f"{'dense + sparse' if sparse else 'dense only'} encoding")
+    print(f"{'runtime':<22}{'threads':>8}{'query p50':>11}{'p95':>9}{'chunks/s':>10}"
+          f"{'min cos':>9}{'query x':>9}{'ingest x':>10}")
+    for r in results:
+        name = f"{r['backend']}/{r['quantize']}"
+        if "error" in r:
+            print(f"{name:<22}{r['threads']:>8}  {r['error']}")
+            continue
+        base = baselines.get(r["threads"])
+        if base is not None:
+            r["query_speedup"] = base["query_ms"]["p50"] / r["query_ms"]["p50"]
+            r["ingest_speedup"] = r["ingest_chunks_per_second"] / base["ingest_chunks_per_second"]
+        print(f"{name:<22}{r['threads']:>8}{r['query_ms']['p50']:>9.1f}ms{r['query_ms']['p95']:>7.1f}ms"
+              f"{r['ingest_chunks_per_second']:>10.1f}{r['min_cosine_vs_float32']:>9.4f}"
+              f"{r.get('query_speedup', float('nan')):>9.2f}{r.get('ingest_speedup', float('nan')):>10.2f}")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"model": args.model, "args": vars(args), "results": results}, handle, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+CPU inference backends for the SentenceTransformer embedder.
+
+The same model can be served by PyTorch, ONNX Runtime or OpenVINO, optionally
+with int8 weights, and with a fixed number of inference threads. Exports are
+written under export_dir once and reused on the next start. Because quantized
+and exported models drift slightly from the float32 PyTorch weights,
+load_embedder() can check them against that baseline and fall back to it when
+they disagree by more than a cosine delta.
+"""
+import gc
+import os
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+BACKENDS = ("torch", "onnx", "openvino")
+QUANTIZATIONS = ("none", "int8")
+
+# Short texts in the languages the app serves, embedded by both models for the startup check
+REFERENCE_TEXTS = [
+    "When is the next city council meeting?",
+    "What day is trash pickup on Main Street?",
+    "Tell me about the history of Graceland University.",
+    "The council voted to approve the new budget for the park and the swimming pool.",
+    "The farmers market is open every Saturday morning from June through September.",
+    "¿Cuándo es la reunión del concejo municipal?",
+    "¿Dónde puedo encontrar un buen lugar para cenar en el pueblo?",
+    "Lamoni",
+]
+
+
+def _export_path(export_dir: str, model_id: str, backend: str, quantize: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "-", model_id)
+    return os.path.join(export_dir, f"{name}-{backend}-{quantize}")
+
+
+def _onnx_kwargs(threads: int) -> Dict[str, Any]:
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return {"provider": "CPUExecutionProvider", "session_options": options}
+
+
+def _load_onnx(model_id: str, quantize: str, threads: int, export_dir: str, onnx_qconfig: str) -> SentenceTransformer:
+    path = _export_path(export_dir, model_id, "onnx", "none")
+    if not os.path.isdir(path):
+        print(f"Exporting {model_id} to ONNX at {path}")
+        SentenceTransformer(model_id, backend="onnx", model_kwargs=_onnx_kwargs(threads)).save_pretrained(path)
+
+    model_kwargs = _onnx_kwargs(threads)
+    if quantize == "int8":
+        file_name = f"onnx/model_qint8_{onnx_qconfig}.onnx"
+        if not os.path.exists(os.path.join(path, file_name)):
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            print(f"Quantizing the ONNX export to int8 ({onnx_qconfig})")
+            export_dynamic_quantized_onnx_model(
+                SentenceTransformer(path, backend="onnx", model_kwargs=_onnx_kwargs(threads)),
+                onnx_qconfig, path
+            )
+        model_kwargs["file_name"] = file_name
+    return SentenceTransformer(path, backend="onnx", model_kwargs=model_kwargs)
+
+
+def _load_openvino(model_id: str, quantize: str, threads: int, export_dir: str) -> SentenceTransformer:
+    model_kwargs = {"ov_config": {"INFERENCE_NUM_THREADS": str(threads)} if threads else {}}
+    path = _export_path(export_dir, model_id, "openvino", quantize)
+    if os.path.isdir(path):
+        return SentenceTransformer(path, backend="openvino", model_kwargs=model_kwargs)
+
+    print(f"Exporting {model_id} to OpenVINO at {path}")
+    export_kwargs = dict(model_kwargs)
+    if quantize == "int8":
+        # Weight-only int8: no calibration data needed, activations stay in float
+        export_kwargs["quantization_config"] = {"bits": 8}
+    model = SentenceTransformer(model_id, backend="openvino", model_kwargs=export_kwargs)
+    model.save_pretrained(path)
+    return model
+
+
+def _load_torch(model_id: str, quantize: str, threads: int) -> SentenceTransformer:
+    if threads:
+        torch.set_num_threads(threads)
+    model = SentenceTransformer(model_id)
+    if torch.cuda.is_available() and quantize == "none":
+        model = model.to(torch.device("cuda"))
+    elif quantize == "int8":
+        # Dynamic int8 matmuls for every Linear layer; CPU only
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def load_sentence_transformer(model_id: str, backend: str = "torch", quantize: str = "none", threads: int = 0,
+                              export_dir: str = "", onnx_qconfig: str = "avx2") -> SentenceTransformer:
+    """
+    Load model_id on one inference backend.
+
+    Args:
+        backend: "torch", "onnx" or "openvino"
+        quantize: "none" or "int8" (dynamic int8 for torch and ONNX, weight-only for OpenVINO)
+        threads: Inference threads, 0 for the backend's default
+        export_dir: Where ONNX and OpenVINO exports are cached
+        onnx_qconfig: ONNX Runtime quantization target ("avx2", "avx512", "avx512_vnni" or "arm64")
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedder backend: {backend}")
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown embedder quantization: {quantize}")
+    if backend == "onnx":
+        return _load_onnx(model_id, quantize, threads, export_dir, onnx_qconfig)
+    if backend == "openvino":
+        return _load_openvino(model_id, quantize, threads, export_dir)
+    return _load_torch(model_id, quantize, threads)
+
+
+def embedding_agreement(model: SentenceTransformer, baseline: SentenceTransformer,
+                        texts: List[str] = REFERENCE_TEXTS) -> Dict[str, float]:
+    """Cosine similarity between the two models' embeddings of the same texts."""
+    encode = dict(normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+    cosines = np.sum(model.encode(texts, **encode) * baseline.encode(texts, **encode), axis=1)
+    return {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "max_delta": float(1.0 - cosines.min())
+    }
+
+
+def load_embedder(model_id: str, backend: str = "torch", quantize: str = "none", threads: int = 0,
+                  export_dir: str = "", onnx_qconfig: str = "avx2", validate: bool = True,
+                  max_delta: float = 0.02) -> Tuple[SentenceTransformer, Dict[str, Any]]:
+    """
+    Load the configured embedder and describe what was loaded.
+
+    Anything other than float32 PyTorch is checked against it when validate is
+    set; if the smallest cosine similarity over REFERENCE_TEXTS is more than
+    max_delta below 1, or the backend fails to load, the float32 PyTorch model
+    is used instead.
+
+    Returns:
+        The model and a dict with the backend and quantization actually in use,
+        the threads setting, the load time and the validation result (if any)
+    """
+    start_time = time.time()
+    info = {"backend": backend, "quantize": quantize, "threads": threads, "validation": None}
+    if backend == "torch" and quantize == "none":
+        model = load_sentence_transformer(model_id, threads=threads)
+        info["load_seconds"] = time.time() - start_time
+        return model, info
+
+    try:
+        model = load_sentence_transformer(model_id, backend, quantize, threads, export_dir, onnx_qconfig)
+    except Exception as e:
+        print(f"Could not load the {backend}/{quantize} embedder ({e}), using float32 PyTorch")
+        model = load_sentence_transformer(model_id, threads=threads)
+        info.update(backend="torch", quantize="none", error=f"{type(e).__name__}: {e}")
+        info["load_seconds"] = time.time() - start_time
+        return model, info
+
+    if validate:
+        baseline = load_sentence_transformer(model_id, threads=threads)
+        validation = embedding_agreement(model, baseline)
+        validation["max_allowed_delta"] = max_delta
+        validation["passed"] = validation["max_delta"] <= max_delta
+        info["validation"] = validation
+        print(f"Embedder {backend}/{quantize} vs float32: min cosine {validation['min_cosine']:.5f}")
+        if not validation["passed"]:
+            print(f"Embedder drift {validation['max_delta']:.5f} exceeds {max_delta}, using float32 PyTorch")
+            model = baseline
+            info.update(backend="torch", quantize="none")
+        else:
+            del baseline
+            gc.collect()
+
+    info["load_seconds"] = time.time() - start_time
+    return model, info
@@ -0,0 +1,573 @@
+"""
+Ingestion throughput benchmark and profiler.
+
+Drives the real upload path over a set of PDF, DOCX and Markdown files and
+reads each stage's time from the telemetry stage metrics it records:
+
+    --mode pipeline    ingest_files, the streaming path uploads take (default)
+    --mode documents   process_documents, then VectorDB.add_documents
+
+Model loading (Docling's converter and chunker, the embedder) runs as
+separate phases first, so it doesn't count against throughput. Each phase
+reports wall seconds and peak RSS, sampled while it runs, plus the files
+converted, chunks created, texts embedded and rows inserted it counted.
+Below that, the pipeline stages it went through:
+
+    convert       Docling conversion and chunking (iter_documents)
+    find_url      source URL lookups (resolve_source_urls)
+    embed_batch   dense + sparse encoding (encode_texts)
+    insert        binary COPY into the store (insert_embedded_documents)
+
+with their busy seconds and items per busy second. --index adds a phase for
+the vector index build. In ingest_files the
+stages overlap, so their busy seconds can add up to more than the phase.
+Files that fail to convert don't count towards files per second.
+
+    python ingest_benchmark.py --files-per-type 5 --output ingest_results.json
+    python ingest_benchmark.py --fixtures ../Documents --backend postgres
+    python ingest_benchmark.py --profile sample --profile-dir ingest_profile
+
+Without --fixtures a deterministic fixture set is generated (Markdown, plus
+DOCX and PDF files written directly, without extra libraries). The default
+store is the embedded one (VECTOR_BACKEND=local) in a temporary directory;
+with --backend postgres the benchmark's documents are deleted again
+afterwards unless --keep is given. In pipeline mode it refuses to run
+against a store that already holds any of the files (use a scratch database).
+
+--profile cprofile writes <stage>.prof (pstats; open with snakeviz) and
+prints the top functions. --profile sample samples every thread's Python
+stack every --sample-interval seconds and writes <stage>.folded, the
+collapsed-stack format flamegraph.pl and speedscope read. Both profile this
+process only; convert with --workers > 1 runs in child processes.
+"""
+import argparse
+import cProfile
+import hashlib
+import io
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+CATEGORY = "benchmark"
+
+PDF_LINES_PER_PAGE = 48
+PDF_LINE_CHARS = 90
+
+
+def _paragraphs(seed: int, count: int, words: int) -> List[str]:
+    from embed_benchmark import seed_sentences, synthetic_chunks
+
+    sentences = seed_sentences()
+    return synthetic_chunks(sentences[seed % len(sentences):] + sentences[:seed % len(sentences)], count, words)
+
+
+def write_markdown(path: str, title: str, paragraphs: List[str]):
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(f"# {title}\n\n")
+        for i, paragraph in enumerate(paragraphs):
+            if i % 3 == 0:
+                handle.write(f"## Section {i // 3 + 1}\n\n")
+            handle.write(paragraph + "\n\n")
+
+
+DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:outlineLvl w:val="0"/></w:pPr></w:style>'
+    '</w:styles>'
+)
+
+
+def write_docx(path: str, title: str, paragraphs: List[str]):
+    """A minimal WordprocessingML package: a Title paragraph, headings and body text."""
+    def paragraph(text, style=None):
+        properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+        return f'<w:p>{properties}<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+    body = [paragraph(title, "Title")]
+    for i, text in enumerate(paragraphs):
+        if i % 3 == 0:
+            body.append(paragraph(f"Section {i // 3 + 1}", "Heading1"))
+        body.append(paragraph(text))
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{"".join(body)}</w:body></w:document>'
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '<Override PartName="/word/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+            '</Types>'
+        ))
+        package.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>'
+        ))
+        package.writestr("word/_rels/document.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+            'Target="styles.xml"/></Relationships>'
+        ))
+        package.writestr("word/document.xml", document)
+        package.writestr("word/styles.xml", DOCX_STYLES)
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def write_pdf(path: str, title: str, paragraphs: List[str]):
+    """A text-only PDF in Helvetica, PDF_LINES_PER_PAGE lines per page, with a real text layer."""
+    lines = [title, ""]
+    for paragraph in paragraphs:
+        lines.extend(_wrap(paragraph, PDF_LINE_CHARS))
+        lines.append("")
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+
+    def literal(text):
+        return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+    # Objects 1-3 are the catalog, page tree and font; each page is a page object and its content stream
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    page_ids = []
+    for page in pages:
+        operations = ["BT", "/F1 11 Tf", "14 TL", "56 780 Td"]
+        for i, line in enumerate(page):
+            operations.append(("" if i == 0 else "T* ") + literal(line) + " Tj")
+        operations.append("ET")
+        stream = "\n".join(operations).encode("cp1252", "replace")
+        content_id = len(objects) + 2
+        page_ids.append(len(objects) + 1)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode("ascii")
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{page_id} 0 R" for page_id in page_ids), len(page_ids)
+    )).encode("ascii")
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    with open(path, "wb") as handle:
+        handle.write(output.getvalue())
+
+
+FIXTURE_WRITERS = {"md": write_markdown, "docx": write_docx, "pdf": write_pdf}
+
+
+def generate_fixtures(directory: str, files_per_type: int, paragraphs: int, words: int) -> List[str]:
+    """files_per_type files of each type in directory, with dated names like real uploads."""
+    files = []
+    for extension, writer in FIXTURE_WRITERS.items():
+        for i in range(files_per_type):
+            seed = len(files)
+            title = f"Lamoni Chronicle {1920 + seed} Issue {i + 1}"
+            path = os.path.join(directory, f"Lamoni Chronicle {1920 + seed}-0{i % 9 + 1}-15.{extension}")
+            writer(path, title, _paragraphs(seed, paragraphs, words))
+            files.append(path)
+    return files
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process, from /proc (None where that isn't available)."""
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+MONITOR_THREADS = ("rss-monitor", "stack-sampler")
+
+
+class RssMonitor:
+    """Samples RSS on a background thread and keeps the peak since the last reset."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = rss_bytes() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-monitor", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes() or 0)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def reset(self) -> int:
+        self.peak = rss_bytes() or 0
+        return self.peak
+
+
+class StackSampler:
+    """
+    Statistical profiler: every interval seconds, record the Python stack of
+    every thread except the benchmark's own monitors as a collapsed
+    "outer;...;inner" line.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            skip = {thread.ident for thread in threading.enumerate() if thread.name in MONITOR_THREADS}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in skip:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def write(self, path: str):
+        with open(path, "w") as handle:
+            for stack, samples in self.stacks.most_common():
+                handle.write(f"{stack} {samples}\n")
+
+
+# Pipeline stages timed in telemetry's rag_stage_seconds, and the rag_events_total
+# counter holding the items each one handled
+PIPELINE_STAGES = {
+    "convert": "files_converted",
+    "find_url": "files_converted",
+    "embed_batch": "texts_embedded",
+    "insert": "rows_inserted"
+}
+# Phases that run the upload path itself (the rest load models or build the index)
+INGEST_PHASES = ("ingest_files", "process_documents", "add_documents")
+
+
+def metric_snapshot() -> Tuple[Dict[str, Dict[str, float]], Dict[str, float]]:
+    """({stage: {"count", "sum"}}, {event: value}) as telemetry has them now."""
+    from telemetry import EVENTS, STAGE_SECONDS
+
+    stages = {labels[0]: values for labels, values in STAGE_SECONDS.snapshot().items()}
+    events = {labels[0]: value for labels, value in EVENTS.snapshot().items()}
+    return stages, events
+
+
+def metric_deltas(before, after) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float]]:
+    """What the stage timings and event counters gained between two metric_snapshot() calls."""
+    stages_before, events_before = before
+    stages_after, events_after = after
+    stages = {}
+    for name, values in stages_after.items():
+        previous = stages_before.get(name, {"count": 0, "sum": 0.0})
+        if values["count"] > previous["count"]:
+            stages[name] = {"calls": values["count"] - previous["count"], "seconds": values["sum"] - previous["sum"]}
+    events = {name: value - events_before.get(name, 0) for name, value in events_after.items()
+              if value > events_before.get(name, 0)}
+    return stages, events
+
+
+class StageRunner:
+    """Times phases, tracks their peak RSS and optionally profiles them."""
+
+    def __init__(self, rss: RssMonitor, profile: str = "none", profile_dir: str = "ingest_profile",
+                 sample_interval: float = 0.005):
+        self.rss = rss
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.stages = []
+        if profile != "none":
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name: str, profile: bool = True):
+        """
+        Measure the with block as phase name. Besides its wall time and RSS,
+        the result holds the pipeline stage timings ("stages") and event counts
+        ("events") telemetry recorded while it ran. The yielded dict is for any
+        other item counts (e.g. {"rows": n}); a rate per second is added for each.
+        """
+        counts = {}
+        rss_start = self.rss.reset()
+        profiler = sampler = None
+        if profile and self.profile == "cprofile":
+            profiler = cProfile.Profile()
+        elif profile and self.profile == "sample":
+            sampler = StackSampler(self.sample_interval).__enter__()
+
+        print(f"Stage {name}")
+        metrics_start = metric_snapshot()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield counts
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            seconds = time.perf_counter() - start
+            if sampler is not None:
+                sampler.__exit__(None, None, None)
+            stages, events = metric_deltas(metrics_start, metric_snapshot())
+
+            result = {
+                "stage": name,
+                "seconds": seconds,
+                "rss_start_mb": rss_start / 2 ** 20,
+                "rss_peak_mb": max(self.rss.peak, rss_bytes() or 0) / 2 ** 20,
+                "rss_end_mb": (rss_bytes() or 0) / 2 ** 20,
+                "stages": stages,
+                "events": events
+            }
+            for key, value in counts.items():
+                result[key] = value
+                if isinstance(value, (int, float)) and seconds > 0:
+                    result[f"{key}_per_second"] = value / seconds
+            if profiler is not None:
+                path = os.path.join(self.profile_dir, f"{name}.prof")
+                profiler.dump_stats(path)
+                result["profile"] = path
+                print(f"  top functions by cumulative time ({path}):")
+                stats = pstats.Stats(profiler, stream=sys.stdout)
+                stats.sort_stats("cumulative").print_stats(15)
+            if sampler is not None:
+                path = os.path.join(self.profile_dir, f"{name}.folded")
+                sampler.write(path)
+                result["profile"] = path
+            self.stages.append(result)
+
+
+def print_report(stages: List[Dict[str, Any]]):
+    print(f"\n{'phase':<18}{'seconds':>9}{'files':>8}{'chunks':>9}{'embedded':>10}{'inserted':>10}{'peak RSS':>11}")
+    for stage in stages:
+        events = stage["events"]
+        print(f"{stage['stage']:<18}{stage['seconds']:>9.2f}{events.get('files_converted', 0):>8.0f}"
+              f"{events.get('chunks_created', 0):>9.0f}{events.get('texts_embedded', 0):>10.0f}"
+              f"{events.get('rows_inserted', 0):>10.0f}{stage['rss_peak_mb']:>9.0f}MB")
+
+    # Stage seconds are busy time; in ingest_files the stages overlap, so they can add up to more than the phase
+    print(f"\n{'stage':<18}{'calls':>7}{'busy s':>9}{'items':>22}{'per busy s':>12}")
+    for stage in stages:
+        for name, item in PIPELINE_STAGES.items():
+            timing = stage["stages"].get(name)
+            if timing is None:
+                continue
+            items = stage["events"].get(item, 0)
+            rate = f"{items / timing['seconds']:>12.1f}" if timing["seconds"] > 0 else f"{'':>12}"
+            print(f"{name:<18}{timing['calls']:>7}{timing['seconds']:>9.2f}{f'{items:.0f} {item}':>22}{rate}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="directory of documents to ingest (default: generate a fixture set)")
+    parser.add_argument("--files-per-type", type=int, default=4, help="generated files per type (md, docx, pdf)")
+    parser.add_argument("--paragraphs", type=int, default=40, help="paragraphs per generated file")
+    parser.add_argument("--paragraph-words", type=int, default=80)
+    parser.add_argument("--backend", choices=("local", "postgres"), default="local")
+    parser.add_argument("--store-dir", help="local store directory (default: a new temporary directory)")
+    parser.add_argument("--mode", choices=("pipeline", "documents"), default="pipeline",
+                        help="pipeline: ingest_files (the streaming upload path); "
+                             "documents: process_documents, then add_documents")
+    parser.add_argument("--workers", type=int, default=1, help="conversion worker processes")
+    parser.add_argument("--batch-size", type=int,
+                        help="chunks per embed / insert batch (default INGEST_BATCH_SIZE, COPY_BATCH_SIZE "
+                             "with --mode documents)")
+    parser.add_argument("--index", action="store_true", help="also time the vector index build")
+    parser.add_argument("--keep", action="store_true", help="leave the benchmark rows in the store")
+    parser.add_argument("--profile", choices=("none", "cprofile", "sample"), default="none")
+    parser.add_argument("--profile-dir", default="ingest_profile")
+    parser.add_argument("--sample-interval", type=float, default=0.005, help="seconds between stack samples")
+    parser.add_argument("--output", help="write the results as JSON here")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.TemporaryDirectory(prefix="ingest-benchmark-")
+    os.environ["VECTOR_BACKEND"] = args.backend
+    if args.backend == "local":
+        os.environ["LOCAL_STORE_DIR"] = args.store_dir or os.path.join(temp_dir.name, "store")
+    # The stage timings are read from telemetry's metrics
+    os.environ["TELEMETRY_ENABLED"] = "true"
+
+    # Imported after the settings above, which VectorTools reads at import time
+    from VectorTools import (
+        CONN_PARAMS, COPY_BATCH_SIZE, INGEST_BATCH_SIZE, PIPELINE_VERSION, VectorDB, _init_conversion_worker,
+        file_content_hash, gather_document_files, ingest_files, load_embedding_model, load_sparse_head,
+        process_documents
+    )
+
+    if args.fixtures:
+        fixture_dir = args.fixtures
+        files = gather_document_files(fixture_dir)
+    else:
+        fixture_dir = os.path.join(temp_dir.name, "fixtures")
+        os.makedirs(fixture_dir)
+        files = generate_fixtures(fixture_dir, args.files_per_type, args.paragraphs, args.paragraph_words)
+    if not files:
+        sys.exit("No documents to ingest")
+    input_bytes = sum(os.path.getsize(file) for file in files)
+    if args.batch_size:
+        batch_size = args.batch_size
+    else:
+        batch_size = INGEST_BATCH_SIZE if args.mode == "pipeline" else COPY_BATCH_SIZE
+    print(f"{len(files)} files, {input_bytes / 2 ** 20:.1f} MB")
+
+    rss = RssMonitor()
+    rss.start()
+    runner = StageRunner(rss, args.profile, args.profile_dir, args.sample_interval)
+    # process_documents' chunks have no content hash, so --mode documents tags its rows
+    # with one for the run, to delete them again afterwards
+    run_hash = hashlib.sha256(f"ingest_benchmark {time.time()}".encode("utf-8")).hexdigest()
+    vector_db = None
+    ingest_summary = None
+    ingesting = False
+    try:
+        with runner.stage("db_open", profile=False):
+            if args.backend == "local":
+                from local_vector_db import LocalVectorDB
+                vector_db = LocalVectorDB()
+            else:
+                vector_db = VectorDB(CONN_PARAMS)
+
+        if args.mode == "pipeline" and vector_db.ingested_hashes([file_content_hash(file) for file in files]):
+            # ingest_files would skip them, and the cleanup would delete them
+            sys.exit("Some of these files are already ingested in this store; benchmark against a scratch database")
+
+        if args.workers <= 1:
+            with runner.stage("converter_load", profile=False):
+                _init_conversion_worker()
+
+        with runner.stage("embed_model_load", profile=False):
+            load_embedding_model()
+            if vector_db.lexical_leg == "sparse":
+                load_sparse_head()
+
+        ingesting = True
+        if args.mode == "pipeline":
+            with runner.stage("ingest_files"):
+                ingest_summary = ingest_files(vector_db, files, CATEGORY, workers=args.workers, batch_size=batch_size)
+        else:
+            with runner.stage("process_documents"):
+                docs = process_documents(fixture_dir, CATEGORY, workers=args.workers)
+            texts = [doc.page_content for doc in docs]
+            metadatas = [dict(doc.metadata, content_hash=run_hash, pipeline_version=PIPELINE_VERSION) for doc in docs]
+            del docs
+            with runner.stage("add_documents"):
+                vector_db.add_documents(texts, metadatas, batch_size=batch_size)
+
+        if args.index:
+            with runner.stage("index") as counts:
+                counts["rows"] = vector_db.get_document_count()
+                vector_db.build_vector_index()
+    finally:
+        rss.stop()
+        if vector_db is not None:
+            if ingesting and not args.keep:
+                if args.mode == "pipeline":
+                    deleted = sum(vector_db.delete_source(os.path.basename(file)) for file in files)
+                else:
+                    deleted = vector_db.delete_ingest_chunks(run_hash)
+                print(f"Deleted {deleted} benchmark rows")
+            vector_db.close()
+        temp_dir.cleanup()
+
+    stages = runner.stages
+    print_report(stages)
+    ingest_phases = [stage for stage in stages if stage["stage"] in INGEST_PHASES]
+    ingest_seconds = sum(stage["seconds"] for stage in ingest_phases)
+    events = Counter()
+    stage_seconds = Counter()
+    for stage in ingest_phases:
+        events.update(stage["events"])
+        stage_seconds.update({name: timing["seconds"] for name, timing in stage["stages"].items()
+                              if name in PIPELINE_STAGES})
+    # Only files that made it through count towards throughput
+    if ingest_summary is not None:
+        files_ok = ingest_summary["files_ingested"]
+        for error in ingest_summary["errors"]:
+            print(f"  failed: {error['file']}: {error['error']}")
+    else:
+        files_ok = events["files_converted"]
+    summary = {
+        "mode": args.mode,
+        "files": len(files),
+        "files_ingested": files_ok,
+        "files_failed": len(ingest_summary["errors"]) if ingest_summary is not None else events["convert_error"],
+        "chunks": events["chunks_created"],
+        "rows_inserted": events["rows_inserted"],
+        "input_mb": input_bytes / 2 ** 20,
+        "ingest_seconds": ingest_seconds,
+        "files_per_second": files_ok / ingest_seconds if ingest_seconds else None,
+        "chunks_per_second": events["rows_inserted"] / ingest_seconds if ingest_seconds else None,
+        "stage_busy_seconds": dict(stage_seconds),
+        "peak_rss_mb": max(stage["rss_peak_mb"] for stage in stages)
+    }
+    print(f"\n{' + '.join(stage['stage'] for stage in ingest_phases)}: {ingest_seconds:.2f}s, "
+          f"{files_ok} of {len(files)} files ingested ({summary['files_per_second'] or 0:.2f} files/s), "
+          f"{summary['chunks_per_second'] or 0:.1f} chunks/s, peak RSS {summary['peak_rss_mb']:.0f}MB")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"args": vars(args), "summary": summary, "stages": stages}, handle, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from VectorTools import ingest_files
+
+# Statuses a job can be in. queued and running jobs are picked up again on restart.
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class IngestJob:
+    """
+    One upload's worth of files to ingest. The job's state is kept in
+    job.json next to its files so it survives a restart.
+    """
+
+    def __init__(self, job_dir: str, job_id: str, category: str, files: List[str]):
+        self.job_dir = job_dir
+        self.id = job_id
+        self.category = category
+        self.files = files
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.reset_progress()
+        self.errors = []
+        self.summary = None
+        self._last_saved = 0.0
+        # ingest_files reports progress from its embed and insert threads
+        self._lock = threading.Lock()
+
+    def reset_progress(self):
+        self.progress = {
+            "files_total": len(self.files),
+            "files_skipped": 0,
+            "files_converted": 0,
+            "files_ingested": 0,
+            "chunks_embedded": 0,
+            "rows_inserted": 0
+        }
+
+    @property
+    def file_paths(self) -> List[str]:
+        return [os.path.join(self.job_dir, name) for name in self.files]
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        throughput = None
+        if elapsed:
+            throughput = {
+                "files_per_second": self.progress["files_converted"] / elapsed,
+                "chunks_per_second": self.progress["rows_inserted"] / elapsed
+            }
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "category": self.category,
+            "files": self.files,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": elapsed,
+            "cancel_requested": self.cancel_requested,
+            "progress": dict(self.progress),
+            "throughput": throughput,
+            "errors": list(self.errors),
+            "summary": self.summary
+        }
+
+    def add_progress(self, counter: str, n: int):
+        with self._lock:
+            self.progress[counter] = self.progress.get(counter, 0) + n
+
+    def save(self, force: bool = True):
+        """Write job.json atomically; unforced saves are throttled to one a second."""
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_saved < 1.0:
+                return
+            self._last_saved = now
+            state = self.to_dict()
+            handle = tempfile.NamedTemporaryFile("w", dir=self.job_dir, prefix="job.json.", suffix=".tmp",
+                                                 delete=False)
+            try:
+                with handle:
+                    json.dump(state, handle)
+                os.replace(handle.name, os.path.join(self.job_dir, "job.json"))
+            except BaseException:
+                try:
+                    os.remove(handle.name)
+                except OSError:
+                    pass
+                raise
+
+    @classmethod
+    def load(cls, job_dir: str) -> "IngestJob":
+        with open(os.path.join(job_dir, "job.json")) as handle:
+            state = json.load(handle)
+        job = cls(job_dir, state["job_id"], state["category"], state["files"])
+        job.status = state["status"]
+        job.created_at = state["created_at"]
+        job.started_at = state["started_at"]
+        job.finished_at = state["finished_at"]
+        job.cancel_requested = state["cancel_requested"]
+        job.progress = state["progress"]
+        job.errors = state["errors"]
+        job.summary = state["summary"]
+        return job
+
+
+class IngestJobQueue:
+    """
+    Bounded queue of ingestion jobs worked by a background thread.
+
+    Uploads are saved under root/<job_id>/ and ingested by ingest_files with
+    progress counters and cancellation wired into the job. Jobs left queued or
+    running by a previous process are re-queued by resume(); files that were
+    fully ingested before the restart are skipped by the ingestion manifest.
+    """
+
+    def __init__(self, root: str, get_vector_db: Callable, max_queued: int = 16,
+                 on_complete: Optional[Callable[[IngestJob], None]] = None):
+        self.root = root
+        self.get_vector_db = get_vector_db
+        self.on_complete = on_complete
+        self.max_queued = max_queued
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stopping = threading.Event()
+        os.makedirs(root, exist_ok=True)
+
+    def start(self):
+        """Re-queue unfinished jobs and start the worker thread."""
+        if self._worker is not None:
+            return
+        self.resume()
+        self._stopping.clear()
+        self._worker = threading.Thread(target=self._work, name="ingest-worker", daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Ask the worker to stop after its current job; that job resumes on next start."""
+        self._stopping.set()
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout)
+            self._worker = None
+
+    def resume(self):
+        """Load every job on disk, re-queueing those that never finished in submission order."""
+        loaded = []
+        for job_id in os.listdir(self.root):
+            job_dir = os.path.join(self.root, job_id)
+            if job_id in self.jobs or not os.path.exists(os.path.join(job_dir, "job.json")):
+                continue
+            try:
+                loaded.append(IngestJob.load(job_dir))
+            except Exception as e:
+                print(f"Could not load ingestion job {job_id}: {e}")
+
+        # Job ids are random, so the directory order says nothing about when a job was submitted
+        for job in sorted(loaded, key=lambda job: job.created_at):
+            self.jobs[job.id] = job
+            if job.status in ACTIVE_STATUSES:
+                print(f"Resuming ingestion job {job.id}")
+                job.status = QUEUED
+                job.reset_progress()
+                job.save()
+                self._queue.put(job.id)
+
+    @staticmethod
+    def saved_name(filename: str) -> str:
+        """The name an upload is saved under: its base name, so it can't write outside the job directory."""
+        return os.path.basename(filename.replace("\\", "/"))
+
+    @classmethod
+    def duplicate_names(cls, filenames: List[str]) -> List[str]:
+        """Names that more than one of filenames would be saved under (compared case-insensitively)."""
+        seen = {}
+        for filename in filenames:
+            name = cls.saved_name(filename)
+            seen.setdefault(name.casefold(), []).append(name)
+        return [names[0] for names in seen.values() if len(names) > 1]
+
+    def submit(self, category: str, uploads: List[Tuple[str, BinaryIO]]) -> IngestJob:
+        """
+        Save uploaded (filename, file object) pairs into a new job and queue it.
+
+        Raises queue.Full if max_queued jobs are already waiting or running, and
+        ValueError if two uploads would be saved under the same name.
+        """
+        duplicates = self.duplicate_names([filename for filename, _ in uploads])
+        if duplicates:
+            raise ValueError(f"Duplicate file names in upload: {', '.join(duplicates)}")
+        with self._lock:
+            active = sum(1 for job in self.jobs.values() if job.status in ACTIVE_STATUSES)
+        if active >= self.max_queued:
+            raise queue.Full("Too many ingestion jobs are queued")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.root, job_id)
+        os.makedirs(job_dir)
+        names = []
+        for filename, file_obj in uploads:
+            name = self.saved_name(filename)
+            with open(os.path.join(job_dir, name), "wb") as buffer:
+                shutil.copyfileobj(file_obj, buffer)
+            names.append(name)
+
+        job = IngestJob(job_dir, job_id, category, names)
+        job.save()
+        with self._lock:
+            self.jobs[job_id] = job
+        self._queue.put(job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        """Request cancellation; a queued job is dropped, a running one stops at the next batch."""
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            return job
+        job.cancel_requested = True
+        if job.status == QUEUED:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            self._remove_files(job)
+        job.save()
+        return job
+
+    def _work(self):
+        try:
+            # Background ingestion yields the CPU to live queries (Linux applies this per thread)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        while not self._stopping.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            job = self.jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                continue
+            self._run(job)
+
+    def _run(self, job: IngestJob):
+        job.status = RUNNING
+        job.started_at = job.started_at or time.time()
+        job.save()
+
+        def progress(counter: str, n: int):
+            job.add_progress(counter, n)
+            try:
+                job.save(force=False)
+            except Exception as e:
+                # A failed progress save must not fail the file being ingested
+                print(f"Could not save progress of ingestion job {job.id}: {e}")
+
+        def should_cancel() -> bool:
+            return job.cancel_requested or self._stopping.is_set()
+
+        try:
+            vector_db = self.get_vector_db()
+            summary = ingest_files(
+                vector_db, job.file_paths, job.category,
+                progress=progress, should_cancel=should_cancel
+            )
+            job.summary = summary
+            job.errors.extend(summary["errors"])
+            if summary["cancelled"] and self._stopping.is_set() and not job.cancel_requested:
+                # Shutting down: leave the job queued so it resumes on restart
+                job.status = QUEUED
+                job.save()
+                return
+            job.status = CANCELLED if summary["cancelled"] else COMPLETED
+        except Exception as e:
+            print(f"Ingestion job {job.id} failed: {e}")
+            job.errors.append({"file": None, "error": f"{type(e).__name__}: {e}"})
+            job.status = FAILED
+
+        job.finished_at = time.time()
+        job.save()
+        if job.status != FAILED:
+            # Failed jobs keep their files so the upload can be inspected or retried
+            self._remove_files(job)
+
+        if self.on_complete is not None and job.summary and job.summary["chunks_inserted"]:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                print(f"Post-ingestion step for job {job.id} failed: {e}")
+
+    def _remove_files(self, job: IngestJob):
+        for path in job.file_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,125 @@
+"""
+Offline English/Spanish language identification.
+
+A character n-gram naive Bayes model is trained at import time from the small
+seed corpora below, so there is nothing to download and a query is scored in
+microseconds. It only has to separate English from Spanish, which is why a
+few hundred words per language are enough.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Tuple
+
+NGRAM_SIZES = (1, 2, 3)
+
+ENGLISH_SEED = """
+What are some things to do in Lamoni this weekend? When is the city council meeting?
+Do I have to register my dog with the city? What day is trash pickup on my street?
+Tell me about the history of Graceland University and the old newspaper.
+Where can I find a good place to eat dinner in town? Is the library open on Sunday?
+How do I pay my water bill online and who should I call about a broken street light?
+The council voted to approve the new budget for the park and the swimming pool.
+The spring yard sale will be held in May, and everyone in the community is welcome.
+There was a fire at the old building on Main Street last night, but nobody was hurt.
+The school board announced that classes will start a week later because of the weather.
+I would like to know which restaurants are open late and whether they deliver.
+Please tell me how to apply for a building permit and how long it usually takes.
+Our family moved here last year and we want to get involved with local events.
+The farmers market is open every Saturday morning from June through September.
+Can you give me the phone number for city hall and the hours they are open?
+What happened in the town during the flood of the nineteen forties?
+Where should I go to vote, and when does the polling place open and close?
+The police department is asking residents to lock their cars and report anything strange.
+Who won the football game on Friday night and when is the next home game?
+How much does it cost to rent the community center for a birthday party?
+Are there any job openings with the city or at the hospital right now?
+Thank you for your help, that was exactly the information that I needed.
+"""
+
+SPANISH_SEED = """
+¿Qué hay para hacer en Lamoni este fin de semana? ¿Cuándo es la reunión del concejo municipal?
+¿Tengo que registrar a mi perro con la ciudad? ¿Qué día pasa el camión de la basura por mi calle?
+Háblame de la historia de la Universidad Graceland y del periódico antiguo.
+¿Dónde puedo encontrar un buen lugar para cenar en el pueblo? ¿Está abierta la biblioteca el domingo?
+¿Cómo pago mi factura del agua por internet y a quién llamo por una luz de la calle rota?
+El concejo votó para aprobar el nuevo presupuesto para el parque y la piscina.
+La venta de garaje de primavera será en mayo, y toda la comunidad está invitada.
+Hubo un incendio en el edificio viejo de la calle principal anoche, pero nadie resultó herido.
+La junta escolar anunció que las clases empezarán una semana más tarde por el clima.
+Me gustaría saber qué restaurantes abren hasta tarde y si hacen entregas a domicilio.
+Por favor dime cómo solicitar un permiso de construcción y cuánto tiempo suele tardar.
+Nuestra familia se mudó aquí el año pasado y queremos participar en los eventos locales.
+El mercado de agricultores abre todos los sábados por la mañana de junio a septiembre.
+¿Me puedes dar el número de teléfono del ayuntamiento y el horario de atención?
+¿Qué pasó en el pueblo durante la inundación de los años cuarenta?
+¿Dónde debo ir a votar, y cuándo abre y cierra el lugar de votación?
+El departamento de policía pide a los vecinos que cierren sus carros y reporten cualquier cosa extraña.
+¿Quién ganó el partido de fútbol el viernes por la noche y cuándo es el próximo partido en casa?
+¿Cuánto cuesta alquilar el centro comunitario para una fiesta de cumpleaños?
+¿Hay ofertas de trabajo con la ciudad o en el hospital ahora mismo?
+Muchas gracias por tu ayuda, esa era exactamente la información que necesitaba.
+"""
+
+
+def _normalize(text: str) -> str:
+    """Lowercase and keep letters, accents and Spanish punctuation; everything else becomes a space."""
+    text = unicodedata.normalize("NFC", text.lower())
+    return re.sub(r"[^a-záéíóúüñ¿¡ ]+", " ", text)
+
+
+def _ngrams(text: str) -> Counter:
+    counts = Counter()
+    for word in _normalize(text).split():
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            for start in range(len(padded) - size + 1):
+                counts[padded[start:start + size]] += 1
+    return counts
+
+
+class NgramLanguageModel:
+    """Multinomial naive Bayes over character n-grams with add-one smoothing."""
+
+    def __init__(self, corpora: Dict[str, str]):
+        self.log_probs = {}
+        self.unseen_log_prob = {}
+        vocabulary = set()
+        counts = {}
+        for language, text in corpora.items():
+            counts[language] = _ngrams(text)
+            vocabulary.update(counts[language])
+
+        for language, language_counts in counts.items():
+            total = sum(language_counts.values()) + len(vocabulary)
+            self.log_probs[language] = {
+                gram: math.log((count + 1) / total) for gram, count in language_counts.items()
+            }
+            self.unseen_log_prob[language] = math.log(1 / total)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        Return the most likely language and its posterior probability.
+
+        Text with no letters at all scores 0.5 for every language, which keeps it
+        below any sensible confidence threshold.
+        """
+        grams = _ngrams(text)
+        scores = {}
+        for language, log_probs in self.log_probs.items():
+            unseen = self.unseen_log_prob[language]
+            scores[language] = sum(log_probs.get(gram, unseen) * count for gram, count in grams.items())
+
+        best = max(scores, key=scores.get)
+        # Softmax of the log-likelihoods, shifted by the best for stability
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+
+_model = NgramLanguageModel({"English": ENGLISH_SEED, "Spanish": SPANISH_SEED})
+
+
+def identify_language(text: str) -> Tuple[str, float]:
+    """Classify text as "English" or "Spanish" and return (language, confidence)."""
+    return _model.predict(text)
@@ -0,0 +1,850 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from VectorTools import (
+    VectorDB, SCRIPT_DIR, EMBED_DIM, PIPELINE_VERSION, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+    IVFFLAT_PROBES, RERANKER, RERANKER_MODEL_ID, RERANKER_MAX_TOKENS, RERANKER_BUDGET_MS, RERANKER_CACHE_SIZE,
+    LEXICAL_LEG, encode_texts
+)
+from reranker import create_reranker
+from telemetry import count, observe
+from source_registry import source_name
+
+# Local store settings (used when VECTOR_BACKEND=local)
+LOCAL_STORE_DIR = os.environ.get("LOCAL_STORE_DIR", os.path.join(SCRIPT_DIR, "LocalVectorStore"))
+LOCAL_STORE_DTYPE = os.environ.get("LOCAL_STORE_DTYPE", "float32")       # float32, float16 or int8
+LOCAL_INDEX_TYPE = os.environ.get("LOCAL_INDEX_TYPE", "exact")           # exact or hnsw (needs hnswlib)
+# sparse (bge-m3 lexical weights in an inverted index), fts5 (SQLite BM25) or none
+LOCAL_KEYWORD_INDEX = os.environ.get("LOCAL_KEYWORD_INDEX", "sparse" if LEXICAL_LEG == "sparse" else "fts5")
+
+# Hamming prefilter over packed sign bits; the shortlist (limit * factor rows) is rescored exactly
+LOCAL_BINARY_PREFILTER = os.environ.get("LOCAL_BINARY_PREFILTER", "false").lower() == "true"
+LOCAL_RESCORE_FACTOR = int(os.environ.get("LOCAL_RESCORE_FACTOR", 10))
+
+# Rows converted to float32 at a time when scoring a float16 or int8 matrix
+SCORE_BLOCK_ROWS = 65536
+
+MATRIX_SUFFIXES = {"float32": "f32", "float16": "f16", "int8": "i8"}
+CODE_BYTES = EMBED_DIM // 8
+
+# Set bits in each byte value, for Hamming distances over packed codes
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: returns (codes, scales) with row ~= codes * scale."""
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def binary_codes(embeddings: np.ndarray) -> np.ndarray:
+    """One bit per dimension (set when positive), packed into EMBED_DIM / 8 bytes per row."""
+    return np.packbits(np.asarray(embeddings) > 0, axis=-1)
+
+
+def hamming_distances(codes: np.ndarray, query_code: np.ndarray) -> np.ndarray:
+    """Hamming distance from query_code to every row of codes."""
+    distances = np.empty(len(codes), dtype=np.int32)
+    for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+        block = np.asarray(codes[start:start + SCORE_BLOCK_ROWS])
+        distances[start:start + len(block)] = POPCOUNT[block ^ query_code].sum(axis=1, dtype=np.int32)
+    return distances
+
+
+
+class LocalVectorDB(VectorDB):
+    """
+    In-process VectorDB for development machines and the kiosk: same API as the
+    Postgres backend, no database server.
+
+    Files under path:
+        embeddings.f32 / .f16 / .i8       row-major embedding matrix, memory-mapped;
+                                          row i belongs to chunk id i + 1
+        scales.f32                        per-row scale of an int8 matrix
+        codes.bin                         packed sign bits for the binary prefilter
+        chunks.db                         SQLite sidecar with chunk text and metadata, the
+                                          filter columns, the sparse postings or FTS5
+                                          keyword index, the ingestion manifest and
+                                          source URLs
+        hnsw.bin                          hnswlib graph, when index_type is "hnsw"
+
+    Deleted chunks keep their matrix row and are masked out of every search.
+    With binary_prefilter, exact scans first shortlist rows by Hamming distance
+    over the sign bits and compute cosine similarity only for the shortlist.
+    Search, fusion and re-ranking are inherited from VectorDB; only the two
+    retrieval legs and the storage underneath them differ.
+    """
+
+    def __init__(self, path: str = LOCAL_STORE_DIR, dtype: str = LOCAL_STORE_DTYPE,
+                 index_type: str = LOCAL_INDEX_TYPE, keyword_index: str = LOCAL_KEYWORD_INDEX,
+                 binary_prefilter: bool = LOCAL_BINARY_PREFILTER, rescore_factor: int = LOCAL_RESCORE_FACTOR):
+        start_time = time.time()
+        if dtype not in MATRIX_SUFFIXES:
+            raise ValueError(f"Unsupported local store dtype: {dtype}")
+        if index_type not in ("exact", "hnsw"):
+            raise ValueError(f"Unsupported local index type: {index_type}")
+        if keyword_index not in ("sparse", "fts5", "none"):
+            raise ValueError(f"Unsupported local keyword index: {keyword_index}")
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.index_type = index_type
+        self.keyword_index = keyword_index
+        self.lexical_leg = "sparse" if keyword_index == "sparse" else "fulltext"
+        # There is no fulltext index to fall back to here; chunks without postings
+        # are simply not found by the sparse leg until start_sparse_backfill() fills them in
+        self.sparse_complete = True
+        self._backfill_thread = None
+        self._backfill_lock = threading.Lock()
+        self.binary_prefilter = binary_prefilter
+        self.rescore_factor = rescore_factor
+        self.matrix_path = os.path.join(path, f"embeddings.{MATRIX_SUFFIXES[dtype]}")
+        self.scales_path = os.path.join(path, "scales.f32")
+        self.codes_path = os.path.join(path, "codes.bin")
+        self.hnsw_path = os.path.join(path, "hnsw.bin")
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        # hnswlib can't resize or add to an index while it is queried, and ef is set on
+        # the index itself, so set_ef + knn_query and every graph update hold this lock
+        self._hnsw_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "chunks.db"), check_same_thread=False)
+        self._search_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-leg")
+        self.reranker = create_reranker(
+            RERANKER, RERANKER_MODEL_ID, RERANKER_MAX_TOKENS, RERANKER_BUDGET_MS / 1000, RERANKER_CACHE_SIZE
+        )
+        self.hnsw = None
+        self._hnsw_dirty = False
+        self.setup_database()
+        self._load_matrix()
+        if index_type == "hnsw":
+            self._load_hnsw()
+        observe("db_init", time.time() - start_time)
+        print(f"Opened local vector store with {self.get_document_count()} chunks")
+
+    def setup_database(self):
+        """Create the sidecar tables and indexes."""
+        with self._lock:
+            self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                content TEXT NOT NULL,
+                metadata TEXT,
+                category TEXT,
+                source_name TEXT,
+                doc_date TEXT,
+                content_hash TEXT,
+                pipeline_version TEXT
+            );
+            CREATE INDEX IF NOT EXISTS chunks_category_idx ON chunks (category);
+            CREATE INDEX IF NOT EXISTS chunks_source_name_idx ON chunks (source_name);
+            CREATE INDEX IF NOT EXISTS chunks_doc_date_idx ON chunks (doc_date);
+            CREATE INDEX IF NOT EXISTS chunks_content_hash_idx ON chunks (content_hash, pipeline_version);
+
+            CREATE TABLE IF NOT EXISTS ingest_manifest (
+                source TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                pipeline_version TEXT NOT NULL,
+                category TEXT,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                ingested_at TEXT NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS sources (
+                name TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            """)
+            if self.keyword_index == "fts5":
+                # Standalone FTS5 table keyed by chunk id; bm25() ranks the keyword leg
+                self._db.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(content, tokenize = 'porter unicode61')"
+                )
+            elif self.keyword_index == "sparse":
+                # Inverted index of bge-m3 sparse weights: one posting per (token, chunk)
+                self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS sparse_postings (
+                    token INTEGER NOT NULL,
+                    chunk_id INTEGER NOT NULL,
+                    weight REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sparse_postings_token_idx ON sparse_postings (token, chunk_id, weight);
+                CREATE INDEX IF NOT EXISTS sparse_postings_chunk_idx ON sparse_postings (chunk_id);
+                """)
+            self._db.commit()
+
+    def _row_files(self) -> List[Tuple[str, int]]:
+        """(path, bytes per row) of the files holding the embeddings themselves."""
+        files = [(self.matrix_path, EMBED_DIM * self.dtype.itemsize)]
+        if self.dtype == np.int8:
+            files.append((self.scales_path, 4))
+        return files
+
+    def _load_matrix(self):
+        """Map the embedding files, first trimming rows or chunks left over by an interrupted insert."""
+        file_rows = min(
+            os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+            for path, row_bytes in self._row_files()
+        )
+        max_id = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()[0]
+
+        if max_id > file_rows:
+            print(f"Local store: dropping {max_id - file_rows} chunks with no embedding row")
+            self._db.execute("DELETE FROM chunks WHERE id > ?", (file_rows,))
+            if self.keyword_index == "fts5":
+                self._db.execute("DELETE FROM chunks_fts WHERE rowid > ?", (file_rows,))
+            self._db.commit()
+            max_id = file_rows
+        for path, row_bytes in self._row_files():
+            if os.path.exists(path) and os.path.getsize(path) != max_id * row_bytes:
+                with open(path, "r+b") as handle:
+                    handle.truncate(max_id * row_bytes)
+
+        alive = np.zeros(max_id, dtype=bool)
+        ids = np.fromiter((row[0] for row in self._db.execute("SELECT id FROM chunks")), dtype=np.int64)
+        alive[ids - 1] = True
+        self._rows = max_id
+        self._alive = alive
+        self._remap()
+        if self.binary_prefilter:
+            self._sync_codes()
+
+    def _sync_codes(self):
+        """Rebuild the binary codes from the matrix if they are missing or out of step with it."""
+        codes_size = os.path.getsize(self.codes_path) if os.path.exists(self.codes_path) else 0
+        if codes_size == self._rows * CODE_BYTES:
+            return
+        print(f"Local store: building binary codes for {self._rows} rows")
+        with open(self.codes_path, "wb") as handle:
+            for start in range(0, self._rows, SCORE_BLOCK_ROWS):
+                handle.write(binary_codes(self._decode(self._matrix, self._scales, start, start + SCORE_BLOCK_ROWS)).tobytes())
+        self._remap()
+
+    def _remap(self):
+        def mapped(path, dtype, shape):
+            if self._rows and os.path.exists(path):
+                return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+            return np.empty((0,) + shape[1:], dtype=dtype)
+
+        self._matrix = mapped(self.matrix_path, self.dtype, (self._rows, EMBED_DIM))
+        self._scales = mapped(self.scales_path, np.float32, (self._rows,)) if self.dtype == np.int8 else None
+        self._codes = mapped(self.codes_path, np.uint8, (self._rows, CODE_BYTES)) if self.binary_prefilter else None
+
+    @staticmethod
+    def _decode(matrix: np.ndarray, scales: Optional[np.ndarray], start: int, stop: int) -> np.ndarray:
+        """Rows start:stop of the matrix as float32."""
+        block = np.asarray(matrix[start:stop], dtype=np.float32)
+        if scales is not None:
+            block *= np.asarray(scales[start:stop])[:, None]
+        return block
+
+    def insert_embedded_documents(self, documents: List[str], metadatas: List[Dict], embeddings: np.ndarray,
+                                  sparse_embeddings: Optional[List[Dict[int, float]]] = None) -> List[int]:
+        """
+        Append one batch of already embedded documents. The matrix rows are written
+        and synced before the sidecar commit, so a crash leaves at most unreferenced
+        rows, which the next open trims.
+        """
+        if not documents:
+            return []
+
+        start_time = time.time()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.dtype == np.int8:
+            stored, scales = quantize_int8(embeddings)
+            appends = [(self.matrix_path, stored), (self.scales_path, scales)]
+        else:
+            appends = [(self.matrix_path, embeddings.astype(self.dtype))]
+        if self.binary_prefilter:
+            appends.append((self.codes_path, binary_codes(embeddings)))
+
+        with self._lock:
+            first_id = self._rows + 1
+            ids = list(range(first_id, first_id + len(documents)))
+            old_sizes = {path: os.path.getsize(path) if os.path.exists(path) else 0 for path, _ in appends}
+            try:
+                for path, rows in appends:
+                    with open(path, "ab") as handle:
+                        handle.write(rows.tobytes())
+                        handle.flush()
+                        os.fsync(handle.fileno())
+
+                rows = []
+                for doc_id, content, metadata in zip(ids, documents, metadatas):
+                    rows.append((
+                        doc_id, content, json.dumps(metadata), metadata.get("type"),
+                        (metadata.get("source") or "").lower() or None, metadata.get("date"),
+                        metadata.get("content_hash"), metadata.get("pipeline_version")
+                    ))
+                self._db.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                if self.keyword_index == "fts5":
+                    self._db.executemany(
+                        "INSERT INTO chunks_fts (rowid, content) VALUES (?, ?)", zip(ids, documents)
+                    )
+                if self.keyword_index == "sparse" and sparse_embeddings is not None:
+                    self._insert_postings(ids, sparse_embeddings)
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                for path, size in old_sizes.items():
+                    if os.path.exists(path):
+                        with open(path, "r+b") as handle:
+                            handle.truncate(size)
+                raise
+
+            self._rows += len(ids)
+            self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+            self._remap()
+            if self.hnsw is not None:
+                with self._hnsw_lock:
+                    if self.hnsw.get_max_elements() < self._rows:
+                        self.hnsw.resize_index(max(self._rows, self.hnsw.get_max_elements() * 2))
+                    self.hnsw.add_items(embeddings, np.asarray(ids) - 1)
+                self._hnsw_dirty = True
+        observe("insert", time.time() - start_time)
+        count("rows_inserted", len(ids))
+        return ids
+
+    def _filter_clause(self, filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        """SQLite version of the similarity_search filter conditions, over the chunks table."""
+        if not filters:
+            return "", []
+        clauses = []
+        params = []
+        category = filters.get("category")
+        if category:
+            categories = [category] if isinstance(category, str) else list(category)
+            clauses.append(f"chunks.category IN ({', '.join('?' * len(categories))})")
+            params.extend(categories)
+        source = filters.get("source")
+        if source:
+            sources = [source] if isinstance(source, str) else list(source)
+            clauses.append(f"chunks.source_name IN ({', '.join('?' * len(sources))})")
+            params.extend(source_name(name).lower() for name in sources)
+        if filters.get("date_from"):
+            clauses.append("chunks.doc_date >= ?")
+            params.append(str(filters["date_from"]))
+        if filters.get("date_to"):
+            clauses.append("chunks.doc_date <= ?")
+            params.append(str(filters["date_to"]))
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    def _search_snapshot(self, filters: Optional[Dict[str, Any]]) -> Tuple[Tuple[Any, ...], Optional[np.ndarray]]:
+        """
+        The stored arrays (matrix, scales, codes, alive) and the rows that may be
+        returned (live chunks passing the filters), taken together so a concurrent
+        insert can't mismatch them. The mask is None when nothing is filtered.
+        """
+        filter_sql, filter_params = self._filter_clause(filters)
+        with self._lock:
+            arrays = (self._matrix, self._scales, self._codes, self._alive)
+            if not filter_sql:
+                return arrays, None
+            ids = [row[0] for row in self._db.execute(f"SELECT id FROM chunks WHERE TRUE{filter_sql}", filter_params)]
+        alive = arrays[3]
+        mask = np.zeros(len(alive), dtype=bool)
+        if ids:
+            mask[np.asarray(ids) - 1] = True
+        return arrays, mask & alive
+
+    def _vector_candidates(self, query_embedding: List[float], limit: int, ef_search: int, probes: int,
+                           filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        Top rows by cosine similarity: from the HNSW graph if built, otherwise an
+        exact scan, narrowed first by the binary prefilter when it is on.
+        """
+        search_start = time.time()
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        (matrix, scales, codes, alive), filter_mask = self._search_snapshot(filters)
+        mask = alive if filter_mask is None else filter_mask
+        limit = min(limit, int(mask.sum()))
+        if limit == 0:
+            return []
+
+        hits = None
+        index = self.hnsw
+        if index is not None:
+            try:
+                with self._hnsw_lock:
+                    index.set_ef(max(ef_search, limit))
+                    labels, distances = index.knn_query(
+                        query_vector, k=limit,
+                        filter=None if filter_mask is None else (lambda label: bool(label < len(mask) and mask[label]))
+                    )
+                hits = [(int(label) + 1, 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+            except RuntimeError as e:
+                # hnswlib can't always fill k results under a tight filter; scan instead
+                print(f"HNSW search fell back to exact scan: {e}")
+        if hits is None:
+            rows, scores = self._exact_top(matrix, scales, codes, mask, query_vector, limit, self.rescore_factor)
+            hits = [(int(row) + 1, float(score)) for row, score in zip(rows, scores)]
+
+        results = self._attach_chunks(hits)
+        observe("vector_leg", time.time() - search_start)
+        return results
+
+    def _exact_top(self, matrix: np.ndarray, scales: Optional[np.ndarray], codes: Optional[np.ndarray],
+                   mask: np.ndarray, query_vector: np.ndarray, limit: int,
+                   rescore_factor: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows and cosine scores of the limit best unmasked rows, best first. With
+        codes, only the rescore_factor * limit rows nearest in Hamming distance
+        are scored.
+        """
+        candidates = np.flatnonzero(mask)
+        shortlist_size = limit * rescore_factor
+        if codes is not None and shortlist_size < len(candidates):
+            distances = hamming_distances(codes, binary_codes(query_vector))[candidates]
+            candidates = np.sort(candidates[np.argpartition(distances, shortlist_size - 1)[:shortlist_size]])
+            scores = self._scores_rows(matrix, scales, candidates, query_vector)
+        else:
+            scores = self._scores(matrix, scales, query_vector)[candidates]
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return candidates[top], scores[top]
+
+    def _scores(self, matrix: np.ndarray, scales: Optional[np.ndarray], query_vector: np.ndarray) -> np.ndarray:
+        """Dot products of every row with the query (cosine similarity, as embeddings are normalized)."""
+        if matrix.dtype == np.float32:
+            return np.asarray(matrix @ query_vector)
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+            block = self._decode(matrix, scales, start, start + SCORE_BLOCK_ROWS)
+            scores[start:start + len(block)] = block @ query_vector
+        return scores
+
+    @staticmethod
+    def _scores_rows(matrix: np.ndarray, scales: Optional[np.ndarray], rows: np.ndarray,
+                     query_vector: np.ndarray) -> np.ndarray:
+        """Dot products of the given (sorted) rows with the query."""
+        scores = np.asarray(matrix[rows], dtype=np.float32) @ query_vector
+        if scales is not None:
+            scores *= np.asarray(scales[rows])
+        return scores
+
+    def _keyword_candidates(self, keywords: str, limit: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Top rows by FTS5 BM25 among those matching any keyword."""
+        if self.keyword_index != "fts5":
+            return []
+        search_start = time.time()
+        match = " OR ".join(f'"{keyword}"' for keyword in keywords.split(" | "))
+        filter_sql, filter_params = self._filter_clause(filters)
+        with self._lock:
+            rows = self._db.execute(
+                f"""
+                SELECT chunks.id, chunks.content, chunks.metadata, -bm25(chunks_fts) AS rank
+                FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid
+                WHERE chunks_fts MATCH ?{filter_sql}
+                ORDER BY bm25(chunks_fts)
+                LIMIT ?
+                """,
+                (match, *filter_params, limit)
+            ).fetchall()
+        observe("keyword_leg", time.time() - search_start)
+        return [
+            {"id": doc_id, "content": content, "metadata": json.loads(metadata), "score": score}
+            for doc_id, content, metadata, score in rows
+        ]
+
+    def _sparse_candidates(self, query_sparse: Dict[int, float], limit: int,
+                           filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Top rows by sparse inner product, summed over the postings of the query's tokens."""
+        if self.keyword_index != "sparse" or not query_sparse:
+            return []
+        search_start = time.time()
+        filter_sql, filter_params = self._filter_clause(filters)
+        query_terms = [value for term in query_sparse.items() for value in term]
+        with self._lock:
+            rows = self._db.execute(
+                f"""
+                WITH query (token, weight) AS (VALUES {', '.join(['(?, ?)'] * len(query_sparse))})
+                SELECT chunks.id, chunks.content, chunks.metadata, SUM(sparse_postings.weight * query.weight) AS score
+                FROM query
+                JOIN sparse_postings ON sparse_postings.token = query.token
+                JOIN chunks ON chunks.id = sparse_postings.chunk_id
+                WHERE TRUE{filter_sql}
+                GROUP BY chunks.id
+                ORDER BY score DESC
+                LIMIT ?
+                """,
+                (*query_terms, *filter_params, limit)
+            ).fetchall()
+        observe("sparse_leg", time.time() - search_start)
+        return [
+            {"id": doc_id, "content": content, "metadata": json.loads(metadata), "score": score}
+            for doc_id, content, metadata, score in rows
+        ]
+
+    def _insert_postings(self, ids: List[int], sparse_embeddings: List[Dict[int, float]]):
+        """Add the chunks' sparse weights to the inverted index. Caller holds the lock and commits."""
+        self._db.executemany(
+            "INSERT INTO sparse_postings (token, chunk_id, weight) VALUES (?, ?, ?)",
+            [
+                (token, doc_id, weight)
+                for doc_id, sparse in zip(ids, sparse_embeddings)
+                for token, weight in sparse.items()
+            ]
+        )
+
+    def _backfill_sparse(self, batch_size: int) -> Dict[str, Any]:
+        """Compute sparse postings for chunks that have none (loaded before the sparse index existed)."""
+        if self.keyword_index != "sparse":
+            raise ValueError("Sparse lexical search is not enabled (LOCAL_KEYWORD_INDEX=sparse)")
+
+        start_time = time.time()
+        updated = 0
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    """
+                    SELECT id, content FROM chunks
+                    WHERE id > ? AND NOT EXISTS (SELECT 1 FROM sparse_postings WHERE chunk_id = chunks.id)
+                    ORDER BY id LIMIT ?
+                    """,
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                break
+            _, sparse_embeddings = encode_texts([content for _, content in rows], sparse=True)
+            ids = [doc_id for doc_id, _ in rows]
+            with self._lock:
+                # Chunks deleted while this batch was encoding get no postings
+                live = {row[0] for row in self._db.execute(
+                    f"SELECT id FROM chunks WHERE id IN ({', '.join('?' * len(ids))})", ids
+                )}
+                kept = [(doc_id, sparse) for doc_id, sparse in zip(ids, sparse_embeddings) if doc_id in live]
+                self._insert_postings([doc_id for doc_id, _ in kept], [sparse for _, sparse in kept])
+                self._db.commit()
+            updated += len(kept)
+            last_id = ids[-1]
+            print(f"Backfilled sparse weights for {updated} chunks")
+
+        end_time = time.time()
+        observe("sparse_backfill", end_time - start_time)
+        return {"updated": updated, "seconds": end_time - start_time}
+
+    def _sparse_rows_missing(self) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT EXISTS (SELECT 1 FROM chunks WHERE NOT EXISTS "
+                "(SELECT 1 FROM sparse_postings WHERE chunk_id = chunks.id))"
+            ).fetchone()[0] == 1
+
+    def _attach_chunks(self, hits: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+        """Turn (id, score) pairs into result dicts with content and metadata, keeping their order."""
+        if not hits:
+            return []
+        ids = [doc_id for doc_id, _ in hits]
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, content, metadata FROM chunks WHERE id IN ({', '.join('?' * len(ids))})", ids
+            ).fetchall()
+        chunks = {doc_id: (content, metadata) for doc_id, content, metadata in rows}
+        return [
+            {"id": doc_id, "content": chunks[doc_id][0], "metadata": json.loads(chunks[doc_id][1]), "score": score}
+            for doc_id, score in hits if doc_id in chunks
+        ]
+
+    def _delete_ids(self, ids: List[int]):
+        """Remove chunks from the sidecar and mask their rows. Caller holds the lock and commits."""
+        if not ids:
+            return
+        self._db.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in ids])
+        if self.keyword_index == "fts5":
+            self._db.executemany("DELETE FROM chunks_fts WHERE rowid = ?", [(doc_id,) for doc_id in ids])
+        elif self.keyword_index == "sparse":
+            self._db.executemany("DELETE FROM sparse_postings WHERE chunk_id = ?", [(doc_id,) for doc_id in ids])
+        alive = self._alive.copy()
+        alive[np.asarray(ids) - 1] = False
+        self._alive = alive
+        if self.hnsw is not None:
+            with self._hnsw_lock:
+                for doc_id in ids:
+                    self.hnsw.mark_deleted(doc_id - 1)
+            self._hnsw_dirty = True
+
+    def _chunk_ids(self, content_hash: str, pipeline_version: str) -> List[int]:
+        return [row[0] for row in self._db.execute(
+            "SELECT id FROM chunks WHERE content_hash = ? AND pipeline_version = ?", (content_hash, pipeline_version)
+        )]
+
+    def load_sources(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._db.execute("SELECT name, url FROM sources").fetchall())
+
+    def upsert_sources(self, urls: Dict[str, str]):
+        if not urls:
+            return
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with self._lock:
+            self._db.executemany(
+                """
+                INSERT INTO sources (name, url, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET url = excluded.url, updated_at = excluded.updated_at
+                """,
+                [(name, url, now) for name, url in urls.items()]
+            )
+            self._db.commit()
+
+    def ingested_hashes(self, content_hashes: List[str], pipeline_version: str = PIPELINE_VERSION) -> set:
+        found = set()
+        with self._lock:
+            for content_hash in content_hashes:
+                row = self._db.execute(
+                    "SELECT 1 FROM ingest_manifest WHERE pipeline_version = ? AND content_hash = ?",
+                    (pipeline_version, content_hash)
+                ).fetchone()
+                if row is not None:
+                    found.add(content_hash)
+        return found
+
+    def delete_ingest_chunks(self, content_hash: str, pipeline_version: str = PIPELINE_VERSION) -> int:
+        with self._lock:
+            ids = self._chunk_ids(content_hash, pipeline_version)
+            self._delete_ids(ids)
+            self._db.commit()
+        return len(ids)
+
+    def delete_source(self, source: str) -> int:
+        """Same contract as VectorDB.delete_source, in one SQLite transaction."""
+        with self._lock:
+            try:
+                previous = self._db.execute(
+                    "SELECT content_hash, pipeline_version FROM ingest_manifest WHERE source = ?", (source,)
+                ).fetchone()
+                ids = []
+                if previous is not None:
+                    ids = self._chunk_ids(*previous)
+                    self._delete_ids(ids)
+                    self._db.execute("DELETE FROM ingest_manifest WHERE source = ?", (source,))
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+        return len(ids)
+
+    def record_ingestion(self, source: str, content_hash: str, category: str, chunk_count: int,
+                         pipeline_version: str = PIPELINE_VERSION) -> int:
+        """Same contract as VectorDB.record_ingestion, in one SQLite transaction."""
+        with self._lock:
+            try:
+                previous = self._db.execute(
+                    "SELECT content_hash, pipeline_version FROM ingest_manifest WHERE source = ?", (source,)
+                ).fetchone()
+                replaced = 0
+                if previous is not None and tuple(previous) != (content_hash, pipeline_version):
+                    ids = self._chunk_ids(*previous)
+                    self._delete_ids(ids)
+                    replaced = len(ids)
+                self._db.execute(
+                    """
+                    INSERT INTO ingest_manifest (source, content_hash, pipeline_version, category, chunk_count, ingested_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (source) DO UPDATE SET
+                        content_hash = excluded.content_hash,
+                        pipeline_version = excluded.pipeline_version,
+                        category = excluded.category,
+                        chunk_count = excluded.chunk_count,
+                        ingested_at = excluded.ingested_at
+                    """,
+                    (source, content_hash, pipeline_version, category, chunk_count, time.strftime("%Y-%m-%dT%H:%M:%S"))
+                )
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+        return replaced
+
+    def _load_hnsw(self):
+        """Open the saved HNSW graph, rebuilding it if it is missing or out of step with the matrix."""
+        import hnswlib
+
+        if os.path.exists(self.hnsw_path):
+            index = hnswlib.Index(space="cosine", dim=EMBED_DIM)
+            index.load_index(self.hnsw_path, max_elements=max(self._rows, 1))
+            if index.get_current_count() == self._rows:
+                self.hnsw = index
+                return
+            print("Local HNSW index is out of date, rebuilding")
+        self.build_vector_index("hnsw", rebuild=True)
+
+    def build_vector_index(self, index_type: str = None, rebuild: bool = False, storage: str = None) -> Dict[str, Any]:
+        """
+        Build (or save) the local HNSW graph, or drop it for exact search.
+
+        The graph is updated on every insert, so without rebuild this only writes
+        pending changes to disk. Storage is fixed when the store is opened
+        (LOCAL_STORE_DTYPE, LOCAL_BINARY_PREFILTER), so storage can't be changed here.
+        """
+        if storage is not None:
+            raise ValueError("The local store's storage mode is set by LOCAL_STORE_DTYPE and LOCAL_BINARY_PREFILTER")
+        index_type = index_type or self.index_type
+        if index_type not in ("exact", "hnsw"):
+            raise ValueError(f"Unsupported local index type: {index_type}")
+
+        start_time = time.time()
+        action = "unchanged"
+        with self._lock:
+            if index_type == "exact":
+                if self.hnsw is not None:
+                    self.hnsw = None
+                    action = "dropped"
+                if os.path.exists(self.hnsw_path):
+                    os.remove(self.hnsw_path)
+            elif self.hnsw is None or rebuild:
+                import hnswlib
+
+                index = hnswlib.Index(space="cosine", dim=EMBED_DIM)
+                index.init_index(max_elements=max(self._rows, 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+                for start in range(0, self._rows, SCORE_BLOCK_ROWS):
+                    block = self._decode(self._matrix, self._scales, start, start + SCORE_BLOCK_ROWS)
+                    index.add_items(block, np.arange(start, start + len(block)))
+                for row in np.flatnonzero(~self._alive):
+                    index.mark_deleted(int(row))
+                index.save_index(self.hnsw_path)
+                self.hnsw = index
+                self._hnsw_dirty = False
+                action = "rebuilt" if rebuild else "created"
+            elif self._hnsw_dirty:
+                with self._hnsw_lock:
+                    self.hnsw.save_index(self.hnsw_path)
+                self._hnsw_dirty = False
+                action = "saved"
+            self.index_type = index_type
+        observe("index_build", time.time() - start_time)
+        print(f"Local vector index {action}")
+        return dict(self.index_status(), action=action)
+
+    def index_status(self) -> Dict[str, Any]:
+        def file_size(path):
+            return os.path.getsize(path) if os.path.exists(path) else 0
+
+        return {
+            "name": "local",
+            "exists": self.hnsw is not None,
+            "type": self.index_type,
+            "dtype": self.dtype.name,
+            "binary_prefilter": self.binary_prefilter,
+            "keyword_index": self.keyword_index,
+            "lexical_leg": self.lexical_leg,
+            "active_lexical_leg": self.active_lexical_leg,
+            "matrix_bytes": sum(file_size(path) for path, _ in self._row_files()),
+            "codes_bytes": file_size(self.codes_path) if self.binary_prefilter else 0,
+            "size_bytes": os.path.getsize(self.hnsw_path) if os.path.exists(self.hnsw_path) else 0,
+            "row_count": self.get_document_count(),
+            "deleted_rows": self._rows - self.get_document_count()
+        }
+
+    def measure_recall(self, k: int = 10, sample_size: int = 20, ef_search: int = HNSW_EF_SEARCH,
+                       probes: int = IVFFLAT_PROBES, storage: str = None) -> Dict[str, Any]:
+        """
+        Compare the vector leg (HNSW graph, or the binary prefilter) against a full
+        exact scan, using stored embeddings as queries. Other storage modes are
+        measured by compare_storage_modes.
+        """
+        if storage is not None:
+            raise ValueError("Use compare_storage_modes to measure other storage modes of the local store")
+        live_rows = np.flatnonzero(self._alive)
+        k = min(k, len(live_rows))
+        sample = np.random.choice(live_rows, size=min(sample_size, len(live_rows)), replace=False)
+        recalls, index_times, exact_times = [], [], []
+        for row in sample:
+            query_vector = self._decode(self._matrix, self._scales, row, row + 1)[0]
+            exact_start = time.time()
+            exact_rows, _ = self._exact_top(self._matrix, self._scales, None, self._alive, query_vector, k, 1)
+            exact = set(exact_rows.tolist())
+            exact_times.append(time.time() - exact_start)
+
+            index_start = time.time()
+            index = self.hnsw
+            if index is not None:
+                with self._hnsw_lock:
+                    index.set_ef(max(ef_search, k))
+                    labels, _ = index.knn_query(query_vector, k=k)
+                approx = set(labels[0].tolist())
+            elif self._codes is not None:
+                approx_rows, _ = self._exact_top(
+                    self._matrix, self._scales, self._codes, self._alive, query_vector, k, self.rescore_factor
+                )
+                approx = set(approx_rows.tolist())
+            else:
+                approx = exact
+            index_times.append(time.time() - index_start)
+            recalls.append(len(approx & exact) / len(exact) if exact else 1.0)
+
+        return {
+            "k": k,
+            "queries": len(sample),
+            "ef_search": ef_search,
+            "recall": float(np.mean(recalls)) if recalls else None,
+            "index_latency_ms": float(np.mean(index_times) * 1000) if index_times else None,
+            "exact_latency_ms": float(np.mean(exact_times) * 1000) if exact_times else None
+        }
+
+    def compare_storage_modes(self, k: int = 10, sample_size: int = 20, ef_search: int = HNSW_EF_SEARCH,
+                              probes: int = IVFFLAT_PROBES) -> Dict[str, Any]:
+        """
+        Report recall@k and exact-scan latency of each storage mode, to help pick
+        LOCAL_STORE_DTYPE and LOCAL_BINARY_PREFILTER. The stored matrix (at its own
+        precision) is the reference; the other modes are built from it in memory,
+        so this needs roughly one more copy of the matrix in RAM.
+        """
+        live_rows = np.flatnonzero(self._alive)
+        k = min(k, len(live_rows))
+        sample = np.random.choice(live_rows, size=min(sample_size, len(live_rows)), replace=False)
+        reference = self._decode(self._matrix, self._scales, 0, self._rows)
+        int8_matrix, int8_scales = quantize_int8(reference)
+        modes = {
+            "float32": (reference, None, None, 1),
+            "float16": (reference.astype(np.float16), None, None, 1),
+            "int8": (int8_matrix, int8_scales, None, 1),
+            "binary": (reference, None, binary_codes(reference), self.rescore_factor)
+        }
+        bytes_per_row = {"float32": EMBED_DIM * 4, "float16": EMBED_DIM * 2, "int8": EMBED_DIM + 4, "binary": CODE_BYTES}
+
+        queries = [reference[row] for row in sample]
+        truths = [set(self._exact_top(reference, None, None, self._alive, query, k, 1)[0].tolist()) for query in queries]
+        report = {}
+        for mode, (matrix, scales, codes, rescore_factor) in modes.items():
+            recalls, times = [], []
+            for query, truth in zip(queries, truths):
+                search_start = time.time()
+                rows, _ = self._exact_top(matrix, scales, codes, self._alive, query, k, rescore_factor)
+                times.append(time.time() - search_start)
+                recalls.append(len(set(rows.tolist()) & truth) / len(truth) if truth else 1.0)
+            report[mode] = {
+                "k": k,
+                "queries": len(queries),
+                "recall": float(np.mean(recalls)) if recalls else None,
+                "latency_ms": float(np.mean(times) * 1000) if times else None,
+                "vector_bytes_per_row": bytes_per_row[mode],
+                "configured": mode == ("binary" if self.binary_prefilter else self.dtype.name)
+            }
+        return report
+
+    def get_document_count(self) -> int:
+        return int(self._alive.sum())
+
+    def close(self):
+        """Save pending HNSW changes and close the sidecar."""
+        with self._lock:
+            if self.hnsw is not None and self._hnsw_dirty:
+                with self._hnsw_lock:
+                    self.hnsw.save_index(self.hnsw_path)
+                self._hnsw_dirty = False
+            self._db.close()
+        self._search_executor.shutdown(wait=False)
@@ -0,0 +1,407 @@
+"""
+End-to-end query latency benchmark.
+
+Loads a corpus into a vector store, starts the API against a stub Ollama
+(stub_ollama.py) that streams a fixed answer at a fixed rate, and drives
+POST /query/ at each concurrency level. Everything except the LLM is the
+real pipeline: language identification, embedding, the search legs, fusion
+and re-ranking.
+
+    python query_benchmark.py --concurrency 1,4,8 --requests 64 --output query_results.json
+    python query_benchmark.py --corpus ../Documents --backend postgres --baseline query_results.json
+
+Per level it reports latency percentiles, throughput, errors and where the
+time went: the mean of each pipeline stage from the server's /metrics
+(rag_stage_seconds), taken as the difference before and after the level.
+
+The default backend is the embedded store (VECTOR_BACKEND=local) in a fresh
+temporary directory. With --backend postgres the corpus goes into the
+database the POSTGRES_* settings point at, so use a scratch database; the
+corpus is recorded in the ingest manifest and isn't loaded twice.
+
+The answer cache and the reranker's score cache are switched off so repeated
+questions pay full price; --caches leaves them on.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from stub_ollama import start_stub_ollama
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cycled through by the load generator; the Spanish ones take the translate path
+QUERIES = [
+    "When does the city council meet?",
+    "What day is trash pickup?",
+    "Tell me about the history of Graceland University.",
+    "When is the farmers market open?",
+    "Where can I get a good dinner in town?",
+    "What events are happening at the library this month?",
+    "Who founded Lamoni?",
+    "How do I pay my water bill?",
+    "What is there to do at Nine Eagles State Park?",
+    "Are there any concerts at Graceland this week?",
+    "¿Cuándo es la reunión del concejo municipal?",
+    "¿Dónde puedo encontrar un buen lugar para cenar en el pueblo?",
+]
+
+CORPUS_SOURCE = "query_benchmark"
+CORPUS_CATEGORY = "benchmark"
+
+
+def synthetic_corpus(docs: int, chunks_per_doc: int, words: int) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    docs documents of chunks_per_doc chunks each, built from the language
+    identification seed corpora, with metadata shaped like convert_file's.
+    """
+    from embed_benchmark import seed_sentences, synthetic_chunks
+
+    chunks = synthetic_chunks(seed_sentences(), docs * chunks_per_doc, words)
+    metadatas = []
+    for i in range(len(chunks)):
+        doc = i // chunks_per_doc
+        metadatas.append({
+            "source": f"Benchmark Document {doc:04d} {1950 + doc % 70}.md",
+            "heading": f"Section {i % chunks_per_doc + 1}",
+            "scraped_at": None,
+            "date": f"{1950 + doc % 70}-01-01",
+            "url": None,
+            "type": CORPUS_CATEGORY
+        })
+    return chunks, metadatas
+
+
+def fixture_corpus(path: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Convert and chunk the files in path the way an upload would."""
+    from VectorTools import process_documents
+
+    docs = process_documents(path, CORPUS_CATEGORY)
+    return [doc.page_content for doc in docs], [dict(doc.metadata) for doc in docs]
+
+
+def load_corpus(corpus: str, docs: int, chunks_per_doc: int, words: int) -> Dict[str, Any]:
+    """
+    Load the corpus into the store selected by the environment and build its
+    vector index. Runs in a child process so the benchmark doesn't keep a
+    second copy of the embedder in memory next to the server's.
+    """
+    from VectorTools import PIPELINE_VERSION
+    from retrieve import get_vector_db
+
+    if corpus == "synthetic":
+        texts, metadatas = synthetic_corpus(docs, chunks_per_doc, words)
+    else:
+        texts, metadatas = fixture_corpus(corpus)
+    if not texts:
+        raise ValueError(f"No chunks in corpus {corpus}")
+
+    content_hash = hashlib.sha256("\x00".join(texts).encode("utf-8")).hexdigest()
+    vector_db = get_vector_db()
+    try:
+        if vector_db.ingested_hashes([content_hash]):
+            print("Corpus already loaded")
+            return {"chunks": len(texts), "loaded": False, "documents_in_store": vector_db.get_document_count()}
+
+        for metadata in metadatas:
+            metadata.update(content_hash=content_hash, pipeline_version=PIPELINE_VERSION)
+        load_start = time.time()
+        vector_db.add_documents(texts, metadatas)
+        vector_db.record_ingestion(CORPUS_SOURCE, content_hash, CORPUS_CATEGORY, len(texts))
+        vector_db.build_vector_index()
+        return {
+            "chunks": len(texts),
+            "loaded": True,
+            "load_seconds": time.time() - load_start,
+            "documents_in_store": vector_db.get_document_count()
+        }
+    finally:
+        vector_db.close()
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(np.mean(values)),
+        "max": float(np.max(values))
+    }
+
+
+def http_get(url: str, timeout: float = 10) -> Tuple[int, str]:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8", "replace")
+
+
+def wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float):
+    """Poll /ready until the server has finished warming up."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"API server exited with code {server.returncode}")
+        try:
+            status, _ = http_get(f"{base_url}/ready", timeout=5)
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"API server not ready within {timeout:.0f} seconds")
+
+
+def stage_totals(base_url: str) -> Dict[str, Tuple[float, float]]:
+    """{stage: (count, sum of seconds)} from the server's rag_stage_seconds histogram."""
+    status, text = http_get(f"{base_url}/metrics")
+    if status != 200:
+        return {}
+    totals = {}
+    for kind, stage, value in re.findall(r'^rag_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', text, re.M):
+        count, seconds = totals.get(stage, (0.0, 0.0))
+        if kind == "count":
+            count = float(value)
+        else:
+            seconds = float(value)
+        totals[stage] = (count, seconds)
+    return totals
+
+
+def stage_breakdown(before: Dict[str, Tuple[float, float]], after: Dict[str, Tuple[float, float]],
+                    requests: int) -> Dict[str, Dict[str, float]]:
+    """Per stage: how often it ran during the level, its mean, and its mean cost per request."""
+    stages = {}
+    for stage, (count, seconds) in sorted(after.items()):
+        base_count, base_seconds = before.get(stage, (0.0, 0.0))
+        count -= base_count
+        seconds -= base_seconds
+        if count <= 0:
+            continue
+        stages[stage] = {
+            "count": int(count),
+            "mean_ms": seconds / count * 1000,
+            "ms_per_request": seconds / max(requests, 1) * 1000
+        }
+    return stages
+
+
+def send_query(base_url: str, query: str, stream: bool, timeout: float) -> Dict[str, Any]:
+    """
+    Send one query and time it. For the streaming endpoint the time to the
+    first token event is recorded as well.
+    """
+    path = "/query/stream" if stream else "/query/"
+    request = urllib.request.Request(
+        f"{base_url}{path}",
+        data=json.dumps({"query": query}).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    start = time.perf_counter()
+    first_token = None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            if stream:
+                error = None
+                for line in response:
+                    if first_token is None and line.startswith(b"event: token"):
+                        first_token = time.perf_counter() - start
+                    elif line.startswith(b"event: error"):
+                        error = "error event"
+            else:
+                body = json.loads(response.read())
+                error = body.get("error")
+    except (OSError, ValueError) as e:
+        error = f"{type(e).__name__}: {e}"
+    return {"seconds": time.perf_counter() - start, "ttft_seconds": first_token, "error": error}
+
+
+def run_level(base_url: str, concurrency: int, requests: int, stream: bool, timeout: float,
+              offset: int = 0) -> Dict[str, Any]:
+    """Send requests queries with concurrency of them in flight at a time."""
+    queries = [QUERIES[(offset + i) % len(QUERIES)] for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda query: send_query(base_url, query, stream, timeout), queries))
+    wall_seconds = time.perf_counter() - start
+
+    ok = [result for result in results if result["error"] is None]
+    errors = [result["error"] for result in results if result["error"] is not None]
+    level = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(ok) / wall_seconds,
+        "latency_ms": percentiles([result["seconds"] * 1000 for result in ok])
+    }
+    if stream:
+        level["ttft_ms"] = percentiles([result["ttft_seconds"] * 1000 for result in ok
+                                        if result["ttft_seconds"] is not None])
+    if errors:
+        level["first_error"] = errors[0]
+    return level
+
+
+def compare_to_baseline(levels: List[Dict[str, Any]], baseline_path: str) -> List[Dict[str, Any]]:
+    """Relative change in latency percentiles and throughput against a previous results file."""
+    with open(baseline_path) as handle:
+        baseline = {level["concurrency"]: level for level in json.load(handle)["levels"]}
+    changes = []
+    for level in levels:
+        base = baseline.get(level["concurrency"])
+        if base is None or not base["latency_ms"] or not level["latency_ms"]:
+            continue
+        change = {"concurrency": level["concurrency"]}
+        for key in ("p50", "p95", "p99"):
+            change[f"{key}_change"] = level["latency_ms"][key] / base["latency_ms"][key] - 1
+        change["throughput_change"] = level["throughput_rps"] / base["throughput_rps"] - 1
+        changes.append(change)
+    return changes
+
+
+def print_report(levels: List[Dict[str, Any]]):
+    print(f"\n{'conc':>5}{'reqs':>6}{'err':>5}{'req/s':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for level in levels:
+        latency = level["latency_ms"]
+        if not latency:
+            print(f"{level['concurrency']:>5}{level['requests']:>6}{level['errors']:>5}  all requests failed")
+            continue
+        print(f"{level['concurrency']:>5}{level['requests']:>6}{level['errors']:>5}{level['throughput_rps']:>8.2f}"
+              f"{latency['p50']:>8.0f}ms{latency['p95']:>8.0f}ms{latency['p99']:>8.0f}ms")
+
+    for level in levels:
+        print(f"\nStages at concurrency {level['concurrency']}:")
+        print(f"  {'stage':<24}{'count':>7}{'mean':>11}{'per request':>14}")
+        for stage, timing in sorted(level["stages"].items(), key=lambda item: -item[1]["ms_per_request"]):
+            print(f"  {stage:<24}{timing['count']:>7}{timing['mean_ms']:>9.1f}ms{timing['ms_per_request']:>12.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("local", "postgres"), default="local")
+    parser.add_argument("--store-dir", help="local store directory (default: a new temporary directory)")
+    parser.add_argument("--corpus", default="synthetic", help='"synthetic" or a directory of documents to ingest')
+    parser.add_argument("--docs", type=int, default=200, help="synthetic documents")
+    parser.add_argument("--chunks-per-doc", type=int, default=5)
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--concurrency", default="1,4,8", help="comma separated levels")
+    parser.add_argument("--requests", type=int, default=48, help="requests per level")
+    parser.add_argument("--warmup-requests", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="drive /query/stream and record time to first token")
+    parser.add_argument("--caches", action="store_true", help="leave the answer and rerank caches on")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="stub LLM output rate")
+    parser.add_argument("--first-token-ms", type=float, default=150.0, help="stub LLM delay before the first token")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=900, help="seconds to wait for warm-up")
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float,
+                        help="exit with status 1 if p95 latency at any level is this fraction slower than the baseline")
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub_ollama(tokens_per_second=args.tokens_per_second,
+                                       first_token_ms=args.first_token_ms, answer_length=args.answer_tokens)
+    print(f"Stub Ollama on {stub_url}")
+
+    temp_dir = None
+    settings = {
+        "OLLAMA_HOST": stub_url,
+        "VECTOR_BACKEND": args.backend,
+        "TELEMETRY_ENABLED": "true",
+        "STARTUP_WARMUP": "true"
+    }
+    if args.backend == "local":
+        if args.store_dir is None:
+            temp_dir = tempfile.TemporaryDirectory(prefix="query-benchmark-")
+        settings["LOCAL_STORE_DIR"] = args.store_dir or temp_dir.name
+    if not args.caches:
+        settings.update(ANSWER_CACHE_ENABLED="false", RERANKER_CACHE_SIZE="0")
+    os.environ.update(settings)
+
+    print(f"Loading the {args.corpus} corpus into the {args.backend} store")
+    # spawn: the child imports VectorTools fresh, with the settings above
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        corpus = pool.submit(load_corpus, args.corpus, args.docs, args.chunks_per_doc, args.chunk_words).result()
+    print(f"Corpus: {corpus['chunks']} chunks, {corpus['documents_in_store']} in the store")
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(args.port)],
+        cwd=SCRIPT_DIR, env=dict(os.environ)
+    )
+    levels = []
+    try:
+        print("Waiting for the API to warm up")
+        wait_until_ready(base_url, server, args.ready_timeout)
+        if args.warmup_requests:
+            run_level(base_url, 1, args.warmup_requests, args.stream, args.request_timeout)
+
+        for concurrency in [int(n) for n in args.concurrency.split(",")]:
+            print(f"Concurrency {concurrency}: {args.requests} requests")
+            before = stage_totals(base_url)
+            level = run_level(base_url, concurrency, args.requests, args.stream, args.request_timeout,
+                              offset=len(levels))
+            level["stages"] = stage_breakdown(before, stage_totals(base_url), args.requests)
+            levels.append(level)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        stub.shutdown()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    print_report(levels)
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": vars(args),
+        "settings": settings,
+        "corpus": corpus,
+        "stub_llm_requests": stub.stub.requests,
+        "levels": levels
+    }
+
+    regressed = False
+    if args.baseline:
+        results["baseline"] = args.baseline
+        results["comparison"] = compare_to_baseline(levels, args.baseline)
+        print(f"\nAgainst {args.baseline}:")
+        for change in results["comparison"]:
+            print(f"  concurrency {change['concurrency']}: p50 {change['p50_change']:+.1%}, "
+                  f"p95 {change['p95_change']:+.1%}, p99 {change['p99_change']:+.1%}, "
+                  f"throughput {change['throughput_change']:+.1%}")
+            if args.max_regression is not None and change["p95_change"] > args.max_regression:
+                regressed = True
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+        print(f"Results written to {args.output}")
+    if regressed:
+        print(f"p95 latency regressed by more than {args.max_regression:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
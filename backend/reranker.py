@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+from telemetry import count, observe, run_in_context
+
+# Rough upper bound on characters per token, used to trim text before tokenizing
+CHARS_PER_TOKEN = 6
+
+
+class CrossEncoderReranker:
+    """
+    Re-rank candidates with a local cross-encoder (e.g. BAAI/bge-reranker-base).
+
+    All uncached (query, chunk) pairs are scored in one batched forward pass,
+    each truncated to max_tokens. Scores are cached per (query, chunk id).
+    Passes run one at a time. A pass that hasn't started within latency_budget
+    seconds is cancelled, and one that has started gets latency_budget seconds
+    of its own to finish; either way the fallback ranking is returned instead.
+    A started pass keeps running in the background and its scores land in the
+    cache for the next time the question is asked.
+    """
+
+    def __init__(self, model_id: str, max_tokens: int = 512, latency_budget: float = 1.5, cache_size: int = 4096):
+        self.model_id = model_id
+        self.max_tokens = max_tokens
+        self.latency_budget = latency_budget
+        self.cache_size = cache_size
+        self.model = None
+        self.fallbacks = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        # One scoring pass at a time; a pass that overran its budget delays the next
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    def load(self):
+        """Load the cross-encoder (done on first use if not called earlier)."""
+        with self._model_lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+
+                load_start = time.time()
+                self.model = CrossEncoder(self.model_id, max_length=self.max_tokens)
+                observe("rerank_model_load", time.time() - load_start)
+        return self.model
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]],
+               fallback: Callable[[str, List[Dict[str, Any]]], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Return candidates sorted by cross-encoder score, stored in each as "final_score"."""
+        if not candidates:
+            return candidates
+
+        query_key = " ".join(query.lower().split())
+        scores = {}
+        with self._lock:
+            for candidate in candidates:
+                key = (query_key, candidate["id"])
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[candidate["id"]] = self._cache[key]
+
+        uncached = [candidate for candidate in candidates if candidate["id"] not in scores]
+        if uncached:
+            started = threading.Event()
+            future = self._executor.submit(run_in_context(self._score, query, query_key, uncached, started))
+            try:
+                # The budget covers scoring, not the wait behind other requests' passes
+                if not started.wait(timeout=self.latency_budget) and future.cancel():
+                    self.fallbacks += 1
+                    count("rerank_queue_timeout")
+                    print(f"Reranker busy for {self.latency_budget:.2f}s, using fallback ranking")
+                    return fallback(query, candidates)
+                scores.update(future.result(timeout=self.latency_budget))
+            except FutureTimeoutError:
+                self.fallbacks += 1
+                count("rerank_timeout")
+                print(f"Reranker exceeded its {self.latency_budget:.2f}s budget, using fallback ranking")
+                return fallback(query, candidates)
+            except Exception as e:
+                self.fallbacks += 1
+                count("rerank_error")
+                print(f"Reranker failed ({e}), using fallback ranking")
+                return fallback(query, candidates)
+
+        for candidate in candidates:
+            candidate["final_score"] = scores[candidate["id"]]
+        return sorted(candidates, key=lambda x: x["final_score"], reverse=True)
+
+    def _score(self, query: str, query_key: str, candidates: List[Dict[str, Any]],
+               started: Optional[threading.Event] = None) -> Dict[Any, float]:
+        if started is not None:
+            started.set()
+        model = self.load()
+        # Trim long chunks before tokenizing; the tokenizer then cuts to max_tokens exactly
+        max_chars = self.max_tokens * CHARS_PER_TOKEN
+        pairs = [(query, candidate["content"][:max_chars]) for candidate in candidates]
+
+        score_start = time.time()
+        raw_scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        observe("rerank_score", time.time() - score_start)
+
+        scores = {candidate["id"]: float(score) for candidate, score in zip(candidates, raw_scores)}
+        with self._lock:
+            for doc_id, score in scores.items():
+                self._cache[(query_key, doc_id)] = score
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+
+def create_reranker(name: str, model_id: str, max_tokens: int, latency_budget: float,
+                    cache_size: int) -> Optional[CrossEncoderReranker]:
+    """
+    Build the configured reranker. "heuristic" (or anything unrecognised)
+    returns None, which leaves VectorDB on its built-in keyword heuristic.
+    """
+    if name == "cross-encoder":
+        return CrossEncoderReranker(model_id, max_tokens=max_tokens, latency_budget=latency_budget, cache_size=cache_size)
+    if name != "heuristic":
+        print(f"Unknown reranker {name!r}, using the heuristic reranker")
+    return None
@@ -4,6 +4,11 @@ import time
 import os
 import datetime
 import re
+import threading
+import asyncio
+import json
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from langchain_community.llms import Ollama
 from langchain_core.prompts import PromptTemplate
@@ -11,42 +16,72 @@ from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, AsyncIterator
 from pydantic import Field
 
-from VectorTools import VectorDB
+from VectorTools import VectorDB, CONN_PARAMS, DB_POOL_MAX, SPARSE_AUTO_BACKFILL, get_query_encoding, embedding_runtime
+from answer_cache import AnswerCache
+from language_id import identify_language
+from telemetry import span, observe, count, annotate, run_in_context
 
 # Load environment variables from .env file
 load_dotenv()
-POSTGRESPASS = os.environ.get("POSTGRESPASS")
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "qwen3:4b")
+OLLAMA_WARMUP_TIMEOUT = float(os.environ.get("OLLAMA_WARMUP_TIMEOUT", 300))  # seconds to load the model
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", 2))
+# Below this confidence the local language identifier defers to the LLM
+LANGUAGE_ID_THRESHOLD = float(os.environ.get("LANGUAGE_ID_THRESHOLD", 0.99))
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# "postgres" (pgvector) or "local" (in-process store, see local_vector_db.py)
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "postgres")
 
-# Connection parameters
-CONN_PARAMS = {
-    "host": "localhost",
-    "port": 5432,
-    "database": "postgres",
-    "user": "postgres",
-    "password": POSTGRESPASS
-}
+# Blocking work is pushed onto these so the event loop stays free.
+# Embedding is CPU-bound, so it gets a small pool; DB calls match the connection pool.
+EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="vectordb")
 
 # Initialize global variables
 vector_db = None
+_vector_db_lock = threading.Lock()
+_components_lock = None
+
+# Answers to repeated (or near-duplicate) questions
+answer_cache = AnswerCache(
+    max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", 512)),
+    ttl_seconds=float(os.environ.get("ANSWER_CACHE_TTL", 3600)),
+    similarity_threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+)
 llm = None
 PROMPT = None
 SPANISH_PROMPT = None
 LANGUAGE_DETECT_PROMPT = None
+TRANSLATE_PROMPT = None
+
+def get_vector_db() -> VectorDB:
+    """Return the process-wide VectorDB for VECTOR_BACKEND, opening it on first use."""
+    global vector_db
+    if vector_db is None:
+        with _vector_db_lock:
+            if vector_db is None:
+                if VECTOR_BACKEND == "local":
+                    from local_vector_db import LocalVectorDB
+                    vector_db = LocalVectorDB()
+                else:
+                    vector_db = VectorDB(CONN_PARAMS)
+    return vector_db
 
 def initialize_components():
     start_time = time.time()
-    global vector_db, llm, PROMPT, LANGUAGE_DETECT_PROMPT, SPANISH_PROMPT
+    global llm, PROMPT, LANGUAGE_DETECT_PROMPT, SPANISH_PROMPT, TRANSLATE_PROMPT
     
     # Initialize vector DB
-    vector_db = VectorDB(CONN_PARAMS)
+    get_vector_db()
 
     # Initialize LLM
     llm = Ollama(
-        model="qwen3:4b",
-        base_url="http://localhost:11434",
+        model=OLLAMA_MODEL,
+        base_url=OLLAMA_HOST,
         temperature=0.2,
         top_p=0.95
     )
@@ -134,8 +169,91 @@ def initialize_components():
         Text: {query}
         """
     )
-    end_time = time.time()
-    print(f"TIMING: initialize_components took {end_time - start_time:.4f} seconds")
+    # Define prompt for translating queries already identified as Spanish
+    TRANSLATE_PROMPT = PromptTemplate.from_template(
+        """Translate the following Spanish text to English.
+        Return only the English translation and nothing else.
+        
+        Text: {query}
+        """
+    )
+    observe("init_components", time.time() - start_time)
+
+async def ensure_components():
+    """Run initialize_components off the event loop the first time it is needed."""
+    global _components_lock
+    if vector_db is not None and llm is not None and PROMPT is not None:
+        return
+    if _components_lock is None:
+        _components_lock = asyncio.Lock()
+    async with _components_lock:
+        if vector_db is None or llm is None or PROMPT is None:
+            print("Initializing components")
+            await run_blocking(None, initialize_components)
+
+async def run_blocking(executor, func, *args, **kwargs):
+    """Await a blocking call on the given executor (None uses the loop default)."""
+    loop = asyncio.get_running_loop()
+    # Run in a copy of this context so spans recorded there join the request's trace
+    return await loop.run_in_executor(executor, run_in_context(func, *args, **kwargs))
+
+def _load_ollama_model():
+    """Ask Ollama to load OLLAMA_MODEL into memory (a generate request without a prompt)."""
+    request = urllib.request.Request(
+        f"{OLLAMA_HOST.rstrip('/')}/api/generate",
+        data=json.dumps({"model": OLLAMA_MODEL, "stream": False}).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=OLLAMA_WARMUP_TIMEOUT) as response:
+        response.read()
+
+async def _warm_embedder():
+    # A first forward pass also loads the sparse head and allocates the runtime's buffers
+    await run_blocking(EMBED_EXECUTOR, get_query_encoding, "Lamoni city council", get_vector_db().lexical_leg == "sparse")
+
+async def _start_sparse_backfill():
+    # Rows loaded before the sparse lexical leg existed; searches use fulltext until they're done
+    if SPARSE_AUTO_BACKFILL:
+        await run_blocking(DB_EXECUTOR, get_vector_db().start_sparse_backfill)
+
+async def _warm_reranker():
+    reranker = get_vector_db().reranker
+    if reranker is not None:
+        await run_blocking(None, reranker.load)
+
+async def _warm_ollama():
+    await run_blocking(None, _load_ollama_model)
+
+WARMUP_STEPS = (
+    ("components", ensure_components),
+    ("embedder", _warm_embedder),
+    ("sparse_backfill", _start_sparse_backfill),
+    ("reranker", _warm_reranker),
+    ("ollama", _warm_ollama),
+)
+
+async def warm_up(skip: Tuple[str, ...] = ()) -> Dict[str, Dict[str, Any]]:
+    """
+    Load everything the first query would otherwise wait for: the vector store and
+    its connection pool, the embedder, the reranker and the Ollama model.
+
+    Every step not in skip is attempted, even after one fails. Returns
+    {step: {"ok", "seconds", "error"}}.
+    """
+    results = {}
+    for name, step in WARMUP_STEPS:
+        if name in skip:
+            continue
+        step_start = time.time()
+        try:
+            await step()
+            results[name] = {"ok": True, "seconds": time.time() - step_start, "error": None}
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            results[name] = {"ok": False, "seconds": time.time() - step_start, "error": f"{type(e).__name__}: {e}"}
+    if "embedder" in results and results["embedder"]["ok"]:
+        results["embedder"]["runtime"] = embedding_runtime()
+    return results
 
 class SimpleRetriever(BaseRetriever):
     documents: List[Document] = Field(default_factory=list)
@@ -143,28 +261,51 @@ class SimpleRetriever(BaseRetriever):
     def _get_relevant_documents(self, query: str) -> List[Document]:
         return self.documents
 
-def detect_language_and_translate(query: str) -> List[str]:
+async def detect_language_and_translate(query: str) -> List[str]:
     """
     Detects if the query is in Spanish or English and translates if necessary.
     Returns a list where:
     - First element is "Spanish" or "English"
     - Second element is the English translation if Spanish, or the original query if English
+
+    The local n-gram identifier decides first. The LLM is only called to
+    translate confident Spanish, or to detect the language when the local
+    identifier isn't confident.
     """
     start_time = time.time()
-    global llm, LANGUAGE_DETECT_PROMPT
-    
-    # Initialize components if not already initialized
-    if llm is None or LANGUAGE_DETECT_PROMPT is None:
-        print("Initializing components in detect_language_and_translate")
-        initialize_components()
-    
-    # Ask LLM to detect language and translate if needed
+    await ensure_components()
+
+    language, confidence = identify_language(query)
+    if confidence >= LANGUAGE_ID_THRESHOLD and language == "English":
+        decision_path = "local"
+        result = ["English", query]
+    elif confidence >= LANGUAGE_ID_THRESHOLD and language == "Spanish":
+        decision_path = "local+llm-translate"
+        result = ["Spanish", await translate_to_english(query)]
+    else:
+        decision_path = "llm-detect"
+        result = await llm_detect_language_and_translate(query)
+
+    observe("language_detect", time.time() - start_time)
+    count(f"language_{decision_path}")
+    annotate(language=result[0], language_confidence=round(confidence, 4), language_path=decision_path)
+    print(f"Language ID: {language} (confidence {confidence:.4f}), path {decision_path}, result {result[0]}")
+    return result
+
+async def translate_to_english(query: str) -> str:
+    """Translate a Spanish query to English with the LLM."""
+    with span("llm_translate"):
+        response = await llm.ainvoke(TRANSLATE_PROMPT.format(query=query))
+
+    translation = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL).strip()
+    return translation or query
+
+async def llm_detect_language_and_translate(query: str) -> List[str]:
+    """Ask the LLM to detect the language and translate if needed."""
     language_prompt = LANGUAGE_DETECT_PROMPT.format(query=query)
     
-    llm_start = time.time()
-    response = llm.predict(language_prompt)
-    llm_end = time.time()
-    print(f"TIMING: Language detection LLM call took {llm_end - llm_start:.4f} seconds")
+    with span("llm_detect"):
+        response = await llm.ainvoke(language_prompt)
     
     # Parse the response
     language = "English"  # Default
@@ -178,127 +319,274 @@ def detect_language_and_translate(query: str) -> List[str]:
             if translation_text != "No translation needed":
                 translation = translation_text
     
-    end_time = time.time()
-    print(f"TIMING: detect_language_and_translate took {end_time - start_time:.4f} seconds")
     return [language, translation]
 
-async def process_query(query: str) -> Dict[str, Any]:
-    start_time = time.time()
-    global vector_db, llm, PROMPT
+class ThinkTagFilter:
+    """
+    Incrementally remove <think>...</think> blocks from streamed LLM output.
+
+    Text is released as soon as it can't be part of a tag, so only a partial
+    "<think>" or "</think>" at the end of a chunk is held back. Leading
+    whitespace before the first visible text is dropped, like the .strip()
+    applied to full answers.
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+        self.started = False
+
+    def feed(self, text: str) -> str:
+        """Consume the next chunk and return whatever is safe to show."""
+        self.buffer += text
+        output = []
+        while True:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = self.buffer.find(tag)
+            if index != -1:
+                if not self.in_think:
+                    output.append(self.buffer[:index])
+                self.buffer = self.buffer[index + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            # Hold back a suffix that might be the start of the tag
+            held = 0
+            for size in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if self.buffer.endswith(tag[:size]):
+                    held = size
+                    break
+            if not self.in_think:
+                output.append(self.buffer[:len(self.buffer) - held])
+            self.buffer = self.buffer[len(self.buffer) - held:]
+            break
+        return self._visible("".join(output))
+
+    def flush(self) -> str:
+        """Return any held-back text once the stream has ended."""
+        remaining = "" if self.in_think else self.buffer
+        self.buffer = ""
+        return self._visible(remaining)
+
+    def _visible(self, text: str) -> str:
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+async def retrieve_context(query: str, hybrid_ratio: float = None, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Run everything before answer generation: language detection, query
+    embedding and similarity search. Returns the language info, the English
+    search query, the query embedding, the retrieved Documents and their sources.
+
+    If a near-duplicate question is in the answer cache, the search is skipped
+    and its answer is returned under "cached" instead. Queries with their own
+    hybrid_ratio or search filters neither read nor fill the answer cache.
+    """
+    await ensure_components()
+    cache_generation = answer_cache.generation
+
+    # Detect language and translate if necessary
+    language_info = await detect_language_and_translate(query)
+    
+    # language_info[0] is "Spanish" or "English"
+    # language_info[1] is the translated query (or original if English)
+    
+    # Use the English query for vector search
+    search_query = language_info[1]
     
-    # Initialize components if not already initialized
-    if vector_db is None or llm is None or PROMPT is None:
-        print("Initializing components in process_query")
-        initialize_components()
+    # Embed the query (dense and, for the sparse lexical leg, sparse weights in one
+    # forward pass) on the embedding pool, then search on the DB pool
+    retrieve_start = time.time()
+    query_embedding, query_sparse = await run_blocking(
+        EMBED_EXECUTOR, get_query_encoding, search_query, vector_db.active_lexical_leg == "sparse"
+    )
+    cacheable = ANSWER_CACHE_ENABLED and hybrid_ratio is None and not filters
+    if cacheable:
+        cached = answer_cache.get_similar(query_embedding, language_info[0])
+        if cached is not None:
+            count("answer_cache_semantic_hit")
+            return {"cached": cached}
+    results = await run_blocking(DB_EXECUTOR, vector_db.similarity_search, search_query, k=3,
+                                query_embedding=query_embedding, query_sparse=query_sparse,
+                                hybrid_ratio=hybrid_ratio, filters=filters)
+    observe("retrieve", time.time() - retrieve_start)
     
+    # Extract sources from results to return later
+    sources = []
+    for result in results:
+        source_info = {
+            "heading": result['metadata'].get('heading', 'Unknown Title'),
+            "source": result['metadata'].get('source', 'None'),
+            "url": result['metadata'].get('url',None),
+            "page": result['metadata'].get('page', None)
+        }
+        sources.append(source_info)
+        if result['metadata'].get('source') == 'Enactus Room Dataset.md':
+            break
+
+    # Convert results to Document objects
+    documents = [Document(page_content=result['content'], metadata=result['metadata']) for result in results]
+
+    return {
+        "language_info": language_info,
+        "search_query": search_query,
+        "query_embedding": query_embedding,
+        "documents": documents,
+        "sources": sources,
+        "cache_generation": cache_generation,
+        "cacheable": cacheable
+    }
+
+def cache_answer(query: str, context: Dict[str, Any], result: Dict[str, Any]):
+    """Store a finished answer in the answer cache."""
+    if context["cacheable"]:
+        answer_cache.put(
+            query,
+            context["query_embedding"],
+            context["language_info"][0],
+            result,
+            generation=context["cache_generation"]
+        )
+
+def build_answer_chain(language: str):
+    """Create the stuff-documents answer chain for spanish or english."""
+    # Get current date for including in prompt
+    current_date = datetime.datetime.now().strftime("%A, %B %d, %Y")
+    prompt = SPANISH_PROMPT if language == "Spanish" else PROMPT
+    return create_stuff_documents_chain(llm, prompt.partial(current_date=current_date))
+
+async def process_query(query: str, hybrid_ratio: float = None, filters: Dict[str, Any] = None) -> Dict[str, Any]:
     try:
-        # Detect language and translate if necessary
-        lang_start = time.time()
-        language_info = detect_language_and_translate(query)
-        lang_end = time.time()
-        print(f"TIMING: Language detection and translation took {lang_end - lang_start:.4f} seconds")
-        print(language_info)
-        
-        # language_info[0] is "Spanish" or "English"
-        # language_info[1] is the translated query (or original if English)
-        
-        # Use the English query for vector search
-        search_query = language_info[1]
-        
-        # Get current date for including in prompt
-        current_date = datetime.datetime.now().strftime("%A, %B %d, %Y")
-        
-        # Perform similarity search
-        vector_start = time.time()
-        results = vector_db.similarity_search(search_query, k=3)
-        vector_end = time.time()
-        print(f"TIMING: Vector similarity search took {vector_end - vector_start:.4f} seconds")
-        
-        # Extract sources from results to return later
-        sources = []
-        for result in results:
-            if result['metadata'].get('source') == 'Enactus Room Dataset.md':
-                source_info = {
-                    "heading": result['metadata'].get('heading', 'Unknown Title'),
-                    "source": result['metadata'].get('source', 'None'),
-                    "url": result['metadata'].get('url',None),
-                    "page": result['metadata'].get('page', None)
-                }
-                sources.append(source_info)
-                break
-            else:
-                source_info = {
-                    "heading": result['metadata'].get('heading', 'Unknown Title'),
-                    "source": result['metadata'].get('source', 'None'),
-                    "url": result['metadata'].get('url',None),
-                    "page": result['metadata'].get('page', None)
-                }
-                sources.append(source_info)
-
-        # Convert results to Document objects
-        documents = [Document(page_content=result['content'], metadata=result['metadata']) for result in results]
+        use_cache = ANSWER_CACHE_ENABLED and hybrid_ratio is None and not filters
+        cached = answer_cache.get(query) if use_cache else None
+        if cached is None:
+            context = await retrieve_context(query, hybrid_ratio, filters)
+            cached = context.get("cached")
+        if cached is not None:
+            count("answer_cache_hit")
+            return dict(cached, cache="hit")
 
         # Create retrieval and response chain for spanish or english.
         llm_start = time.time()
-        if language_info[0] == 'English':
-            question_answer_chain = create_stuff_documents_chain(llm, PROMPT.partial(current_date=current_date))
-            retriever = SimpleRetriever(documents=documents)
-            rag_chain = create_retrieval_chain(
-                retriever=retriever,
-                combine_docs_chain=question_answer_chain
-            )
-            
-            # Get response using the English query
-            response = rag_chain.invoke({"input": search_query})
-
-            # Remove <think>...</think> content
-            if response.get("answer"):
-                response["answer"] = re.sub(r"<think>.*?</think>", "", response["answer"], flags=re.DOTALL).strip()
-
-            llm_end = time.time()
-            print(f"TIMING: LLM response generation took {llm_end - llm_start:.4f} seconds")
-            
-            end_time = time.time()
-            print(f"TIMING: Total process_query function took {end_time - start_time:.4f} seconds")
-            
-            return {
-                "answer": response["answer"],
-                "sources": sources,
-                "language_info": language_info
-            }
+        question_answer_chain = build_answer_chain(context["language_info"][0])
+        retriever = SimpleRetriever(documents=context["documents"])
+        rag_chain = create_retrieval_chain(
+            retriever=retriever,
+            combine_docs_chain=question_answer_chain
+        )
         
-        elif language_info[0] == "Spanish":
-            question_answer_chain = create_stuff_documents_chain(llm, SPANISH_PROMPT.partial(current_date=current_date))
-            retriever = SimpleRetriever(documents=documents)
-            rag_chain = create_retrieval_chain(
-                retriever=retriever,
-                combine_docs_chain=question_answer_chain
-            )
-            
-            # Get response using the English query
-            response = rag_chain.invoke({"input": search_query})
-
-            # Remove <think>...</think> content
-            if response.get("answer"):
-                response["answer"] = re.sub(r"<think>.*?</think>", "", response["answer"], flags=re.DOTALL).strip()
-
-            llm_end = time.time()
-            print(f"TIMING: LLM response generation took {llm_end - llm_start:.4f} seconds")
-            
-            end_time = time.time()
-            print(f"TIMING: Total process_query function took {end_time - start_time:.4f} seconds")
-
-            return {
-                "answer": response["answer"],
-                "sources": sources,
-                "language_info": language_info
-            }
-            # bruh
+        # Get response using the English query
+        response = await rag_chain.ainvoke({"input": context["search_query"]})
+
+        # Remove <think>...</think> content
+        if response.get("answer"):
+            response["answer"] = re.sub(r"<think>.*?</think>", "", response["answer"], flags=re.DOTALL).strip()
+
+        observe("llm", time.time() - llm_start)
+        
+        result = {
+            "answer": response["answer"],
+            "sources": context["sources"],
+            "language_info": context["language_info"]
+        }
+        cache_answer(query, context, result)
+        return dict(result, cache="miss")
     except Exception as e:
-        end_time = time.time()
-        print(f"TIMING: process_query function failed after {end_time - start_time:.4f} seconds")
+        count("query_error")
+        print(f"process_query failed: {e}")
         return {"error": str(e)}
 
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_query(query: str, hybrid_ratio: float = None,
+                       filters: Dict[str, Any] = None) -> AsyncIterator[str]:
+    """
+    Answer a query as a stream of server-sent events:
+    - sources: language info and sources, sent before generation starts
+    - token: each piece of visible answer text, with <think> blocks removed
+    - done: timing, including time to first token
+    - error: sent instead of the rest if anything fails
+    """
+    start_time = time.time()
+    first_model_token_time = None
+    first_token_time = None
+
+    try:
+        use_cache = ANSWER_CACHE_ENABLED and hybrid_ratio is None and not filters
+        cached = answer_cache.get(query) if use_cache else None
+        if cached is None:
+            context = await retrieve_context(query, hybrid_ratio, filters)
+            cached = context.get("cached")
+        if cached is not None:
+            count("answer_cache_hit")
+            yield format_sse("sources", {
+                "sources": cached["sources"],
+                "language_info": cached["language_info"]
+            })
+            yield format_sse("token", {"text": cached["answer"]})
+            end_time = time.time()
+            yield format_sse("done", {
+                "time_to_first_token": f"{end_time - start_time:.4f} seconds",
+                "total_time": f"{end_time - start_time:.4f} seconds",
+                "cache": "hit"
+            })
+            return
+
+        yield format_sse("sources", {
+            "sources": context["sources"],
+            "language_info": context["language_info"]
+        })
+
+        think_filter = ThinkTagFilter()
+        answer_parts = []
+        llm_start = time.time()
+        question_answer_chain = build_answer_chain(context["language_info"][0])
+        async for chunk in question_answer_chain.astream({
+            "input": context["search_query"],
+            "context": context["documents"]
+        }):
+            if first_model_token_time is None:
+                first_model_token_time = time.time()
+            text = think_filter.feed(chunk)
+            if text:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    observe("ttft", first_token_time - start_time)
+                answer_parts.append(text)
+                yield format_sse("token", {"text": text})
+
+        text = think_filter.flush()
+        if text:
+            if first_token_time is None:
+                first_token_time = time.time()
+            answer_parts.append(text)
+            yield format_sse("token", {"text": text})
+
+        cache_answer(query, context, {
+            "answer": "".join(answer_parts).strip(),
+            "sources": context["sources"],
+            "language_info": context["language_info"]
+        })
+
+        end_time = time.time()
+        observe("llm", end_time - llm_start)
+        yield format_sse("done", {
+            "time_to_first_token": f"{first_token_time - start_time:.4f} seconds" if first_token_time else None,
+            "time_to_first_model_token": f"{first_model_token_time - start_time:.4f} seconds" if first_model_token_time else None,
+            "total_time": f"{end_time - start_time:.4f} seconds",
+            "cache": "miss"
+        })
+    except Exception as e:
+        count("query_error")
+        print(f"stream_query failed: {e}")
+        yield format_sse("error", {"error": str(e)})
+
 if __name__ == "__main__":
     # Test the query processing
     process_start = time.time()
@@ -306,13 +594,13 @@ if __name__ == "__main__":
     # Test with an English query
     test_query = "Tell me about City Council"
     print(f"Testing with English query: {test_query}")
-    result = process_query(test_query)
+    result = asyncio.run(process_query(test_query))
     print(f"Language detection: {result.get('language_info', ['Unknown', ''])}")
     
     # Test with a Spanish query
     test_query_spanish = "Háblame del Concejo Municipal"
     print(f"Testing with Spanish query: {test_query_spanish}")
-    result_spanish = process_query(test_query_spanish)
+    result_spanish = asyncio.run(process_query(test_query_spanish))
     print(f"Language detection: {result_spanish.get('language_info', ['Unknown', ''])}")
     
     # Close connection
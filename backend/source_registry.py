@@ -0,0 +1,102 @@
+import csv
+import os
+import re
+import threading
+from typing import Dict, Optional
+
+
+def normalize_source(path: str) -> str:
+    """
+    Reduce a document path to the key used for URL lookups: its file name,
+    case-folded. Windows and POSIX separators are both handled, so
+    "c:\\Users\\...\\TempDocumentStore\\Report.pdf", "TempDocumentStore/report.pdf"
+    and "REPORT.pdf" all map to "report.pdf".
+    """
+    return re.split(r"[\\/]", path.strip())[-1].casefold()
+
+
+def source_name(path: str) -> str:
+    """The file name of a document path, with its original casing."""
+    return re.split(r"[\\/]", path.strip())[-1]
+
+
+class SourceRegistry:
+    """
+    Document name -> URL index built from the URL CSV (URL in the first column,
+    document name in the second).
+
+    The CSV is parsed once and re-read only when its mtime changes. When a
+    VectorDB is attached, entries are also kept in its sources table: CSV rows
+    are upserted there on each reload, and URLs registered only in the table
+    are served too.
+    """
+
+    def __init__(self, csv_file: str):
+        self.csv_file = csv_file
+        self.vector_db = None
+        self._urls = {}
+        self._csv_mtime = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def attach(self, vector_db):
+        """Back the registry with vector_db's sources table."""
+        with self._lock:
+            if self.vector_db is vector_db:
+                return
+            self.vector_db = vector_db
+            self._loaded = False  # force a reload that includes the table
+
+    def lookup(self, document_name: str) -> Optional[str]:
+        """Return the URL for a document name or path, or None."""
+        if not document_name:
+            return None
+        self._refresh()
+        return self._urls.get(normalize_source(document_name))
+
+    def register(self, document_name: str, url: str):
+        """Add or replace one entry, persisting it when a sources table is attached."""
+        with self._lock:
+            self._urls[normalize_source(document_name)] = url
+            if self.vector_db is not None:
+                self.vector_db.upsert_sources({normalize_source(document_name): url})
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._urls)
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.csv_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._loaded and mtime == self._csv_mtime:
+            return
+
+        with self._lock:
+            if self._loaded and mtime == self._csv_mtime:
+                return
+            csv_urls = self._read_csv() if mtime is not None else {}
+            urls = {}
+            if self.vector_db is not None:
+                if csv_urls:
+                    self.vector_db.upsert_sources(csv_urls)
+                urls.update(self.vector_db.load_sources())
+            urls.update(csv_urls)
+            self._urls = urls
+            self._csv_mtime = mtime
+            self._loaded = True
+            print(f"Loaded {len(urls)} source URLs")
+
+    def _read_csv(self) -> Dict[str, str]:
+        urls = {}
+        try:
+            with open(self.csv_file, newline="", encoding="utf-8-sig") as handle:
+                reader = csv.reader(handle)
+                next(reader, None)  # header row
+                for row in reader:
+                    if len(row) >= 2 and row[0].strip() and row[1].strip():
+                        urls[normalize_source(row[1])] = row[0].strip()
+        except Exception as e:
+            print(f"Error: {e}")
+        return urls
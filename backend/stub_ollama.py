@@ -0,0 +1,184 @@
+"""
+A stand-in for the Ollama server, for benchmarks and offline development.
+
+It answers /api/generate the way Ollama does (newline-delimited JSON chunks
+when streaming, one JSON object otherwise) but with canned text at a fixed
+rate, so query latency can be measured without a GPU and without the LLM's
+own variance:
+
+    python stub_ollama.py --port 11435 --tokens-per-second 40 --first-token-ms 150
+    OLLAMA_HOST=http://localhost:11435 uvicorn api:app
+
+Language detection and translation prompts get short answers in the format
+retrieve.py parses; every other prompt gets answer_tokens tokens of markdown.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Tuple
+
+ANSWER_TEXT = (
+    "## Lamoni\n\nLamoni is a small town in **Decatur County**, Iowa. "
+    "Based on the documents I have, here is what I found:\n\n"
+    "- The city council meets on the first and third Monday of each month.\n"
+    "- The farmers market is open on Saturday mornings from June through September.\n"
+    "- Graceland University hosts concerts, lectures and sporting events during the school year.\n\n"
+    "If you have any more questions, let me know!"
+)
+
+
+def answer_tokens(count: int) -> List[str]:
+    """count tokens of ANSWER_TEXT (words with their trailing space), repeating it as needed."""
+    words = re.findall(r"\S+\s*", ANSWER_TEXT)
+    return [words[i % len(words)] for i in range(count)]
+
+
+class StubOllama:
+    """The canned responses and their timing."""
+
+    def __init__(self, tokens_per_second: float = 40.0, first_token_ms: float = 150.0, answer_length: int = 120,
+                 model: str = "stub"):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_seconds = first_token_ms / 1000
+        self.answer = answer_tokens(answer_length)
+        self.model = model
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def reply(self, prompt: str) -> List[str]:
+        if "Determine if the following text is in Spanish or English" in prompt:
+            return ["Language: ", "English\n", "Translation: ", "No ", "translation ", "needed"]
+        if prompt.startswith("Translate the following Spanish text to English"):
+            text = prompt.rsplit("Text:", 1)[-1].strip()
+            return re.findall(r"\S+\s*", text) or [text]
+        return self.answer
+
+    def generate(self, prompt: str) -> Iterator[Tuple[str, float]]:
+        """Yield (token, seconds to wait before sending it)."""
+        with self._lock:
+            self.requests += 1
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i, token in enumerate(self.reply(prompt)):
+            yield token, self.first_token_seconds if i == 0 else interval
+
+
+def _chunk(model: str, response: str, done: bool, **extra) -> bytes:
+    chunk = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+             "response": response, "done": done}
+    chunk.update(extra)
+    return (json.dumps(chunk) + "\n").encode("utf-8")
+
+
+def make_handler(stub: StubOllama):
+    class StubOllamaHandler(BaseHTTPRequestHandler):
+        # HTTP/1.0: the streamed body ends when the connection closes, no chunked encoding needed
+        protocol_version = "HTTP/1.0"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status: int = 200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": stub.model, "model": stub.model}]})
+            elif self.path == "/api/version":
+                self._send_json({"version": "0.0.0-stub"})
+            elif self.path == "/":
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.end_headers()
+                self.wfile.write(b"Ollama is running")
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            if self.path != "/api/generate":
+                self._send_json({"error": "not found"}, status=404)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            model = request.get("model", stub.model)
+            prompt = request.get("prompt") or ""
+            start = time.perf_counter()
+
+            # A request without a prompt just loads the model
+            if not prompt:
+                self._send_json({"model": model, "response": "", "done": True, "done_reason": "load"})
+                return
+
+            if request.get("stream", True) is False:
+                tokens = []
+                for token, delay in stub.generate(prompt):
+                    time.sleep(delay)
+                    tokens.append(token)
+                self._send_json({
+                    "model": model, "response": "".join(tokens), "done": True, "done_reason": "stop",
+                    "eval_count": len(tokens), "total_duration": int((time.perf_counter() - start) * 1e9)
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            count = 0
+            try:
+                for token, delay in stub.generate(prompt):
+                    time.sleep(delay)
+                    self.wfile.write(_chunk(model, token, False))
+                    self.wfile.flush()
+                    count += 1
+                self.wfile.write(_chunk(model, "", True, done_reason="stop", eval_count=count,
+                                        total_duration=int((time.perf_counter() - start) * 1e9)))
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up on the answer
+                pass
+
+    return StubOllamaHandler
+
+
+def start_stub_ollama(host: str = "127.0.0.1", port: int = 0, **stub_options) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Serve a StubOllama on a daemon thread. Port 0 picks a free port.
+
+    Returns:
+        The server (call shutdown() to stop it) and its base URL
+    """
+    stub = StubOllama(**stub_options)
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    server.stub = stub
+    threading.Thread(target=server.serve_forever, name="stub-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="0 streams as fast as possible")
+    parser.add_argument("--first-token-ms", type=float, default=150.0, help="delay before the first token (prefill)")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    args = parser.parse_args()
+
+    server, url = start_stub_ollama(args.host, args.port, tokens_per_second=args.tokens_per_second,
+                                    first_token_ms=args.first_token_ms, answer_length=args.answer_tokens)
+    print(f"Stub Ollama listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
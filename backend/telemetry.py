@@ -0,0 +1,245 @@
+"""
+Stage timings, counters and per-request traces.
+
+Spans time pipeline stages (language detection, embedding, SQL legs, rerank,
+LLM, ...) into a Prometheus histogram, and into the current request's trace
+when there is one:
+
+    with span("rerank"):
+        ...
+
+render_metrics() produces the Prometheus text exposition served at /metrics.
+A trace is started per HTTP request; its id travels in a context variable,
+so spans on executor threads need the context copied over (see run_in_context).
+With TELEMETRY_ENABLED=false, span() returns a shared no-op context manager
+and nothing is recorded.
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TELEMETRY_ENABLED = os.environ.get("TELEMETRY_ENABLED", "true").lower() == "true"
+# Print one JSON line per finished trace (request id, total and per-stage seconds, attributes)
+TRACE_LOG = os.environ.get("TRACE_LOG", "false").lower() == "true"
+
+# Seconds; spans range from sub-millisecond SQL to multi-second LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NOOP = nullcontext()
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label value tuple."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, the +Inf overflow, sum
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Dict[str, float]]:
+        """{label values: {"count", "sum"}} for every series."""
+        with self._lock:
+            return {labels: {"count": sum(counts), "sum": total} for labels, (counts, total) in self._series.items()}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += counts[-1]
+            series_labels = _format_labels(self.labelnames, labels)
+            inf_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{series_labels} {total}")
+            lines.append(f"{self.name}_count{series_labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label value tuple."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labelvalues: str):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        """{label values: value} for every series."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duration of query and ingestion pipeline stages.", ("stage",))
+REQUEST_SECONDS = Histogram("rag_request_seconds", "HTTP request duration, until the last byte is sent.",
+                            ("method", "route", "status"))
+EVENTS = Counter("rag_events_total", "Pipeline events such as cache hits, fallbacks and errors.", ("event",))
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, EVENTS)
+
+
+class Trace:
+    """The stages recorded while handling one request, and facts about it (see annotate)."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        self.name = name
+        self.id = trace_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.stages = []
+        self.attributes = {}
+
+    def summary(self) -> Dict[str, Any]:
+        stages = {}
+        for stage, seconds in list(self.stages):
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "seconds": time.perf_counter() - self.started,
+            "stages": stages,
+            "attributes": dict(self.attributes)
+        }
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+# What start_trace returns when telemetry is off; nothing is ever recorded into it
+_NOOP_TRACE = Trace("", trace_id="")
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def span(stage: str):
+    """Context manager timing one stage (a no-op when telemetry is off)."""
+    if not TELEMETRY_ENABLED:
+        return _NOOP
+    return _Span(stage)
+
+
+def observe(stage: str, seconds: float):
+    """Record a stage duration measured by the caller, e.g. time to first token."""
+    if not TELEMETRY_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages.append((stage, seconds))
+
+
+def count(event: str, amount: float = 1):
+    if TELEMETRY_ENABLED:
+        EVENTS.inc(amount, event)
+
+
+def annotate(**attributes):
+    """Attach attributes (e.g. the detected language) to the current request's trace, if any."""
+    if not TELEMETRY_ENABLED:
+        return
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def start_trace(name: str, trace_id: Optional[str] = None) -> Trace:
+    """
+    Start a trace and make it current for this context (and tasks created from
+    it). With telemetry off, returns a shared no-op trace and sets nothing.
+    """
+    if not TELEMETRY_ENABLED:
+        return _NOOP_TRACE
+    trace = Trace(name, trace_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace, method: str, route: str, status: int) -> Dict[str, Any]:
+    """Record a finished request trace and return its summary (empty for the no-op trace)."""
+    if trace is _NOOP_TRACE:
+        return {}
+    summary = trace.summary()
+    REQUEST_SECONDS.observe(summary["seconds"], method, route, str(status))
+    if TRACE_LOG:
+        print(json.dumps(dict(summary, route=route, status=status)))
+    return summary
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.id if trace is not None else None
+
+
+def run_in_context(func: Callable, *args, **kwargs) -> Callable[[], Any]:
+    """
+    Bind func to a copy of the current context, for handing to a thread pool,
+    so spans it records land in the caller's trace.
+    """
+    context = contextvars.copy_context()
+    return lambda: context.run(func, *args, **kwargs)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"